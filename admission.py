@@ -0,0 +1,71 @@
+"""
+Request-level admission control.
+
+Each worker process admits at most `max_inflight` search requests at a time.
+A request arriving when every slot is taken waits up to `max_wait_ms` for one
+to free up and is then rejected, so overload turns into fast 503s instead of
+an ever-growing backlog of threads waiting on the model.
+"""
+import threading
+from contextlib import contextmanager
+
+from config import Config
+
+
+class OverloadedError(Exception):
+    """Raised when a request cannot be admitted in time and should be shed."""
+
+
+class AdmissionController:
+    """
+    Bounded count of in-flight requests.
+
+    Args:
+        max_inflight: Requests served at once (default: Config.MAX_INFLIGHT_REQUESTS)
+        max_wait_ms: How long a request may wait for a slot
+                     (default: Config.ADMISSION_WAIT_MS)
+    """
+
+    def __init__(self, max_inflight=None, max_wait_ms=None):
+        self.max_inflight = max_inflight or Config.MAX_INFLIGHT_REQUESTS
+        self.max_wait = (Config.ADMISSION_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+        self._slots = threading.BoundedSemaphore(self.max_inflight)
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold one request slot for the duration of the block.
+
+        Raises:
+            OverloadedError: If no slot frees up within max_wait_ms
+        """
+        if not self._slots.acquire(timeout=self.max_wait):
+            with self._lock:
+                self.rejected += 1
+            raise OverloadedError(f"{self.max_inflight} requests already in flight")
+        with self._lock:
+            self.inflight += 1
+            self.admitted += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.inflight -= 1
+            self._slots.release()
+
+    def stats(self):
+        return {
+            'inflight': self.inflight,
+            'max_inflight': self.max_inflight,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+        }
+
+
+# Created unused in a preloading gunicorn master, so each forked worker
+# starts with all of its slots free
+admission = AdmissionController()
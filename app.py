@@ -1,21 +1,112 @@
-from flask import Flask, request, render_template_string, jsonify, flash
-from werkzeug.utils import secure_filename
+from flask import (Flask, Request, Response, g, request, render_template_string, jsonify, flash, stream_with_context,
+                   url_for)
+import base64
+import binascii
+import io
 import os
-import tempfile
 import traceback
 import json
 import time
+from contextlib import ExitStack
 from datetime import datetime
-from query_pinecone import query_image_unique_addresses
+from config import Config
+import model_loader
+from admission import OverloadedError, admission
+from batching import QueueFullError, get_scheduler
+from jobs import cancel_job, get_job_runner, get_job_store, job_summary, submit_job
+from metrics import registry
+from query_pinecone import (FUSION_METHODS, batch_executor, cache_stats, check_views, fetch_image_url,
+                            near_duplicate_cache, query_image_unique_addresses, query_images_fused,
+                            query_images_unique_addresses, read_image_bytes, search_image_stages)
+from rerank import check_rerank_backend, get_reranker
+from shards import configured_shards, coverage_label
+from vector_store import get_routed_store, store_info
+
+class InMemoryRequest(Request):
+    """
+    Keep uploaded files in memory instead of spooling large ones to a temp file.
+    Job archives are the exception: they may be far larger than
+    MAX_CONTENT_LENGTH and spool to disk.
+    """
+    
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'create_job':
+            return Config.JOBS_MAX_UPLOAD_MB * 1024 * 1024
+        return super().max_content_length
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint == 'create_job':
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        # Bounded by MAX_CONTENT_LENGTH
+        return io.BytesIO()
 
 app = Flask(__name__)
+app.request_class = InMemoryRequest
 app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 # File upload settings
-UPLOAD_FOLDER = tempfile.gettempdir()
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'gif'}
 
+# Fail at boot rather than on the first close call
+check_rerank_backend()
+
+if Config.MODEL_PRELOAD:
+    # Under gunicorn preload_app this runs once in the master; workers share
+    # the weights copy-on-write and warm up in the post_fork hook.
+    model_loader.get_model()
+
+# --- Metrics (served on /metrics) ---
+REQUESTS = registry.counter('http_requests_total', "HTTP requests by route and status code",
+                            ('endpoint', 'status'))
+REQUEST_SECONDS = registry.histogram('http_request_duration_seconds', "HTTP request latency by route",
+                                     ('endpoint',))
+STAGE_SECONDS = registry.histogram('search_stage_duration_seconds', "Time spent in each search stage",
+                                   ('stage',))
+SEARCH_ERRORS = registry.counter('search_errors_total', "Failed searches: overloaded (shed) or error",
+                                 ('kind',))
+registry.gauge('model_load_seconds', "Time taken to load the model", lambda: model_loader.load_seconds)
+registry.gauge('model_ready', "1 once the model is loaded and warmed up", lambda: int(model_loader.is_ready()))
+registry.gauge('inference_queue_depth', "Images waiting for a forward pass", lambda: get_scheduler().queue_depth())
+registry.counter('inference_batches_total', "Forward passes run", fn=lambda: get_scheduler().batches_run)
+registry.counter('inference_images_total', "Images embedded", fn=lambda: get_scheduler().images_run)
+registry.gauge('cache_hit_ratio', "Hit ratio per cache level",
+               lambda: {name: stats['hit_ratio'] for name, stats in (cache_stats() or {}).items()}, ('cache',))
+registry.gauge('cache_entries', "Entries per cache level",
+               lambda: {name: stats['entries'] for name, stats in (cache_stats() or {}).items()}, ('cache',))
+registry.gauge('near_duplicate_threshold', "Hamming distance under which two photos share an embedding",
+               lambda: Config.NEAR_DUPLICATE_THRESHOLD if near_duplicate_cache is not None else None)
+registry.gauge('admission_inflight', "Search requests being served", lambda: admission.inflight)
+registry.counter('admission_rejected_total', "Search requests shed by admission control",
+                 fn=lambda: admission.rejected)
+registry.gauge('index_vectors', "Vectors in the live index", lambda: store_info()['total_vectors'])
+registry.gauge('index_version', "Version of the live local index", lambda: store_info()['version'])
+registry.counter('rerank_outcomes_total', "Searches per re-ranking outcome", ('outcome',),
+                 fn=lambda: dict(get_reranker().counts) if Config.RERANK_ENABLED else None)
+
+@app.before_request
+def start_timer():
+    g.start_time = time.perf_counter()
+    g.timings = None
+
+@app.after_request
+def record_request(response):
+    elapsed = time.perf_counter() - g.get('start_time', time.perf_counter())
+    endpoint = request.endpoint or 'unknown'
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+    timings = g.get('timings')
+    if timings:
+        for stage, seconds in timings.items():
+            STAGE_SECONDS.observe(seconds, stage=stage)
+        if Config.SERVER_TIMING:
+            response.headers['Server-Timing'] = ", ".join(
+                [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+                + [f"total;dur={elapsed * 1000:.1f}"]
+            )
+    return response
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -77,6 +168,16 @@ HTML_TEMPLATE = '''
             margin-bottom: 30px;
         }
         
+        .shard-select {
+            display: block;
+            margin: 0 auto 16px;
+            padding: 10px 14px;
+            border: 1px solid #d1d5db;
+            border-radius: 10px;
+            font-size: 1rem;
+            color: #374151;
+        }
+        
         .upload-btn {
             background: #6c63ff;
             color: #fff;
@@ -210,6 +311,16 @@ HTML_TEMPLATE = '''
             border-left: 4px solid #dc2626;
         }
         
+        .progress {
+            background: #eef2ff;
+            color: #3730a3;
+            padding: 16px;
+            border-radius: 12px;
+            margin: 20px 0;
+            font-weight: 500;
+            border-left: 4px solid #5b5be6;
+        }
+        
         .success {
             background: #d1fae5;
             color: #065f46;
@@ -293,20 +404,32 @@ HTML_TEMPLATE = '''
     
     <div class="container">
         <div class="title">🔍 Recherche d'adresse par image</div>
-        <div class="subtitle">Téléchargez une photo d'immeuble pour retrouver l'adresse. Disponible pour Paris 18</div>
+        <div class="subtitle">Téléchargez une ou plusieurs photos d'un immeuble pour retrouver l'adresse. Disponible pour {{ coverage }}</div>
+        {% if total_vectors %}
+            <div class="subtitle stats-text">{{ total_vectors }} photos indexées{% if index_version %} (version {{ index_version }}){% endif %}</div>
+        {% endif %}
         
         <div class="upload-section">
             <form id="upload-form" method="post" enctype="multipart/form-data">
-                <input type="file" name="file" id="file-input" class="file-input" accept="image/*" required>
+                {% if shards %}
+                    <select name="arrondissement" class="shard-select">
+                        <option value="">Tous les arrondissements</option>
+                        {% for name, label in shards %}
+                            <option value="{{ name }}">{{ label }}</option>
+                        {% endfor %}
+                    </select>
+                {% endif %}
+                <input type="file" name="file" id="file-input" class="file-input" accept="image/*" multiple required>
                 <label for="file-input" class="upload-btn">
                     <svg fill="none" stroke="currentColor" stroke-width="2" viewBox="0 0 24 24">
                         <path stroke-linecap="round" stroke-linejoin="round" d="M4 16v2a2 2 0 002 2h12a2 2 0 002-2v-2M7 10l5-5m0 0l5 5m-5-5v12"/>
                     </svg>
-                    Choisir une image
+                    Choisir une ou plusieurs images
                 </label>
             </form>
         </div>
         
+        <div id="results">
         {% if error %}
             <div class="error">{{ error }}</div>
         {% endif %}
@@ -324,7 +447,11 @@ HTML_TEMPLATE = '''
                             <span class="result-number">{{ loop.index }}</span>
                             <div>
                                 <div class="result-address">{{ result.address }}</div>
-                                <div class="result-score">Score de confiance: {{ "%.2f"|format(result.score * 100) }}%</div>
+                                {% if result.confidence is defined %}
+                                <div class="result-score">Confiance: {{ "%.1f"|format(result.confidence * 100) }}%</div>
+                                {% else %}
+                                <div class="result-score">Score de similarité: {{ "%.2f"|format(result.score * 100) }}%</div>
+                                {% endif %}
                                 <div class="result-maps">
                                     <span class="maps-link">
                                         <svg width="16" height="16" viewBox="0 0 24 24" fill="currentColor">
@@ -340,82 +467,227 @@ HTML_TEMPLATE = '''
             </div>
             
             <div class="stats">
+                {% if processing_time is not none %}
+                    <div class="stats-text">Analyse effectuée en {{ processing_time }} s</div>
+                {% endif %}
                 <div class="stats-text">
                     L'adresse n'est pas la bonne? Votre image doit avoir une résolution suffisamment bonne et peu d'éléments parasites au premier plan.
                 </div>
             </div>
         {% endif %}
+        </div>
     </div>
     
     <script>
         const form = document.getElementById('upload-form');
         const fileInput = document.getElementById('file-input');
         const loader = document.getElementById('loader');
+        const resultsBox = document.getElementById('results');
+        const streaming = window.fetch && window.ReadableStream && window.TextDecoder;
+        const MAPS_ICON = '<svg width="16" height="16" viewBox="0 0 24 24" fill="currentColor"><path d="M12 2C8.13 2 5 5.13 5 9c0 5.25 7 13 7 13s7-7.75 7-13c0-3.87-3.13-7-7-7zm0 9.5c-1.38 0-2.5-1.12-2.5-2.5s1.12-2.5 2.5-2.5 2.5 1.12 2.5 2.5-1.12 2.5-2.5 2.5z"/></svg>';
         
         form.addEventListener('submit', function() {
             loader.classList.add('active');
         });
         
         fileInput.addEventListener('change', function() {
-            loader.classList.add('active');
-            form.submit();
+            // One photo streams its results into the page; several are fused by a normal submit
+            if (fileInput.files.length === 1 && streaming) {
+                streamSearch(fileInput.files[0]);
+            } else {
+                loader.classList.add('active');
+                form.submit();
+            }
         });
         
         window.onload = function() {
             loader.classList.remove('active');
         };
+        
+        function element(tag, className, text) {
+            const node = document.createElement(tag);
+            if (className) node.className = className;
+            if (text !== undefined) node.textContent = text;
+            return node;
+        }
+        
+        function showStatus(text, className) {
+            let status = document.getElementById('live-status');
+            if (!status) {
+                status = element('div');
+                status.id = 'live-status';
+                resultsBox.prepend(status);
+            }
+            status.className = className || 'progress';
+            status.textContent = text;
+        }
+        
+        function renderResults(results) {
+            let section = document.getElementById('live-results');
+            if (!section) {
+                section = element('div', 'results-section');
+                section.id = 'live-results';
+                resultsBox.appendChild(section);
+            }
+            section.replaceChildren(element('div', 'results-title', '🏠 Adresses trouvées (' + results.length + ' plus similaires)'));
+            results.forEach(function(result, i) {
+                const link = element('a', 'result-link');
+                link.href = result.google_maps_url;
+                link.target = '_blank';
+                const item = element('div', 'result-item');
+                const body = element('div');
+                body.appendChild(element('div', 'result-address', result.address));
+                body.appendChild(element('div', 'result-score', result.confidence !== undefined
+                    ? 'Confiance: ' + (result.confidence * 100).toFixed(1) + '%'
+                    : 'Score de similarité: ' + (result.score * 100).toFixed(2) + '%'));
+                const maps = body.appendChild(element('div', 'result-maps')).appendChild(element('span', 'maps-link'));
+                maps.innerHTML = MAPS_ICON + ' Voir sur Google Maps';
+                item.appendChild(element('span', 'result-number', String(i + 1)));
+                item.appendChild(body);
+                link.appendChild(item);
+                section.appendChild(link);
+            });
+        }
+        
+        function handleEvent(kind, data) {
+            const seconds = (data.elapsed_ms / 1000).toFixed(2);
+            if (kind === 'received') {
+                showStatus('Photo reçue, analyse de l’image…');
+            } else if (kind === 'embedded') {
+                showStatus('Image analysée, recherche des adresses…');
+            } else if (kind === 'results' && data.stage === 'approximate') {
+                renderResults(data.results);
+                showStatus(data.results.length + ' adresses trouvées en ' + seconds + ' s, affinage en cours…');
+            } else if (kind === 'results') {
+                if (data.changed) renderResults(data.results);
+                showStatus(data.results.length
+                    ? 'Analyse terminée ! ' + data.results.length + ' adresses uniques trouvées en ' + seconds + ' s.'
+                    : 'Aucune adresse similaire trouvée dans la base de données.',
+                    data.results.length ? 'success' : 'error');
+            } else if (kind === 'error') {
+                showStatus('Erreur lors du traitement de l’image: ' + data.error, 'error');
+            }
+        }
+        
+        async function streamSearch(file) {
+            const data = new FormData();
+            data.append('file', file);
+            const arrondissement = form.querySelector('select[name="arrondissement"]');
+            if (arrondissement && arrondissement.value) data.append('shards', arrondissement.value);
+            resultsBox.replaceChildren();
+            showStatus('Envoi de la photo…');
+            
+            let response;
+            try {
+                response = await fetch('/api/search/stream', {method: 'POST', body: data});
+            } catch (e) {
+                loader.classList.add('active');
+                form.submit();
+                return;
+            }
+            if (!response.ok) {
+                const body = await response.json().catch(function() { return {}; });
+                showStatus(response.status === 503
+                    ? 'Le service est très sollicité, veuillez réessayer dans quelques instants.'
+                    : 'Erreur lors du traitement de l’image: ' + (body.error || response.status), 'error');
+                return;
+            }
+            
+            // Server-Sent Events over a POST body: blocks of "event:" and "data:" lines
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const chunk = await reader.read();
+                if (chunk.done) break;
+                buffer += decoder.decode(chunk.value, {stream: true});
+                let end;
+                while ((end = buffer.indexOf('\\n\\n')) >= 0) {
+                    let kind = 'message', payload = '';
+                    buffer.slice(0, end).split('\\n').forEach(function(line) {
+                        if (line.startsWith('event: ')) kind = line.slice(7);
+                        else if (line.startsWith('data: ')) payload += line.slice(6);
+                    });
+                    buffer = buffer.slice(end + 2);
+                    handleEvent(kind, JSON.parse(payload));
+                }
+            }
+        }
     </script>
 </body>
 </html>
 '''
 
+def index_info():
+    """Live vector and address counts and index version, or None if the store cannot be reached."""
+    try:
+        return store_info()
+    except Exception as e:
+        print(f"Could not read the index size: {e}")
+        return None
+
 @app.route('/', methods=['GET', 'POST'])
 def upload_file():
     results = None
     error = None
     success = None
-    total_vectors = "636,145"  # From your Pinecone index info
+    info = index_info()
+    total_vectors = f"{info['total_vectors']:,}" if info else None
     processing_time = None
+    status = 200
+    shards = configured_shards()
     
     if request.method == 'POST':
         try:
-            if 'file' not in request.files:
+            files = [f for f in request.files.getlist('file') if f.filename != '']
+            arrondissement = request.form.get('arrondissement') or None
+            if arrondissement not in (None, *shards):
+                arrondissement = None
+            if not files:
                 error = "Aucun fichier sélectionné."
             else:
-                file = request.files['file']
-                if file.filename == '':
-                    error = "Aucun fichier sélectionné."
-                elif not allowed_file(file.filename):
+                if not all(allowed_file(f.filename) for f in files):
                     error = "Format de fichier non supporté. Utilisez PNG, JPG, JPEG, BMP ou GIF."
+                elif len(files) > Config.SEARCH_MAX_IMAGES:
+                    error = f"Sélectionnez au plus {Config.SEARCH_MAX_IMAGES} images."
                 else:
-                    # Save file temporarily
-                    filename = secure_filename(file.filename)
-                    temp_path = os.path.join(UPLOAD_FOLDER, filename)
-                    file.save(temp_path)
-                    
                     try:
                         # Start timing
                         start_time = time.time()
                         
-                        # Process image and get 5 unique addresses
-                        results = query_image_unique_addresses(temp_path, top_k=5)
+                        # Decode straight from the upload stream and get 5 unique addresses
+                        timings = g.timings = {}
+                        with admission.slot():
+                            if len(files) == 1:
+                                results = query_image_unique_addresses(files[0].stream, top_k=5, timings=timings,
+                                                                       shards=arrondissement)
+                            else:
+                                # Several photos of the same building: one fused answer, scored
+                                # by the mean embedding so the confidence stays a cosine similarity
+                                results, _ = query_images_fused([f.stream for f in files], top_k=5,
+                                                                method='mean', timings=timings,
+                                                                shards=arrondissement)
                         
                         # Calculate processing time
                         processing_time = round(time.time() - start_time, 2)
+                        print(f"Processed upload in {processing_time}s ("
+                              + ", ".join(f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in timings.items())
+                              + ")")
                         
                         if results:
                             success = f"Analyse terminée ! {len(results)} adresses uniques trouvées."
                         else:
                             error = "Aucune adresse similaire trouvée dans la base de données."
                             
+                    except (QueueFullError, OverloadedError):
+                        error = "Le service est très sollicité, veuillez réessayer dans quelques instants."
+                        status = 503
+                        SEARCH_ERRORS.inc(kind='overloaded')
                     except Exception as e:
+                        SEARCH_ERRORS.inc(kind='error')
                         error = f"Erreur lors du traitement de l'image: {str(e)}"
                         print("Error processing image:", str(e))
                         print(traceback.format_exc())
-                    finally:
-                        # Clean up temp file
-                        if os.path.exists(temp_path):
-                            os.remove(temp_path)
                             
         except Exception as e:
             error = "Erreur lors du traitement de l'image."
@@ -427,7 +699,364 @@ def upload_file():
                                 error=error, 
                                 success=success,
                                 total_vectors=total_vectors,
-                                processing_time=processing_time)
+                                index_version=info['version'] if info else None,
+                                shards=[(name, coverage_label([name])) for name in shards],
+                                coverage=coverage_label(shards) if shards else "Paris 18",
+                                processing_time=processing_time), status
+
+def decode_base64_image(data):
+    """Decode a base64 image, with or without a data: URL prefix."""
+    if data.startswith('data:'):
+        data = data.partition(',')[2]
+    try:
+        return base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("Invalid base64 image")
+
+def load_api_image(item):
+    """
+    Resolve one JSON image item to encoded bytes.
+    
+    Args:
+        item: {"url": ...}, {"base64": ...} or a bare URL or base64 string
+    
+    Returns:
+        Encoded image bytes
+    """
+    if isinstance(item, dict):
+        if item.get('url'):
+            return fetch_image_url(item['url'])
+        if item.get('base64'):
+            return decode_base64_image(item['base64'])
+        raise ValueError("Image needs a 'url' or 'base64' field")
+    if isinstance(item, str):
+        if item.startswith(('http://', 'https://')):
+            return fetch_image_url(item)
+        return decode_base64_image(item)
+    raise ValueError("Image must be an object or a string")
+
+def api_error(message, status):
+    return jsonify({'error': message}), status
+
+@app.route('/api/search', methods=['POST'])
+def api_search():
+    """
+    Search several images in one request.
+    
+    Accepts either multipart files (any field name, e.g. several `file` parts)
+    or a JSON body {"images": [{"url": ...} | {"base64": ...}, ...], "top_k": 5}.
+    All images are embedded together and their vector queries run concurrently.
+    With sharded search, "shards" (e.g. "75018" or ["17", "18"]) limits the
+    search to some arrondissements.
+    With "fusion" (rrf, score or mean) the images are treated as views of one
+    building and a single fused address list is returned.
+    Without fusion, "views" (1-8, default TTA_VIEWS) crops and flips of each
+    image are embedded and searched, aggregated as set by "view_aggregation"
+    (mean or multi, default TTA_AGGREGATION).
+    
+    Returns:
+        JSON {"images": [{"name", "results", "timings_ms"} | {"name", "error"}],
+        "timings_ms": {...}} with results in request order, plus
+        "fused": {"method", "results"} when fusion was requested
+    """
+    start_time = time.perf_counter()
+    timings = g.timings = {}
+    
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or not isinstance(payload.get('images'), list):
+            return api_error("Expected a JSON body with an 'images' list", 400)
+        items = payload['images']
+        top_k = payload.get('top_k', 5)
+        fusion = payload.get('fusion')
+        shards = payload.get('shards')
+        views = payload.get('views', Config.TTA_VIEWS)
+        view_aggregation = payload.get('view_aggregation')
+        names = [item.get('name') if isinstance(item, dict) else None for item in items]
+    else:
+        files = [f for _, f in request.files.items(multi=True)]
+        items = files
+        top_k = request.form.get('top_k', 5)
+        fusion = request.form.get('fusion')
+        shards = request.form.get('shards')
+        views = request.form.get('views', Config.TTA_VIEWS)
+        view_aggregation = request.form.get('view_aggregation') or None
+        names = [f.filename for f in files]
+    
+    try:
+        top_k = int(top_k)
+    except (TypeError, ValueError):
+        return api_error("top_k must be an integer", 400)
+    if not 1 <= top_k <= 50:
+        return api_error("top_k must be between 1 and 50", 400)
+    if fusion is not None and fusion not in FUSION_METHODS:
+        return api_error(f"fusion must be one of {', '.join(FUSION_METHODS)}", 400)
+    try:
+        views = int(views)
+    except (TypeError, ValueError):
+        return api_error("views must be an integer", 400)
+    try:
+        check_views(views, view_aggregation)
+    except ValueError as e:
+        return api_error(str(e), 400)
+    if not items:
+        return api_error("No images in the request", 400)
+    if len(items) > Config.SEARCH_MAX_IMAGES:
+        return api_error(f"At most {Config.SEARCH_MAX_IMAGES} images per request", 400)
+    try:
+        get_routed_store(shards)
+    except ValueError as e:
+        return api_error(str(e), 400)
+    
+    try:
+        with admission.slot():
+            # Download URLs in parallel; uploads are already in memory
+            stage_start = time.perf_counter()
+            if request.is_json:
+                futures = [batch_executor.submit(load_api_image, item) for item in items]
+                inputs = []
+                for future in futures:
+                    try:
+                        inputs.append(future.result())
+                    except Exception as e:
+                        inputs.append(e)
+            else:
+                inputs = [f.stream for f in items]
+            timings['fetch'] = time.perf_counter() - stage_start
+            
+            loaded = [i for i, image in enumerate(inputs) if not isinstance(image, Exception)]
+            if fusion:
+                fused, errors = query_images_fused([inputs[i] for i in loaded], top_k=top_k, method=fusion,
+                                                   timings=timings, shards=shards)
+                entries = [{'error': error} if error else {} for error in errors]
+            else:
+                entries = query_images_unique_addresses([inputs[i] for i in loaded], top_k=top_k,
+                                                        timings=timings, shards=shards, views=views,
+                                                        view_aggregation=view_aggregation)
+    except (QueueFullError, OverloadedError) as e:
+        SEARCH_ERRORS.inc(kind='overloaded')
+        response = api_error(f"Server busy, retry shortly ({e})", 503)
+        response[0].headers['Retry-After'] = '1'
+        return response
+    except Exception as e:
+        SEARCH_ERRORS.inc(kind='error')
+        print("Error in batch search:", str(e))
+        print(traceback.format_exc())
+        return api_error(f"Search failed: {e}", 500)
+    
+    images = [{'name': name} for name in names]
+    for i, image in enumerate(inputs):
+        if isinstance(image, Exception):
+            images[i]['error'] = f"Could not load image: {image}"
+    for i, entry in zip(loaded, entries):
+        if 'error' in entry:
+            images[i]['error'] = entry['error']
+        elif not fusion:
+            images[i]['results'] = entry['results']
+            images[i]['timings_ms'] = {stage: round(seconds * 1000, 1) for stage, seconds in entry['timings'].items()}
+    
+    total = time.perf_counter() - start_time
+    print(f"Batch search of {len(items)} images in {total:.2f}s ("
+          + ", ".join(f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in timings.items())
+          + ")")
+    response = {
+        'images': images,
+        'timings_ms': {stage: round(seconds * 1000, 1) for stage, seconds in dict(timings, total=total).items()},
+    }
+    if fusion:
+        # Contributions are listed per image, in request order
+        for result in fused:
+            contributions = [None] * len(items)
+            for i, contribution in zip(loaded, result['contributions']):
+                contributions[i] = contribution
+            result['contributions'] = contributions
+        response['fused'] = {'method': fusion, 'results': fused}
+    return jsonify(response)
+
+@app.route('/api/search/stream', methods=['POST'])
+def api_search_stream():
+    """
+    Search one image and stream each stage's outcome as Server-Sent Events.
+    
+    Accepts a multipart upload (the first file, with optional `top_k` and
+    `shards` fields) or a JSON body {"url": ...} or {"base64": ...} with
+    optional "top_k", "shards" and "name".
+    
+    Returns:
+        text/event-stream of events whose data is JSON with the elapsed_ms
+        since the request arrived: received {name, bytes}, embedded {cached},
+        results {stage: "approximate", results}, results {stage: "refined",
+        results, changed} and done {timings_ms}; or error {error} at any point
+    """
+    start_time = time.perf_counter()
+    is_json = request.is_json
+    if is_json:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or not (payload.get('url') or payload.get('base64')):
+            return api_error("Expected a JSON body with 'url' or 'base64'", 400)
+        item, name = payload, payload.get('name')
+        top_k, shards = payload.get('top_k', 5), payload.get('shards')
+    else:
+        files = [f for _, f in request.files.items(multi=True)]
+        if not files:
+            return api_error("No image in the request", 400)
+        item, name = files[0].stream, files[0].filename
+        top_k, shards = request.form.get('top_k', 5), request.form.get('shards') or None
+    
+    try:
+        top_k = int(top_k)
+    except (TypeError, ValueError):
+        return api_error("top_k must be an integer", 400)
+    if not 1 <= top_k <= 50:
+        return api_error("top_k must be between 1 and 50", 400)
+    try:
+        get_routed_store(shards)
+    except ValueError as e:
+        return api_error(str(e), 400)
+    
+    # Shed before the stream starts, so an overloaded worker still answers with a 503
+    slot = ExitStack()
+    try:
+        slot.enter_context(admission.slot())
+    except OverloadedError as e:
+        SEARCH_ERRORS.inc(kind='overloaded')
+        response = api_error(f"Server busy, retry shortly ({e})", 503)
+        response[0].headers['Retry-After'] = '1'
+        return response
+    
+    def event(kind, data):
+        data = dict(data, elapsed_ms=round((time.perf_counter() - start_time) * 1000, 1))
+        return f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+    
+    def events():
+        timings = {}
+        try:
+            image_bytes = load_api_image(item) if is_json else read_image_bytes(item)
+            yield event('received', {'name': name, 'bytes': len(image_bytes)})
+            for kind, data in search_image_stages(image_bytes, top_k=top_k, timings=timings, shards=shards):
+                yield event(kind, data)
+            yield event('done', {'timings_ms': {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()}})
+        except (QueueFullError, OverloadedError) as e:
+            SEARCH_ERRORS.inc(kind='overloaded')
+            yield event('error', {'error': f"Server busy, retry shortly ({e})"})
+        except Exception as e:
+            SEARCH_ERRORS.inc(kind='error')
+            print("Error in streamed search:", str(e))
+            print(traceback.format_exc())
+            yield event('error', {'error': f"Search failed: {e}"})
+        finally:
+            # after_request ran when the headers went out, before any stage
+            for stage, seconds in timings.items():
+                STAGE_SECONDS.observe(seconds, stage=stage)
+            print(f"Streamed search in {time.perf_counter() - start_time:.2f}s ("
+                  + ", ".join(f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in timings.items())
+                  + ")")
+    
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx-style proxies from holding events back
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(slot.close)
+    return response
+
+def job_response(job, status=200):
+    summary = job_summary(job)
+    summary['results_url'] = url_for('job_results', job_id=job['id'])
+    return jsonify(summary), status
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """
+    Queue a bulk search job and return its ID at once.
+    
+    Accepts a multipart upload of a zip or tar archive of images (the first
+    file, up to JOBS_MAX_UPLOAD_MB) with optional `top_k`, `shards` and
+    `views` fields, or a JSON body {"paths": [...]} and/or {"archive": ...}
+    with local paths under JOBS_INPUT_DIR and the same options.
+    
+    An archive is extracted by the job runner once it takes the job, so its
+    images only count towards `total` from then on.
+    
+    Returns:
+        202 with the job's status (see job_status)
+    """
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or not (isinstance(payload.get('paths'), list) or payload.get('archive')):
+            return api_error("Expected a JSON body with a 'paths' list or an 'archive' path", 400)
+        archive, paths = payload.get('archive'), payload.get('paths')
+        top_k, shards, views = payload.get('top_k', 5), payload.get('shards'), payload.get('views', Config.TTA_VIEWS)
+    else:
+        files = [f for _, f in request.files.items(multi=True)]
+        if not files:
+            return api_error("No archive in the request", 400)
+        archive, paths = files[0].stream, None
+        top_k, shards = request.form.get('top_k', 5), request.form.get('shards') or None
+        views = request.form.get('views', Config.TTA_VIEWS)
+    
+    try:
+        top_k, views = int(top_k), int(views)
+    except (TypeError, ValueError):
+        return api_error("top_k and views must be integers", 400)
+    if not 1 <= top_k <= 50:
+        return api_error("top_k must be between 1 and 50", 400)
+    try:
+        check_views(views, None)
+        get_routed_store(shards)
+        job = submit_job(archive, paths, top_k, shards, views)
+    except ValueError as e:
+        return api_error(str(e), 400)
+    if Config.JOBS_ENABLED:
+        get_job_runner().start()
+    return job_response(job, 202)
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Progress of a bulk search job.
+    
+    Returns:
+        JSON {"id", "status" (queued, running, done, failed or cancelled),
+        "total", "done", "failed", "pending", "progress", "images_per_second",
+        "eta_seconds", "results_url", ...}
+    """
+    job = get_job_store().get(job_id)
+    if job is None:
+        return api_error("No such job", 404)
+    return job_response(job)
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def delete_job(job_id):
+    """Cancel a bulk search job; images already searched keep their results."""
+    if get_job_store().get(job_id) is None:
+        return api_error("No such job", 404)
+    cancel_job(job_id)
+    return job_response(get_job_store().get(job_id))
+
+@app.route('/api/jobs/<job_id>/results', methods=['GET'])
+def job_results(job_id):
+    """
+    Results of the images searched so far, as JSON Lines in submission order.
+    
+    Each line is {"seq", "name", "results"} or {"seq", "name", "error"}.
+    With `?after=<seq>`, only later images are returned, so a client can
+    fetch results incrementally while the job runs.
+    """
+    if get_job_store().get(job_id) is None:
+        return api_error("No such job", 404)
+    try:
+        after = int(request.args.get('after', -1))
+    except ValueError:
+        return api_error("after must be an integer", 400)
+    lines = (line + '\n' for line in get_job_store().results(job_id, after))
+    response = Response(stream_with_context(lines), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename="{job_id}.jsonl"'
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for this worker process"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/health')
 def health_check():
@@ -438,17 +1067,29 @@ def health_check():
         pinecone_env = os.environ.get('PINECONE_ENVIRONMENT')
         pinecone_index = os.environ.get('PINECONE_INDEX_NAME')
         
+        # Keep the load balancer away from workers that are still warming up
+        model_ready = model_loader.is_ready()
+        ready = model_ready or not Config.MODEL_PRELOAD
+        info = index_info()
+        
         return jsonify({
-            'status': 'healthy', 
+            'status': 'healthy' if ready else 'starting', 
             'timestamp': datetime.utcnow().isoformat(),
+            'model_ready': model_ready,
+            'model_load_seconds': model_loader.load_seconds,
+            'cache': cache_stats(),
+            'admission': admission.stats(),
             'pinecone_index': pinecone_index or 'paris-18',
-            'total_vectors': 636145,
+            'vector_store': Config.VECTOR_STORE,
+            'total_vectors': info['total_vectors'] if info else None,
+            'total_addresses': info['total_addresses'] if info else None,
+            'index_version': info['version'] if info else None,
             'env_vars_available': {
                 'PINECONE_API_KEY': bool(pinecone_api_key),
                 'PINECONE_ENVIRONMENT': bool(pinecone_env),
                 'PINECONE_INDEX_NAME': bool(pinecone_index)
             }
-        })
+        }), 200 if ready else 503
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -459,4 +1100,6 @@ def health_check():
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
     print(f"Starting Flask app on port {port}")
+    if Config.MODEL_PRELOAD:
+        model_loader.start_warm_up()
     app.run(debug=False, host='0.0.0.0', port=port)
@@ -0,0 +1,175 @@
+"""
+Micro-batching scheduler in front of the DINOv2 model.
+
+Concurrent requests put their preprocessed image tensors on a queue. A single
+worker thread collects up to `max_batch_size` of them, waiting at most
+`max_wait_ms` after the first one arrives, runs one forward pass over the
+stacked batch and hands each caller its own embedding through a future.
+
+Background work (bulk jobs, see jobs.py) is queued behind every interactive
+image and runs in passes of at most `max_background_batch` images, so an
+interactive search waits for one short pass at most.
+"""
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+from config import Config
+from model_loader import device, get_model
+
+
+class QueueFullError(Exception):
+    """Raised when the inference queue is full and the request should be shed."""
+
+
+class BatchScheduler:
+    """
+    Collects single-image inference requests into batched forward passes.
+
+    Args:
+        model_fn: Callable taking a (n, 3, 224, 224) tensor and returning an
+                  (n, d) tensor; defaults to the shared DINOv2 model
+        max_batch_size: Maximum images per forward pass (default: Config.BATCH_MAX_SIZE)
+        max_wait_ms: How long to wait for more images once one is queued
+                     (default: Config.BATCH_MAX_WAIT_MS)
+        max_queue_size: Queued images beyond which submit() raises QueueFullError
+                        (default: Config.BATCH_QUEUE_SIZE)
+        max_background_batch: Maximum background images per forward pass
+                              (default: Config.BATCH_BACKGROUND_SIZE)
+    """
+
+    def __init__(self, model_fn=None, max_batch_size=None, max_wait_ms=None, max_queue_size=None,
+                 max_background_batch=None):
+        self.model_fn = model_fn or _forward
+        self.max_batch_size = max_batch_size or Config.BATCH_MAX_SIZE
+        self.max_wait = (Config.BATCH_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+        self.max_queue_size = max_queue_size or Config.BATCH_QUEUE_SIZE
+        self.max_background_batch = max_background_batch or Config.BATCH_BACKGROUND_SIZE
+        # (priority, arrival, tensor, future): interactive images first, in arrival order
+        self._queue = queue.PriorityQueue()
+        self._arrivals = itertools.count()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches_run = 0
+        self.images_run = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+                self._thread.start()
+
+    def submit(self, img_tensor, background=False):
+        """
+        Queue one preprocessed image for inference.
+
+        Args:
+            img_tensor: Tensor of shape (3, 224, 224)
+            background: Run only when no interactive image is waiting
+
+        Returns:
+            Future resolving to the image embedding as a 1-D CPU tensor
+
+        Raises:
+            QueueFullError: If the queue already holds max_queue_size images
+        """
+        self._ensure_started()
+        if self._queue.qsize() >= self.max_queue_size:
+            raise QueueFullError(f"Inference queue is full ({self.max_queue_size} images waiting)")
+        future = Future()
+        self._queue.put((int(background), next(self._arrivals), img_tensor, future))
+        return future
+
+    def embed(self, img_tensor, timeout=None):
+        """Submit one image and block until its embedding is ready."""
+        return self.submit(img_tensor).result(timeout=timeout)
+
+    def embed_many(self, img_tensors, timeout=None, background=False):
+        """Submit several images at once and return their embeddings in order."""
+        futures = []
+        try:
+            for t in img_tensors:
+                futures.append(self.submit(t, background))
+        except QueueFullError:
+            # Shed the whole request rather than embed part of it
+            for f in futures:
+                f.cancel()
+            raise
+        return [f.result(timeout=timeout) for f in futures]
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        background = batch[0][0]
+        limit = self.max_background_batch if background else self.max_batch_size
+        # Background passes start at once, without waiting for more images
+        deadline = time.monotonic() + (0 if background else self.max_wait)
+        while len(batch) < limit:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] != background:
+                # Interactive and background images never share a pass
+                self._queue.put(item)
+                break
+            batch.append(item)
+        return [(t, f) for _, _, t, f in batch]
+
+    def _run(self):
+        while True:
+            # Skip requests whose caller cancelled while they were queued
+            batch = [(t, f) for t, f in self._collect() if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                embeddings = self.model_fn(torch.stack([t for t, _ in batch]))
+            except Exception as e:
+                for _, f in batch:
+                    f.set_exception(e)
+                continue
+            self.batches_run += 1
+            self.images_run += len(batch)
+            for (_, f), embedding in zip(batch, embeddings):
+                f.set_result(embedding)
+
+
+def _forward(batch):
+    with torch.no_grad():
+        return get_model()(batch.to(device)).cpu()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return this process's scheduler, creating it on first use."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = BatchScheduler()
+    return _scheduler
+
+
+def _reset_after_fork():
+    # The worker thread does not exist in the child; start from a fresh queue.
+    global _scheduler, _scheduler_lock
+    _scheduler = None
+    _scheduler_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,398 @@
+"""
+Offline benchmark suite.
+
+Measures the serving path stage by stage without network access:
+
+- preprocess: reference torchvision pipeline and the fast path, per image
+- forward: the DINOv2 forward pass at several batch sizes and thread counts
+- dedupe: the per-address dedup of vector store matches
+- vector_store: grouped top-k search in the configured stand-in store
+- routes: the Flask `/` upload and `/api/health` routes through the test client
+- tta: test-time augmentation at 1, 2, 4 and 8 views per image (preprocessing
+  plus one batched forward pass), with the address recall each view count
+  and aggregation reaches on synthetic off-centre shots
+
+The vector store is a stand-in filled with synthetic 768-d vectors: an
+in-process local store (`--store local`) or the Pinecone HTTP stand-in from
+local_pinecone.py (`--store pinecone`). Query images are synthetic JPEGs at
+phone-camera and web sizes. Caches are disabled so every request runs the
+full path.
+
+Each benchmark reports p50/p95/p99 latency, throughput and the peak RSS of
+the process so far. Results are written as JSON; pass an earlier run with
+--compare to see the change and fail on a regression.
+
+The model comes from DINOV2_REPO_DIR/DINOV2_WEIGHTS_PATH when set (as in the
+Docker image), so the suite needs no network there.
+
+Usage:
+    python benchmark.py --output bench.json
+    python benchmark.py --output new.json --compare bench.json --max-regression 0.15
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+# (width, height) of the synthetic query photos
+IMAGE_SIZES = ((4032, 3024), (1600, 1200), (800, 600))
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def summarize(latencies, items_per_call=1):
+    """Latency percentiles in ms, throughput in items/s and peak RSS in MB."""
+    latencies = np.asarray(latencies)
+    return {
+        'iterations': len(latencies),
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p95_ms': float(np.percentile(latencies, 95) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'mean_ms': float(latencies.mean() * 1000),
+        'throughput_per_s': float(items_per_call * len(latencies) / latencies.sum()),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def measure(fn, iterations, warmup=2, items_per_call=1):
+    """
+    Time repeated calls of fn.
+
+    Args:
+        fn: Callable taking the iteration number
+        iterations: Timed calls
+        warmup: Untimed calls first
+        items_per_call: Items one call processes, for the throughput
+
+    Returns:
+        Summary dict (see summarize)
+    """
+    for i in range(warmup):
+        fn(i)
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies, items_per_call)
+
+
+def synthetic_photos(seed=0):
+    """JPEG-encoded, photo-like images: smooth gradients with sensor-like noise."""
+    rng = np.random.default_rng(seed)
+    photos = []
+    for width, height in IMAGE_SIZES:
+        y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+        base = np.stack([x / width, y / height, (x + y) / (width + height)], axis=-1) * 200
+        pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+        photos.append((f"{width}x{height}.jpg", buffer.getvalue()))
+    return photos
+
+
+def synthetic_street(buildings, seed=0, height=1000):
+    """
+    A synthetic street panorama: buildings of height x height pixels side by
+    side, each a wall colour with a grid of windows, plus sensor-like noise.
+
+    Returns:
+        (height, buildings * height, 3) uint8 array
+    """
+    rng = np.random.default_rng(seed)
+    pixels = np.empty((height, buildings * height, 3), dtype=np.float32)
+    for b in range(buildings):
+        facade = pixels[:, b * height:(b + 1) * height]
+        facade[:] = rng.uniform(60, 220, 3)
+        rows, cols = rng.integers(3, 7), rng.integers(3, 7)
+        cell_h, cell_w = height // rows, height // cols
+        for r in range(rows):
+            for c in range(cols):
+                if rng.random() < 0.8:
+                    h, w = int(cell_h * rng.uniform(0.4, 0.7)), int(cell_w * rng.uniform(0.3, 0.6))
+                    top, left = r * cell_h + (cell_h - h) // 2, c * cell_w + (cell_w - w) // 2
+                    facade[top:top + h, left:left + w] = rng.uniform(0, 255, 3)
+    return np.clip(pixels + rng.normal(0, 10, pixels.shape), 0, 255).astype(np.uint8)
+
+
+def jpeg(pixels, quality=85):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+# --- Benchmarks ---
+def bench_preprocess(photos, iterations):
+    from preprocessing import open_image, preprocess_image
+    from query_pinecone import preprocess
+
+    results = {}
+    for name, data in photos:
+        results[f"reference/{name}"] = measure(
+            lambda i: preprocess(Image.open(io.BytesIO(data)).convert('RGB')), iterations)
+        results[f"fast/{name}"] = measure(lambda i: preprocess_image(open_image(data)), iterations)
+    return results
+
+
+def bench_forward(batch_sizes, thread_counts, iterations):
+    import torch
+    from model_loader import get_model
+
+    model = get_model()
+    default_threads = torch.get_num_threads()
+    results = {}
+    try:
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            for batch_size in batch_sizes:
+                batch = torch.randn(batch_size, 3, 224, 224)
+
+                def forward(i):
+                    with torch.no_grad():
+                        model(batch)
+
+                results[f"batch{batch_size}/threads{threads}"] = measure(
+                    forward, iterations, warmup=1, items_per_call=batch_size)
+    finally:
+        torch.set_num_threads(default_threads)
+    return results
+
+
+def bench_dedupe(iterations, max_results=50, addresses=12, top_k=5):
+    from query_pinecone import dedupe_addresses
+
+    rng = np.random.default_rng(0)
+    # A dense street: max_results matches spread over a few addresses
+    matches = [
+        {'id': f"img_{i}", 'score': float(s),
+         'metadata': {'address': f"{rng.integers(addresses) + 1} rue synthetique, 75018 Paris, France"}}
+        for i, s in enumerate(sorted(rng.random(max_results), reverse=True))
+    ]
+    return {f"{max_results}matches": measure(lambda i: dedupe_addresses(matches, top_k), iterations * 50)}
+
+
+def bench_vector_store(iterations, dimension=768, top_k=5):
+    from vector_store import get_vector_store
+
+    store = get_vector_store()
+    rng = np.random.default_rng(1)
+    queries = rng.standard_normal((iterations + 2, dimension), dtype=np.float32).tolist()
+    return {f"{store.name}/grouped_top{top_k}": measure(
+        lambda i: store.query_grouped(queries[i], top_k), iterations)}
+
+
+def bench_tta(photos, iterations, buildings=40, view_counts=(1, 2, 4, 8)):
+    """
+    Latency of embedding 1 to 8 views of a photo through the batch scheduler,
+    and the recall those views reach on off-centre shots.
+
+    The "index" holds one square photo per building of a synthetic street.
+    Each query is a wider 16:9 shot aligned on one edge of its building, so
+    over a third of its center crop shows the neighbouring building.
+    Every query's views are embedded once; recall@1 and recall@5 of the
+    building are then computed for each view count with a mean vector
+    ('mean') and with one query per view fused by best score ('multi').
+    """
+    import torch
+
+    from batching import get_scheduler
+    from preprocessing import VIEWS, open_image, preprocess_images, preprocess_views
+    from query_pinecone import mean_embedding, view_vectors
+
+    scheduler = get_scheduler()
+    results = {}
+    name, data = photos[1]
+    for count in view_counts:
+        results[f"views{count}/{name}"] = measure(
+            lambda i: scheduler.embed_many(list(preprocess_views(open_image(data), VIEWS[:count]))), iterations)
+
+    # Index: each building shot head-on; queries: a 16:9 shot starting at
+    # the building's left or right edge, over a third of its center crop on a neighbour
+    street = synthetic_street(buildings + 2)
+    side = street.shape[0]
+    indexed = [open_image(jpeg(street[:, b * side:(b + 1) * side])) for b in range(1, buildings + 1)]
+    index = torch.cat([torch.stack(scheduler.embed_many(list(preprocess_images(indexed[i:i + 8]))))
+                       for i in range(0, len(indexed), 8)]).numpy()
+    index /= np.linalg.norm(index, axis=1, keepdims=True)
+
+    rng = np.random.default_rng(2)
+    shot = side * 16 // 9
+    query_views = []
+    for b in range(1, buildings + 1):
+        left = b * side if rng.random() < 0.5 else (b + 1) * side - shot
+        pixels = np.clip(street[:, left:left + shot] * rng.uniform(0.8, 1.2), 0, 255).astype(np.uint8)
+        img = open_image(jpeg(pixels, quality=70))
+        query_views.append(np.stack([e.numpy() for e in scheduler.embed_many(list(preprocess_views(img, VIEWS)))]))
+
+    for count in view_counts:
+        for aggregation in ('mean', 'multi'):
+            hits = np.zeros(2)
+            for truth, embeddings in enumerate(query_views):
+                vectors = (np.asarray([mean_embedding(embeddings[:count])]) if aggregation == 'mean'
+                           else np.asarray(view_vectors(embeddings[:count], 'multi')))
+                ranking = np.argsort(-(vectors @ index.T).max(axis=0))
+                hits += [ranking[0] == truth, truth in ranking[:5]]
+            entry = results[f"views{count}/{name}"]
+            entry[f"recall_at_1/{aggregation}"] = float(hits[0] / len(query_views))
+            entry[f"recall_at_5/{aggregation}"] = float(hits[1] / len(query_views))
+    return results
+
+
+def bench_routes(photos, iterations):
+    from app import app
+
+    client = app.test_client()
+    results = {'health': measure(lambda i: client.get('/api/health'), iterations * 5)}
+    for name, data in photos:
+        def upload(i):
+            response = client.post('/', data={'file': (io.BytesIO(data), name)},
+                                   content_type='multipart/form-data')
+            if response.status_code != 200:
+                raise RuntimeError(f"POST / returned {response.status_code}")
+        results[f"upload/{name}"] = measure(upload, iterations)
+    return results
+
+
+# --- Setup and reporting ---
+def configure(args, workdir):
+    """
+    Point the app at a synthetic stand-in store and disable caching.
+
+    Must run before config.py is imported, since Config reads the environment once.
+
+    Returns:
+        The Pinecone stand-in server to stop at the end, or None
+    """
+    from local_pinecone import synthetic_index
+
+    os.environ['CACHE_ENABLED'] = '0'
+    os.environ['MODEL_PRELOAD'] = '0'
+    ids, vectors, metadata = synthetic_index(args.vectors, args.addresses, seed=0)
+    if args.store == 'pinecone':
+        from local_pinecone import LocalPineconeServer
+
+        server = LocalPineconeServer(ids, vectors, metadata)
+        server.start()
+        os.environ.update(VECTOR_STORE='pinecone', PINECONE_API_KEY='local', PINECONE_INDEX_HOST=server.url)
+        return server
+
+    os.environ.update(VECTOR_STORE='local', LOCAL_INDEX_DIR=workdir, LOCAL_INDEX_MODE='exact')
+    from vector_store import write_local_store
+
+    write_local_store(workdir, ids, vectors, [m['address'] for m in metadata])
+    return None
+
+
+def environment():
+    import torch
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'cpu_count': os.cpu_count(),
+        'platform': platform.platform(),
+        'inference_backend': os.environ.get('INFERENCE_BACKEND') or 'eager',
+    }
+
+
+def compare(results, baseline, max_regression):
+    """
+    Print p50 and throughput changes against a baseline run.
+
+    Returns:
+        Names of benchmarks whose p50 grew by more than max_regression (a fraction)
+    """
+    regressions = []
+    print(f"\n{'benchmark':<46} {'p50 ms':>9} {'base':>9} {'change':>8}")
+    for suite, entries in results.items():
+        for name, current in entries.items():
+            previous = baseline.get(suite, {}).get(name)
+            if previous is None:
+                continue
+            change = current['p50_ms'] / previous['p50_ms'] - 1 if previous['p50_ms'] else 0.0
+            flag = ''
+            if change > max_regression:
+                regressions.append(f"{suite}/{name}")
+                flag = '  REGRESSION'
+            print(f"{suite + '/' + name:<46} {current['p50_ms']:>9.2f} {previous['p50_ms']:>9.2f} "
+                  f"{change:>+7.1%}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline latency/throughput benchmarks")
+    parser.add_argument('--output', default='benchmark.json', help="JSON results file (default: benchmark.json)")
+    parser.add_argument('--suites', nargs='+', default=['preprocess', 'forward', 'dedupe', 'vector_store', 'routes'],
+                        choices=['preprocess', 'forward', 'dedupe', 'vector_store', 'routes', 'tta'])
+    parser.add_argument('--iterations', type=int, default=20, help="Timed iterations per benchmark")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--threads', type=int, nargs='+', help="torch thread counts (default: 1 and all cores)")
+    parser.add_argument('--store', choices=['local', 'pinecone'], default='local',
+                        help="Stand-in vector store: in-process local store or the Pinecone HTTP stand-in")
+    parser.add_argument('--vectors', type=int, default=100000, help="Synthetic vectors in the stand-in store")
+    parser.add_argument('--addresses', type=int, default=10000, help="Distinct addresses in the stand-in store")
+    parser.add_argument('--buildings', type=int, default=40, help="Synthetic buildings in the tta recall measure")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help="With --compare, exit 1 if any p50 grew by more than this fraction (default: 0.2)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        server = configure(args, workdir)
+        try:
+            photos = synthetic_photos()
+            thread_counts = args.threads or sorted({1, os.cpu_count() or 1})
+            suites = {
+                'preprocess': lambda: bench_preprocess(photos, args.iterations),
+                'forward': lambda: bench_forward(args.batch_sizes, thread_counts, args.iterations),
+                'dedupe': lambda: bench_dedupe(args.iterations),
+                'vector_store': lambda: bench_vector_store(args.iterations),
+                'routes': lambda: bench_routes(photos, args.iterations),
+                'tta': lambda: bench_tta(photos, args.iterations, args.buildings),
+            }
+            results = {}
+            for suite in args.suites:
+                print(f"Running {suite}...")
+                results[suite] = suites[suite]()
+                for name, r in results[suite].items():
+                    print(f"  {name:<36} p50 {r['p50_ms']:>9.2f}ms  p95 {r['p95_ms']:>9.2f}ms  "
+                          f"p99 {r['p99_ms']:>9.2f}ms  {r['throughput_per_s']:>9.1f}/s  rss {r['peak_rss_mb']:.0f}MB")
+                    recalls = {k: v for k, v in r.items() if k.startswith('recall')}
+                    if recalls:
+                        print("    " + "  ".join(f"{k} {v:.2f}" for k, v in recalls.items()))
+        finally:
+            if server is not None:
+                server.stop()
+
+    report = {'environment': environment(), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.max_regression:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
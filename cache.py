@@ -0,0 +1,248 @@
+"""
+Bounded LRU caches with TTL, in process memory or in a SQLite file shared by
+all gunicorn workers.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+
+
+class _CacheCounters:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class LRUCache(_CacheCounters):
+    """
+    Thread-safe in-memory LRU cache with per-entry TTL.
+
+    Args:
+        max_entries: Entries kept before the least recently used is evicted
+        ttl: Seconds an entry stays valid
+    """
+
+    def __init__(self, max_entries, ttl):
+        super().__init__(max_entries, ttl)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value, or None on a miss or an expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache(_CacheCounters):
+    """
+    LRU cache with TTL stored in a SQLite file, so every worker process on
+    the host shares the same entries. Hit/miss counters are per process.
+
+    Args:
+        path: SQLite database file
+        table: Table holding this cache's entries
+        max_entries: Entries kept before the least recently used are evicted
+        ttl: Seconds an entry stays valid
+        dumps: Function encoding a value to bytes or str
+        loads: Function decoding what dumps produced
+    """
+
+    def __init__(self, path, table, max_entries, ttl, dumps, loads):
+        super().__init__(max_entries, ttl)
+        self.path = path
+        self.table = table
+        self.dumps = dumps
+        self.loads = loads
+        self._local = threading.local()
+        # Guards the hit/miss counters; SQLite handles its own locking
+        self._lock = threading.Lock()
+        with self._connection() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                         "(key TEXT PRIMARY KEY, value BLOB, expires_at REAL, accessed_at REAL)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed_at)")
+
+    def _connection(self):
+        # sqlite3 connections cannot cross threads or a fork, so keep one per
+        # thread and per process.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < now:
+            if row is not None:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            with self._lock:
+                self.misses += 1
+            return None
+        conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        with self._lock:
+            self.hits += 1
+        return self.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        conn = self._connection()
+        conn.execute(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)",
+                     (key, self.dumps(value), now + self.ttl, now))
+        conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+        conn.execute(f"DELETE FROM {self.table} WHERE key IN "
+                     f"(SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                     (self.max_entries,))
+
+    def clear(self):
+        self._connection().execute(f"DELETE FROM {self.table}")
+
+    def __len__(self):
+        return self._connection().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+def make_cache(name, dumps, loads, max_entries=None):
+    """
+    Build the cache configured for this deployment.
+
+    Uses SQLiteCache when Config.CACHE_SQLITE_PATH is set, LRUCache otherwise.
+
+    Args:
+        name: Cache name, used as the SQLite table name
+        dumps: Value encoder for the SQLite backend
+        loads: Value decoder for the SQLite backend
+        max_entries: Size bound (default: Config.CACHE_MAX_ENTRIES)
+
+    Returns:
+        LRUCache or SQLiteCache
+    """
+    max_entries = max_entries or Config.CACHE_MAX_ENTRIES
+    if Config.CACHE_SQLITE_PATH:
+        return SQLiteCache(Config.CACHE_SQLITE_PATH, name, max_entries, Config.CACHE_TTL_SECONDS, dumps, loads)
+    return LRUCache(max_entries, Config.CACHE_TTL_SECONDS)
+
+
+class NearDuplicateCache(_CacheCounters):
+    """
+    Thread-safe in-memory LRU cache keyed by 64-bit perceptual hashes, where a
+    lookup matches the closest stored hash within a Hamming distance.
+
+    The hash is split into threshold + 1 bit segments, each indexed in its own
+    table. Two hashes at most threshold bits apart agree on at least one whole
+    segment, so a lookup only compares the entries sharing a segment with the
+    query and still finds every match.
+
+    Args:
+        max_entries: Entries kept before the least recently used is evicted
+        ttl: Seconds an entry stays valid
+        threshold: Largest Hamming distance counted as a match
+        bits: Hash length in bits (default: 64)
+    """
+
+    def __init__(self, max_entries, ttl, threshold, bits=64):
+        super().__init__(max_entries, ttl)
+        if not 0 <= threshold < bits:
+            raise ValueError(f"threshold must be between 0 and {bits - 1}, got {threshold}")
+        self.threshold = threshold
+        segments = threshold + 1
+        self._segments = [(i * bits // segments, (i + 1) * bits // segments - i * bits // segments)
+                          for i in range(segments)]
+        self._tables = [{} for _ in range(segments)]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _keys(self, image_hash):
+        return [(image_hash >> start) & ((1 << width) - 1) for start, width in self._segments]
+
+    def _remove(self, image_hash):
+        del self._entries[image_hash]
+        for table, key in zip(self._tables, self._keys(image_hash)):
+            bucket = table[key]
+            bucket.discard(image_hash)
+            if not bucket:
+                del table[key]
+
+    def get(self, image_hash):
+        """Return the value of the closest stored hash within threshold bits, or None."""
+        now = time.monotonic()
+        with self._lock:
+            best, best_distance = None, self.threshold + 1
+            expired = set()
+            for table, key in zip(self._tables, self._keys(image_hash)):
+                for candidate in table.get(key, ()):
+                    distance = (candidate ^ image_hash).bit_count()
+                    if distance > self.threshold:
+                        continue
+                    # An expired entry must not hide a live one further away
+                    if self._entries[candidate][1] < now:
+                        expired.add(candidate)
+                    elif distance < best_distance:
+                        best, best_distance = candidate, distance
+            for candidate in expired:
+                self._remove(candidate)
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            return self._entries[best][0]
+
+    def set(self, image_hash, value):
+        with self._lock:
+            if image_hash in self._entries:
+                self._remove(image_hash)
+            self._entries[image_hash] = (value, time.monotonic() + self.ttl)
+            for table, key in zip(self._tables, self._keys(image_hash)):
+                table.setdefault(key, set()).add(image_hash)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for table in self._tables:
+                table.clear()
+
+    def __len__(self):
+        return len(self._entries)
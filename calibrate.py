@@ -0,0 +1,177 @@
+"""
+Fit the score calibration on a labelled image set.
+
+The set uses the ingest.py layout: one folder per address, or files named
+`<address>_<n>.jpg`. Each image is embedded and searched the way the service
+does it, with the same backend, vector store and RESULT_AGGREGATION. Its
+best CANDIDATES address scores are recorded, with whether each address is
+the image's own.
+
+Part of the images is held out. The calibration is fitted on the rest and
+the report compares, on the held-out images, the top-1 expected calibration
+error (ECE) and Brier score of the calibrated confidence with the raw score
+shown as a percentage.
+
+The photos must not be in the index, or every search finds its own photo
+at a score near 1.
+
+Usage:
+    python calibrate.py /path/to/labelled-images --method temperature --output calibration.json
+    CALIBRATION_PATH=calibration.json gunicorn --config gunicorn.conf.py app:app
+"""
+import argparse
+
+import numpy as np
+
+from postprocess import CANDIDATES, Calibrator
+
+
+def collect(folder, max_results=50, batch_size=16, candidates=CANDIDATES):
+    """
+    Search every labelled image and record its candidate address scores.
+
+    Args:
+        folder: Labelled image folder in the ingest.py layout
+        max_results: Matches fetched by the first vector store query (default: 50)
+        batch_size: Images embedded per batch (default: 16)
+        candidates: Addresses recorded per image (default: CANDIDATES)
+
+    Returns:
+        List of (address scores best first, candidate addresses, true address), one per image
+    """
+    from config import Config
+    from ingest import FolderSource, address_from_key
+    from postprocess import aggregate
+    from query_pinecone import embed_images, query_matches
+    from vector_store import get_vector_store
+
+    source = FolderSource(folder)
+    keys = source.keys()
+    store = get_vector_store()
+    samples = []
+    for start in range(0, len(keys), batch_size):
+        chunk = keys[start:start + batch_size]
+        vectors, errors = embed_images([source.read(key) for key in chunk])
+        for key, vector, error in zip(chunk, vectors, errors):
+            if error:
+                print(f"Skipping {key}: {error}")
+                continue
+            matches = query_matches(store, vector, candidates, max_results)
+            first, aggregated, _ = aggregate(matches.scores, matches.keys, Config.RESULT_AGGREGATION,
+                                             Config.RESULT_TOP_M)
+            addresses = np.array([matches.address(k) for k in matches.keys[first[:candidates]]], dtype=str)
+            samples.append((aggregated[:candidates], addresses, address_from_key(key)))
+        print(f"{len(samples)}/{len(keys)} images searched")
+    return samples
+
+
+def fit_temperature(samples, candidates=CANDIDATES):
+    """
+    Grid-search the softmax temperature and "none of them" score that
+    minimise the negative log-likelihood of the true addresses.
+
+    Returns:
+        Calibrator
+    """
+    scores = np.full((len(samples), candidates), -np.inf)
+    labels = np.full(len(samples), candidates)  # candidates: the true address was not found
+    for i, (s, addresses, truth) in enumerate(samples):
+        scores[i, :len(s)] = s
+        hits = np.flatnonzero(addresses == truth)
+        if len(hits):
+            labels[i] = hits[0]
+    top = scores[:, 0]
+    best = (np.inf, 1.0, 0.0)
+    for temperature in np.geomspace(0.001, 1.0, 90):
+        for bias in np.linspace(top.min() - 0.2, top.max() + 0.2, 90):
+            logits = np.concatenate([scores, np.full((len(scores), 1), bias)], axis=1) / temperature
+            peak = logits.max(axis=1, keepdims=True)
+            log_norm = np.log(np.exp(logits - peak).sum(axis=1)) + peak[:, 0]
+            nll = (log_norm - logits[np.arange(len(logits)), labels]).mean()
+            if nll < best[0]:
+                best = (nll, temperature, bias)
+    return Calibrator('temperature', temperature=best[1], bias=best[2], candidates=candidates)
+
+
+def fit_isotonic(samples):
+    """
+    Fit a non-decreasing map from address score to the share of addresses at
+    that score that were right, by pool-adjacent-violators over every
+    candidate address.
+
+    Returns:
+        Calibrator
+    """
+    scores = np.concatenate([s for s, _, _ in samples])
+    correct = np.concatenate([(addresses == truth).astype(np.float64) for _, addresses, truth in samples])
+    order = np.argsort(scores, kind='stable')
+    # Blocks of [sum of labels, count, lowest score, highest score]
+    blocks = []
+    for x, y in zip(scores[order], correct[order]):
+        blocks.append([y, 1, x, x])
+        while len(blocks) > 1 and blocks[-2][0] / blocks[-2][1] >= blocks[-1][0] / blocks[-1][1]:
+            total, count, _, high = blocks.pop()
+            blocks[-1][0] += total
+            blocks[-1][1] += count
+            blocks[-1][3] = high
+    x, y = [], []
+    for total, count, low, high in blocks:
+        x.extend((low, high))
+        y.extend((total / count, total / count))
+    return Calibrator('isotonic', x=x, y=y)
+
+
+def evaluate(samples, calibrator=None, bins=10):
+    """
+    Top-1 accuracy, expected calibration error and Brier score.
+
+    Args:
+        samples: Output of collect
+        calibrator: Calibrator, or None for the raw score as confidence
+        bins: Equal-width confidence bins for the ECE (default: 10)
+
+    Returns:
+        Dict with 'accuracy', 'ece' and 'brier'
+    """
+    confidence = np.empty(len(samples))
+    correct = np.empty(len(samples))
+    for i, (scores, addresses, truth) in enumerate(samples):
+        top = calibrator.confidences(scores)[0] if calibrator is not None else scores[0]
+        confidence[i] = np.clip(top, 0.0, 1.0)
+        correct[i] = addresses[0] == truth
+    bin_ids = np.minimum((confidence * bins).astype(int), bins - 1)
+    ece = sum(abs(confidence[bin_ids == b].mean() - correct[bin_ids == b].mean()) * (bin_ids == b).mean()
+              for b in range(bins) if (bin_ids == b).any())
+    return {
+        'accuracy': float(correct.mean()),
+        'ece': float(ece),
+        'brier': float(((confidence - correct) ** 2).mean()),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the score calibration on a labelled image set")
+    parser.add_argument('folder', help="Labelled images in the ingest.py layout, not in the index")
+    parser.add_argument('--method', choices=['temperature', 'isotonic'], default='temperature')
+    parser.add_argument('--output', default='calibration.json', help="Calibration file (default: calibration.json)")
+    parser.add_argument('--holdout', type=float, default=0.3, help="Share of images kept for the report (default: 0.3)")
+    parser.add_argument('--max-results', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    samples = collect(args.folder, args.max_results, args.batch_size)
+    if len(samples) < 10:
+        parser.error(f"only {len(samples)} usable images, need at least 10")
+    order = np.random.default_rng(args.seed).permutation(len(samples))
+    cut = int(len(samples) * (1 - args.holdout))
+    train = [samples[i] for i in order[:cut]]
+    held_out = [samples[i] for i in order[cut:]] or train
+
+    calibrator = fit_temperature(train) if args.method == 'temperature' else fit_isotonic(train)
+    calibrator.save(args.output)
+    print(f"Fitted {args.method} calibration on {len(train)} images, wrote {args.output}")
+    print(f"{'held out':<12} {'accuracy':>9} {'ECE':>7} {'Brier':>7}")
+    for name, c in (('raw score', None), ('calibrated', calibrator)):
+        report = evaluate(held_out, c)
+        print(f"{name:<12} {report['accuracy']:>9.3f} {report['ece']:>7.3f} {report['brier']:>7.3f}")
@@ -20,6 +20,91 @@ class Config:
     PINECONE_API_KEY = os.environ.get('PINECONE_API_KEY')
     PINECONE_ENVIRONMENT = os.environ.get('PINECONE_ENVIRONMENT') or 'gcp-starter'
     PINECONE_INDEX_NAME = os.environ.get('PINECONE_INDEX_NAME') or 'paris-18'
+    PINECONE_INDEX_HOST = os.environ.get('PINECONE_INDEX_HOST')  # skips the control-plane lookup, e.g. a local stand-in
+    PINECONE_POOL_MAXSIZE = int(os.environ.get('PINECONE_POOL_MAXSIZE') or 10)
+    PINECONE_TIMEOUT = float(os.environ.get('PINECONE_TIMEOUT') or 10)  # seconds
+    
+    # Vector store: 'pinecone' or 'local' (memory-mapped files, see vector_store.py)
+    VECTOR_STORE = os.environ.get('VECTOR_STORE') or 'pinecone'
+    LOCAL_INDEX_DIR = os.environ.get('LOCAL_INDEX_DIR') or 'index'
+    LOCAL_INDEX_MODE = os.environ.get('LOCAL_INDEX_MODE') or 'auto'  # auto, exact, ivf or pq
+    LOCAL_INDEX_NPROBE = int(os.environ.get('LOCAL_INDEX_NPROBE') or 16)  # IVF lists scanned per query
+    LOCAL_INDEX_RESCORE = int(os.environ.get('LOCAL_INDEX_RESCORE') or 512)  # PQ candidates re-scored with full vectors
+    LOCAL_INDEX_RELOAD_SECONDS = float(os.environ.get('LOCAL_INDEX_RELOAD_SECONDS') or 10)  # how often workers look for a new version; 0 disables
+    
+    # Sharded search (see shards.py)
+    SHARDS = os.environ.get('SHARDS', '')  # comma-separated: Pinecone namespaces or sub-directories of LOCAL_INDEX_DIR
+    SHARD_TIMEOUT_MS = float(os.environ.get('SHARD_TIMEOUT_MS') or 2000)  # shards slower than this are left out
+    SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS') or 32)  # threads querying each shard
+    
+    # Model settings
+    MODEL_PRELOAD = os.environ.get('MODEL_PRELOAD', '0').lower() in ('1', 'true', 'yes')
+    DINOV2_REPO_DIR = os.environ.get('DINOV2_REPO_DIR')  # local copy of the facebookresearch/dinov2 hub repo
+    DINOV2_WEIGHTS_PATH = os.environ.get('DINOV2_WEIGHTS_PATH')  # dinov2_vitb14_pretrain.pth
+    INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND') or 'eager'  # eager (fp32), int8, torchscript, bf16 or fp16
+    FAST_PREPROCESS = os.environ.get('FAST_PREPROCESS', '1').lower() in ('1', 'true', 'yes')  # draft JPEG decode + fused resize/crop/normalize
+    MODEL_MMAP = os.environ.get('MODEL_MMAP', '0').lower() in ('1', 'true', 'yes')  # map the weights file, shared by all workers
+    TORCH_THREADS = int(os.environ.get('TORCH_THREADS') or 0)  # intra-op threads per worker; 0 splits the CPUs between workers
+    
+    # Inference micro-batching
+    BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE') or 8)  # images per forward pass
+    BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS') or 5)  # wait for more images after the first
+    BATCH_QUEUE_SIZE = int(os.environ.get('BATCH_QUEUE_SIZE') or 64)  # queued images before requests are shed
+    BATCH_BACKGROUND_SIZE = int(os.environ.get('BATCH_BACKGROUND_SIZE') or 2)  # bulk job images per forward pass; an interactive search waits for one such pass at most
+    
+    # Admission control, per worker process
+    MAX_INFLIGHT_REQUESTS = int(os.environ.get('MAX_INFLIGHT_REQUESTS') or 8)  # search requests served at once
+    ADMISSION_WAIT_MS = float(os.environ.get('ADMISSION_WAIT_MS') or 200)  # wait for a free slot before a 503
+    
+    # Observability
+    SERVER_TIMING = os.environ.get('SERVER_TIMING', '0').lower() in ('1', 'true', 'yes')  # per-stage Server-Timing response header
+    
+    # Embedding and result caches
+    CACHE_ENABLED = os.environ.get('CACHE_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES') or 4096)
+    CACHE_TTL_SECONDS = float(os.environ.get('CACHE_TTL_SECONDS') or 3600)
+    CACHE_SQLITE_PATH = os.environ.get('CACHE_SQLITE_PATH')  # share the cache between workers, e.g. /tmp/search-cache.db
+    NEAR_DUPLICATE_CACHE = os.environ.get('NEAR_DUPLICATE_CACHE', '1').lower() in ('1', 'true', 'yes')  # reuse embeddings of re-encoded photos
+    NEAR_DUPLICATE_THRESHOLD = int(os.environ.get('NEAR_DUPLICATE_THRESHOLD') or 4)  # max differing bits of the 64-bit perceptual hash
+    
+    # Test-time augmentation (see preprocessing.VIEWS)
+    TTA_VIEWS = int(os.environ.get('TTA_VIEWS') or 1)  # views embedded per query image; 1 is the plain center crop
+    TTA_AGGREGATION = os.environ.get('TTA_AGGREGATION') or 'mean'  # mean: one averaged query vector; multi: one query per view
+    
+    # /api/search batch endpoint
+    SEARCH_MAX_IMAGES = int(os.environ.get('SEARCH_MAX_IMAGES') or 32)  # images per request
+    SEARCH_WORKERS = int(os.environ.get('SEARCH_WORKERS') or 8)  # threads decoding, downloading and querying
+    SEARCH_URL_TIMEOUT = float(os.environ.get('SEARCH_URL_TIMEOUT') or 10)  # seconds per image URL download
+    SEARCH_URL_ENABLED = os.environ.get('SEARCH_URL_ENABLED', '1').lower() in ('1', 'true', 'yes')  # accept image URLs; 0 for uploads and base64 only
+    SEARCH_URL_ALLOWED_HOSTS = [h.strip().lower() for h in os.environ.get('SEARCH_URL_ALLOWED_HOSTS', '').split(',') if h.strip()]  # image URL hosts and their subdomains; empty allows any public host
+    STREAM_REFINE_FACTOR = int(os.environ.get('STREAM_REFINE_FACTOR') or 4)  # /api/search/stream: wider search for the refined results
+    
+    # Bulk search jobs (see jobs.py)
+    JOBS_ENABLED = os.environ.get('JOBS_ENABLED', '0').lower() in ('1', 'true', 'yes')  # run job threads in each web worker; off, run `python jobs.py worker`
+    JOBS_DIR = os.environ.get('JOBS_DIR') or 'jobs'  # uploaded archives and the images extracted from them
+    JOBS_DB_PATH = os.environ.get('JOBS_DB_PATH') or os.path.join(JOBS_DIR, 'jobs.db')  # job state; keep it on a volume so restarts resume
+    JOBS_INPUT_DIR = os.environ.get('JOBS_INPUT_DIR', '')  # local paths jobs may read; unset allows archive uploads only
+    JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS') or 1)  # job threads per process
+    JOBS_BATCH_SIZE = int(os.environ.get('JOBS_BATCH_SIZE') or 8)  # images searched together
+    JOBS_RATE_LIMIT = float(os.environ.get('JOBS_RATE_LIMIT') or 4)  # images per second per process; 0 for no limit
+    JOBS_LEASE_SECONDS = float(os.environ.get('JOBS_LEASE_SECONDS') or 60)  # a job not renewed for this long is resumed by another process
+    JOBS_MAX_IMAGES = int(os.environ.get('JOBS_MAX_IMAGES') or 100000)  # images per job
+    JOBS_MAX_UPLOAD_MB = int(os.environ.get('JOBS_MAX_UPLOAD_MB') or 2048)  # archive upload limit, instead of MAX_CONTENT_LENGTH
+    JOBS_MAX_EXTRACT_MB = int(os.environ.get('JOBS_MAX_EXTRACT_MB') or 4096)  # images written per extracted archive, against zip bombs
+    
+    # Address scoring and calibration (see postprocess.py)
+    RESULT_AGGREGATION = os.environ.get('RESULT_AGGREGATION') or 'max'  # per-address score: max, or sum of the best RESULT_TOP_M matches
+    RESULT_TOP_M = int(os.environ.get('RESULT_TOP_M') or 3)  # matches summed per address with RESULT_AGGREGATION=sum
+    RESULT_MAX_PER_STREET = int(os.environ.get('RESULT_MAX_PER_STREET') or 0)  # addresses per street before other streets move up; 0 for no limit
+    CALIBRATION_PATH = os.environ.get('CALIBRATION_PATH')  # score calibration fitted by calibrate.py, e.g. calibration.json
+    
+    # Patch-feature re-ranking of close calls (see rerank.py)
+    RERANK_ENABLED = os.environ.get('RERANK_ENABLED', '0').lower() in ('1', 'true', 'yes')
+    RERANK_DIR = os.environ.get('RERANK_DIR') or 'rerank'  # feature store built by rerank.py build
+    RERANK_CANDIDATES = int(os.environ.get('RERANK_CANDIDATES') or 20)  # addresses re-scored
+    RERANK_GAP = float(os.environ.get('RERANK_GAP') or 0.02)  # re-rank when top-1 minus top-2 score is below this
+    RERANK_WEIGHT = float(os.environ.get('RERANK_WEIGHT') or 0.5)  # share of the patch score in the blended score
+    RERANK_BUDGET_MS = float(os.environ.get('RERANK_BUDGET_MS') or 250)  # give up on the extra forward pass after this
 
 # Images folder path - use environment variable for GCP
 IMAGES_FOLDER = os.getenv('IMAGES_FOLDER', '/Users/alex/Desktop/addresses-paris')
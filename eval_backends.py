@@ -0,0 +1,131 @@
+"""
+Compare inference backends against the fp32 baseline on a held-out image set.
+
+For every image the fp32 eager model and each candidate backend embed the
+same preprocessed input, both embeddings are searched in the vector index,
+and the unique addresses returned are compared. Reports top-k address recall
+(share of the fp32 addresses the backend also finds), top-1 agreement,
+embedding cosine similarity and forward-pass time per image.
+
+Usage:
+    python eval_backends.py /path/to/held-out-images --backends int8 torchscript
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+from model_loader import INFERENCE_BACKENDS, load_dinov2_model, optimize_model
+from preprocessing import open_image, preprocess_images
+from query_pinecone import dedupe_addresses
+from vector_store import get_vector_store
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+
+def list_images(folder):
+    return sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def embed(model, batch):
+    """Return (embeddings, seconds) for one forward pass."""
+    start = time.perf_counter()
+    with torch.no_grad():
+        embeddings = model(batch)
+    return embeddings, time.perf_counter() - start
+
+
+def search_addresses(vector, top_k, max_results):
+    response = get_vector_store().query_grouped(vector=vector.tolist(), top_k=top_k, max_results=max_results)
+    return [r['address'] for r in dedupe_addresses(response['matches'], top_k)]
+
+
+def evaluate(paths, backends, top_k=5, max_results=50, batch_size=8):
+    """
+    Evaluate backends against fp32 eager inference.
+
+    Args:
+        paths: Held-out image files
+        backends: Backend names to compare (see model_loader.INFERENCE_BACKENDS)
+        top_k: Unique addresses compared per image (default: 5)
+        max_results: Matches fetched by the first query per image (default: 50)
+        batch_size: Images per forward pass (default: 8)
+
+    Returns:
+        Dict mapping backend name to its metrics; 'eager' is the baseline
+    """
+    baseline = load_dinov2_model()
+    models = {'eager': baseline}
+    for backend in backends:
+        models[backend] = optimize_model(baseline, backend)
+
+    totals = {name: {'recall': 0.0, 'top1': 0, 'cosine': 0.0, 'seconds': 0.0} for name in models}
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        images = []
+        for path in chunk:
+            with open(path, 'rb') as f:
+                images.append(open_image(f.read()))
+        batch = preprocess_images(images)
+
+        reference, seconds = embed(baseline, batch)
+        totals['eager']['seconds'] += seconds
+        reference_addresses = [search_addresses(v, top_k, max_results) for v in reference]
+        for name, model in models.items():
+            if name == 'eager':
+                totals[name]['recall'] += len(chunk)
+                totals[name]['top1'] += len(chunk)
+                totals[name]['cosine'] += len(chunk)
+                continue
+            embeddings, seconds = embed(model, batch)
+            totals[name]['seconds'] += seconds
+            totals[name]['cosine'] += torch.nn.functional.cosine_similarity(reference, embeddings).sum().item()
+            for vector, expected in zip(embeddings, reference_addresses):
+                found = search_addresses(vector, top_k, max_results)
+                if expected:
+                    totals[name]['recall'] += len(set(found) & set(expected)) / len(expected)
+                else:
+                    totals[name]['recall'] += 1.0
+                totals[name]['top1'] += bool(found and expected and found[0] == expected[0])
+
+    count = len(paths)
+    return {
+        name: {
+            'recall_at_k': t['recall'] / count,
+            'top1_agreement': t['top1'] / count,
+            'mean_cosine': t['cosine'] / count,
+            'ms_per_image': 1000 * t['seconds'] / count,
+        }
+        for name, t in totals.items()
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare inference backends against fp32 on held-out images")
+    parser.add_argument('images', help="Folder of held-out query images")
+    parser.add_argument('--backends', nargs='+', default=['int8', 'torchscript'],
+                        choices=[b for b in INFERENCE_BACKENDS if b != 'eager'])
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--max-results', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--min-recall', type=float, default=0.9,
+                        help="Exit with status 1 if any backend's recall@k is below this")
+    args = parser.parse_args()
+
+    paths = list_images(args.images)
+    if not paths:
+        print(f"No images found in {args.images}")
+        sys.exit(2)
+    report = evaluate(paths, args.backends, args.top_k, args.max_results, args.batch_size)
+
+    print(f"{len(paths)} images, top_k={args.top_k}")
+    print(f"{'backend':<12} {'recall@k':>9} {'top-1':>7} {'cosine':>8} {'ms/img':>8}")
+    for name, m in report.items():
+        print(f"{name:<12} {m['recall_at_k']:>9.3f} {m['top1_agreement']:>7.3f} "
+              f"{m['mean_cosine']:>8.4f} {m['ms_per_image']:>8.1f}")
+    sys.exit(0 if all(m['recall_at_k'] >= args.min_recall for m in report.values()) else 1)
@@ -0,0 +1,28 @@
+import os
+
+bind = '0.0.0.0:8080'
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+timeout = 120
+
+# Threaded workers: while one request waits on the vector store, the others
+# keep running. Inference stays on the batch scheduler's single thread, so
+# extra threads only add concurrent I/O, never concurrent forward passes.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+
+# Import the app (and, with MODEL_PRELOAD, the model weights) once in the
+# master so forked workers share the weights copy-on-write.
+preload_app = True
+
+
+def post_fork(server, worker):
+    from config import Config
+    import model_loader
+    threads = model_loader.configure_threads(server.cfg.workers)
+    server.log.info(f"Worker {worker.pid} uses {threads} torch threads")
+    if Config.MODEL_PRELOAD:
+        model_loader.start_warm_up()
+    if Config.JOBS_ENABLED:
+        # Run bulk jobs in every worker; by default `python jobs.py worker` runs them
+        import jobs
+        jobs.get_job_runner().start()
@@ -0,0 +1,359 @@
+"""
+Bulk index build: embed a folder (or bucket) of address photos and upsert them.
+
+Addresses come from the file layout: an image inside a sub-folder takes the
+folder name as its address ("26 rue etex, 75018 Paris, France/IMG_1.jpg"),
+an image at the top level takes its file name without a trailing "_<n>"
+("26 rue etex, 75018 Paris, France_2.jpg"). Vector IDs are the relative
+path passed through to_ascii_id.
+
+Images are decoded in a thread pool a few batches ahead of the model,
+embedded in batches, and upserted in batches with retries. Every upserted
+batch is appended to a checkpoint manifest, so an interrupted run picks up
+where it stopped.
+
+With --update, only photos not in the manifest are embedded, and photos no
+longer in the source are deleted from the index. For a local store the
+changes are published as a new version that running workers pick up
+without a restart (see update_local_store in vector_store.py).
+
+Usage:
+    python ingest.py --source /data/addresses-paris --target pinecone
+    python ingest.py --source gs://real-estate-images/paris-18 --target local --output index
+    python ingest.py --source /data/addresses-paris --target local --output index --update
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from config import Config, IMAGES_FOLDER, PROJECT_ID
+from model_loader import device, get_model
+from preprocessing import open_image, preprocess_images
+from query_pinecone import to_ascii_id
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+
+# --- Sources ---
+class FolderSource:
+    """Images under a local folder, also used as a stand-in for the bucket."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def keys(self):
+        keys = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    keys.append(os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, '/'))
+        return sorted(keys)
+
+    def read(self, key):
+        with open(os.path.join(self.root, key), 'rb') as f:
+            return f.read()
+
+
+class BucketSource:
+    """Images under a gs://bucket/prefix location."""
+
+    def __init__(self, url):
+        from google.cloud import storage
+
+        bucket_name, _, self.prefix = url[len('gs://'):].partition('/')
+        self.bucket = storage.Client(project=PROJECT_ID).bucket(bucket_name)
+
+    def keys(self):
+        return sorted(
+            blob.name[len(self.prefix):].lstrip('/')
+            for blob in self.bucket.list_blobs(prefix=self.prefix)
+            if blob.name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+
+    def read(self, key):
+        name = f"{self.prefix.rstrip('/')}/{key}" if self.prefix else key
+        return self.bucket.blob(name).download_as_bytes()
+
+
+def address_from_key(key):
+    """Derive the address of an image from its path relative to the source root."""
+    parts = key.split('/')
+    if len(parts) > 1:
+        return parts[-2]
+    stem = os.path.splitext(parts[-1])[0]
+    return re.sub(r'_\d+$', '', stem)
+
+
+def vector_id(key):
+    """Vector ID of an image: its relative path without extension, as ASCII."""
+    return to_ascii_id(os.path.splitext(key)[0])
+
+
+# --- Sinks ---
+def with_retries(fn, attempts=5, base_delay=1.0):
+    """Call fn, retrying with exponential backoff on any exception."""
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == attempts - 1:
+                raise
+            wait_time = base_delay * 2 ** attempt
+            print(f"Upsert failed ({e}), retrying in {wait_time:.0f}s...")
+            time.sleep(wait_time)
+
+
+class PineconeSink:
+    """Upserts into the configured Pinecone index, optionally into one namespace (shard)."""
+
+    def __init__(self, namespace=None):
+        from pinecone_pool import index_manager
+
+        self.index, _ = index_manager.get_index()
+        self.kwargs = {'namespace': namespace} if namespace else {}
+
+    def write(self, ids, vectors, metadata):
+        records = [
+            {'id': vector_id, 'values': vector.tolist(), 'metadata': meta}
+            for vector_id, vector, meta in zip(ids, vectors, metadata)
+        ]
+        with_retries(lambda: self.index.upsert(vectors=records, show_progress=False, **self.kwargs))
+
+    def remove(self, ids):
+        with_retries(lambda: self.index.delete(ids=list(ids), **self.kwargs))
+
+    def finalize(self):
+        pass
+
+
+class LocalSink:
+    """
+    Writes each batch as a chunk file, then merges the chunks into a local
+    vector store (see vector_store.py) when the run completes.
+
+    With update=True the chunks of this run are added to the existing store
+    as a new version instead, and are cleared once it is published.
+    """
+
+    def __init__(self, directory, update=False):
+        self.directory = directory
+        # Without a store yet, the first run builds it in full
+        self.update = update and any(os.path.exists(os.path.join(directory, name)) for name in ('CURRENT', 'ids.npy'))
+        self.chunk_dir = os.path.join(directory, 'chunks-update' if self.update else 'chunks')
+        self.removed = set()
+        os.makedirs(self.chunk_dir, exist_ok=True)
+
+    def remove(self, ids):
+        self.removed.update(ids)
+
+    def write(self, ids, vectors, metadata):
+        name = f"{len(os.listdir(self.chunk_dir)):08d}.npz"
+        tmp_path = os.path.join(self.chunk_dir, name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, ids=np.asarray(ids, dtype=str), vectors=vectors,
+                     addresses=np.asarray([m['address'] for m in metadata], dtype=str))
+        os.replace(tmp_path, os.path.join(self.chunk_dir, name))
+
+    def finalize(self):
+        import shutil
+
+        from vector_store import update_local_store, write_local_store
+
+        # A chunk written just before a crash, but not yet in the manifest, is
+        # written again on resume; keep the latest copy of each ID
+        rows = {}
+        for name in sorted(os.listdir(self.chunk_dir)):
+            if name.endswith('.npz'):
+                with np.load(os.path.join(self.chunk_dir, name)) as chunk:
+                    for vector_id, vector, address in zip(chunk['ids'].tolist(), chunk['vectors'],
+                                                          chunk['addresses'].tolist()):
+                        rows[vector_id] = (vector, address)
+        for vector_id in self.removed:
+            rows.pop(vector_id, None)
+        vectors = np.stack([v for v, _ in rows.values()]) if rows else None
+        addresses = [a for _, a in rows.values()]
+        if self.update:
+            if rows or self.removed:
+                version = update_local_store(self.directory, list(rows), vectors, addresses, remove=self.removed)
+                print(f"Published local store version {version}: {len(rows)} added, {len(self.removed)} removed")
+            shutil.rmtree(self.chunk_dir)
+        elif rows:
+            write_local_store(self.directory, list(rows), vectors, addresses)
+            print(f"Wrote local store with {len(rows)} vectors to {self.directory}")
+
+
+# --- Checkpoint manifest ---
+class Manifest:
+    """Append-only record of the keys already upserted (or failed to decode)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        entry = json.loads(line)
+                        if entry['status'] == 'removed':
+                            self.done.difference_update(entry['keys'])
+                        else:
+                            self.done.update(entry['keys'])
+
+    def record(self, keys, status='upserted'):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'status': status, 'keys': keys}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if status == 'removed':
+            self.done.difference_update(keys)
+        else:
+            self.done.update(keys)
+
+
+# --- Pipeline ---
+class StageTimer:
+    """Busy time and item counts per pipeline stage."""
+
+    def __init__(self):
+        self.seconds = {}
+        self.items = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, items):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.items[stage] = self.items.get(stage, 0) + items
+
+    def report(self, workers):
+        parts = []
+        for stage, seconds in self.seconds.items():
+            # Decoding runs on `workers` threads at once
+            busy = seconds / workers if stage == 'decode' else seconds
+            parts.append(f"{stage} {self.items[stage] / busy if busy else 0:.1f} img/s")
+        return ", ".join(parts)
+
+
+def _decode(source, key, timer):
+    start = time.perf_counter()
+    try:
+        img = open_image(source.read(key))
+    except Exception as e:
+        print(f"Skipping {key}: {e}")
+        img = None
+    timer.add('decode', time.perf_counter() - start, 1)
+    return key, img
+
+
+def _decoded_batches(source, keys, batch_size, pool, timer, prefetch=2):
+    # Keep `prefetch` batches decoding while the model works on the current one
+    pending = deque()
+    for start in range(0, len(keys), batch_size):
+        pending.append([pool.submit(_decode, source, key, timer) for key in keys[start:start + batch_size]])
+        if len(pending) > prefetch:
+            yield [f.result() for f in pending.popleft()]
+    while pending:
+        yield [f.result() for f in pending.popleft()]
+
+
+def ingest(source, sink, manifest, batch_size=32, upsert_batch_size=256, workers=4, prune=False):
+    """
+    Embed every image of the source not yet in the manifest and write it to the sink.
+
+    Args:
+        source: FolderSource or BucketSource
+        sink: PineconeSink or LocalSink
+        manifest: Manifest of already processed keys
+        batch_size: Images per forward pass (default: 32)
+        upsert_batch_size: Vectors per upsert (default: 256)
+        workers: Decoding threads (default: 4)
+        prune: Also delete images that are in the manifest but no longer in the source
+
+    Returns:
+        Number of images upserted in this run
+    """
+    source_keys = source.keys()
+    keys = [key for key in source_keys if key not in manifest.done]
+    removed = sorted(manifest.done.difference(source_keys)) if prune else []
+    print(f"{len(manifest.done)} images already done, {len(keys)} to go, {len(removed)} to remove")
+    if removed:
+        sink.remove([vector_id(key) for key in removed])
+    model = get_model()
+    timer = StageTimer()
+    started = time.perf_counter()
+    buffer_ids, buffer_keys, buffer_vectors, buffer_meta = [], [], [], []
+    upserted = 0
+
+    def flush():
+        nonlocal upserted
+        start = time.perf_counter()
+        sink.write(buffer_ids, np.stack(buffer_vectors), buffer_meta)
+        timer.add('upsert', time.perf_counter() - start, len(buffer_ids))
+        manifest.record(list(buffer_keys))
+        upserted += len(buffer_ids)
+        for buffer in (buffer_ids, buffer_keys, buffer_vectors, buffer_meta):
+            buffer.clear()
+        elapsed = time.perf_counter() - started
+        print(f"{upserted}/{len(keys)} images, {upserted / elapsed:.1f} img/s overall ({timer.report(workers)})")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch in _decoded_batches(source, keys, batch_size, pool, timer):
+            failed = [key for key, img in batch if img is None]
+            if failed:
+                manifest.record(failed, status='failed')
+            batch = [(key, img) for key, img in batch if img is not None]
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            with torch.no_grad():
+                embeddings = model(preprocess_images([img for _, img in batch]).to(device)).cpu().numpy()
+            timer.add('embed', time.perf_counter() - start, len(batch))
+
+            for (key, _), embedding in zip(batch, embeddings):
+                buffer_ids.append(vector_id(key))
+                buffer_keys.append(key)
+                buffer_vectors.append(embedding.astype(np.float32))
+                buffer_meta.append({'address': address_from_key(key), 'image': key})
+            if len(buffer_ids) >= upsert_batch_size:
+                flush()
+    if buffer_ids:
+        flush()
+    sink.finalize()
+    if removed:
+        manifest.record(removed, status='removed')
+    return upserted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed address photos and upsert them into the index")
+    parser.add_argument('--source', default=IMAGES_FOLDER,
+                        help="Image folder or gs://bucket/prefix (default: IMAGES_FOLDER)")
+    parser.add_argument('--target', choices=['pinecone', 'local'], default='pinecone')
+    parser.add_argument('--output', default=Config.LOCAL_INDEX_DIR, help="Local store directory for --target local")
+    parser.add_argument('--manifest', help="Checkpoint manifest (default: ingest-manifest.jsonl, in --output for local)")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--upsert-batch-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--namespace', help="Pinecone namespace to write, for sharded search (e.g. 75018)")
+    parser.add_argument('--update', action='store_true',
+                        help="Delete images no longer in the source; for --target local, publish the changes "
+                             "as a new version of the existing store")
+    args = parser.parse_args()
+
+    source = BucketSource(args.source) if args.source.startswith('gs://') else FolderSource(args.source)
+    sink = LocalSink(args.output, update=args.update) if args.target == 'local' else PineconeSink(args.namespace)
+    manifest_path = args.manifest or (
+        os.path.join(args.output, 'ingest-manifest.jsonl') if args.target == 'local' else 'ingest-manifest.jsonl'
+    )
+    count = ingest(source, sink, Manifest(manifest_path), args.batch_size, args.upsert_batch_size, args.workers,
+                   prune=args.update)
+    print(f"Done: {count} images upserted")
@@ -0,0 +1,694 @@
+"""
+Background bulk search jobs.
+
+A job is a list of images, from an uploaded zip/tar archive or from local
+paths under JOBS_INPUT_DIR, searched in the background. Submitting only
+saves the archive; the job thread that takes the job extracts it first, so
+the request returns at once, whatever the archive's size. Its state lives in a
+SQLite file (JOBS_DB_PATH): one row per job and one per image, holding the
+image's JSON result once searched. A restarted process picks up every
+unfinished job where it stopped.
+
+`python jobs.py worker` (or, with JOBS_ENABLED, each web worker) runs
+JOBS_WORKERS job threads.
+A thread leases the oldest unfinished job, renews the lease as it goes, and
+searches its pending images JOBS_BATCH_SIZE at a time through
+query_images_unique_addresses: one batched forward pass, then concurrent
+vector queries. A job whose lease has run out, because its process died, is
+taken over by another thread, at once when that process was on this host.
+
+Bulk work must never slow down interactive searches. Job threads are held to
+JOBS_RATE_LIMIT images per second per process, and wait before each batch
+until this process has no search request in flight and nothing queued for
+the model. Their images are queued as background work on the batch
+scheduler, behind any interactive image and in passes of at most
+BATCH_BACKGROUND_SIZE images.
+
+Usage:
+    curl -F archive=@listings.zip https://<host>/api/jobs
+    python jobs.py worker
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+
+from admission import admission
+from batching import QueueFullError, get_scheduler
+from config import Config
+from metrics import registry
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+JOB_IMAGES = registry.counter('job_images_total', "Images searched by bulk jobs", ('outcome',))
+
+# A job fails after this many batches in a row raised an error
+MAX_BATCH_ERRORS = 5
+
+
+# --- Job state ---
+def runner_alive(runner):
+    """False when a runner ("host:pid:thread") belongs to a process of this host that has exited."""
+    host, pid, _ = (runner or '::').rsplit(':', 2)
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    """
+    Jobs and their per-image results in a SQLite file shared by every process on the host.
+
+    Args:
+        path: SQLite database file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, created_at REAL, "
+                     "started_at REAL, finished_at REAL, params TEXT, total INTEGER, error TEXT, "
+                     "runner TEXT, lease_until REAL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS job_items (job_id TEXT, seq INTEGER, name TEXT, path TEXT, "
+                     "status TEXT, result TEXT, PRIMARY KEY (job_id, seq))")
+
+    def _connection(self):
+        # One connection per thread and per process, as in cache.SQLiteCache
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, job_id, items, params):
+        """
+        Queue a job.
+
+        Args:
+            job_id: New job ID
+            items: List of (name, path) per image, in result order
+            params: Search parameters: top_k, shards and views
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO jobs (id, status, created_at, params, total) VALUES (?, 'queued', ?, ?, ?)",
+                         (job_id, time.time(), json.dumps(params), len(items)))
+            conn.executemany("INSERT INTO job_items (job_id, seq, name, path, status) VALUES (?, ?, ?, ?, 'pending')",
+                             [(job_id, seq, name, path) for seq, (name, path) in enumerate(items)])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, job_id):
+        """The job's row as a dict, with 'done', 'failed' and 'pending' image counts, or None."""
+        conn = self._connection()
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row, params=json.loads(row['params']), done=0, failed=0, pending=0)
+        for status, count in conn.execute("SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status",
+                                          (job_id,)):
+            job[status] = count
+        return job
+
+    def claim(self, runner, lease):
+        """
+        Lease the oldest unfinished job that no live runner holds.
+
+        Returns:
+            The job (see get), or None when there is nothing to do
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            job_id = None
+            for row in conn.execute("SELECT id, runner, lease_until FROM jobs WHERE status IN ('queued', 'running') "
+                                    "ORDER BY created_at"):
+                if row['lease_until'] is None or row['lease_until'] < now or not runner_alive(row['runner']):
+                    job_id = row['id']
+                    break
+            if job_id is not None:
+                conn.execute("UPDATE jobs SET status = 'running', started_at = COALESCE(started_at, ?), "
+                             "runner = ?, lease_until = ? WHERE id = ?", (now, runner, now + lease, job_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(job_id) if job_id is not None else None
+
+    def renew(self, job_id, runner, lease):
+        """Extend a lease; False when the job was cancelled or another runner holds it."""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND runner = ? AND status = 'running'",
+            (time.time() + lease, job_id, runner))
+        return cursor.rowcount == 1
+
+    def pending(self, job_id, limit):
+        """Up to limit (seq, name, path) of images not searched yet, in order."""
+        return [tuple(row) for row in self._connection().execute(
+            "SELECT seq, name, path FROM job_items WHERE job_id = ? AND status = 'pending' ORDER BY seq LIMIT ?",
+            (job_id, limit))]
+
+    def record(self, job_id, runner, outcomes):
+        """
+        Store the results of some images: (seq, 'done' or 'failed', result dict) each.
+
+        Returns:
+            False, storing nothing, when the job was cancelled or another runner holds it
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.executemany(
+                "UPDATE job_items SET status = ?, result = ? WHERE job_id = ? AND seq = ? AND EXISTS "
+                "(SELECT 1 FROM jobs WHERE id = job_items.job_id AND status = 'running' AND runner = ?)",
+                [(status, json.dumps(result), job_id, seq, runner) for seq, status, result in outcomes])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount > 0
+
+    def add_items(self, job_id, runner, items):
+        """
+        Append the images extracted from a job's archive and drop the archive from its params.
+
+        Returns:
+            False, storing nothing, when the job was cancelled or another runner holds it
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT total, params FROM jobs WHERE id = ? AND status = 'running' AND runner = ?",
+                               (job_id, runner)).fetchone()
+            if row is not None:
+                params = json.loads(row['params'])
+                params.pop('archive', None)
+                conn.executemany("INSERT INTO job_items (job_id, seq, name, path, status) "
+                                 "VALUES (?, ?, ?, ?, 'pending')",
+                                 [(job_id, row['total'] + i, name, path) for i, (name, path) in enumerate(items)])
+                conn.execute("UPDATE jobs SET total = ?, params = ? WHERE id = ?",
+                             (row['total'] + len(items), json.dumps(params), job_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row is not None
+
+    def finish(self, job_id, status, error=None):
+        """Mark a job done, failed or cancelled and release its lease; False if it had already finished."""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_until = NULL "
+            "WHERE id = ? AND status IN ('queued', 'running')", (status, error, time.time(), job_id))
+        return cursor.rowcount == 1
+
+    def finished(self, job_ids):
+        """The IDs among job_ids of jobs that are done, failed or cancelled."""
+        if not job_ids:
+            return []
+        return [row[0] for row in self._connection().execute(
+            f"SELECT id FROM jobs WHERE id IN ({','.join('?' * len(job_ids))}) "
+            "AND status NOT IN ('queued', 'running')", list(job_ids))]
+
+    def results(self, job_id, after=-1):
+        """Yield the stored result of each searched image after seq `after`, as JSON text, in order."""
+        yield from (row[0] for row in self._connection().execute(
+            "SELECT result FROM job_items WHERE job_id = ? AND seq > ? AND status != 'pending' ORDER BY seq",
+            (job_id, after)))
+
+
+# --- Submission ---
+def job_directory(job_id):
+    return os.path.join(Config.JOBS_DIR, job_id)
+
+
+def upload_path(job_id):
+    # Uploaded archive, removed once extracted
+    return os.path.join(job_directory(job_id), 'upload')
+
+
+def is_archive(path):
+    """True for a zip or tar archive file."""
+    return os.path.isfile(path) and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path))
+
+
+def extract_archive(archive, directory, keep_going=None):
+    """
+    Extract the images of a zip or tar archive.
+
+    Members are written under numbered names, so no member path can escape
+    the directory. At most JOBS_MAX_EXTRACT_MB are written, counting the
+    bytes actually decompressed rather than the sizes the archive declares;
+    the directory is removed when extraction fails.
+
+    Args:
+        archive: Path of the archive file
+        directory: Output directory
+        keep_going: Optional callable run before each member; extraction
+                    stops with a ValueError when it returns False
+
+    Returns:
+        List of (member name, extracted path), in archive order
+    """
+    os.makedirs(directory, exist_ok=True)
+    items = []
+    limit = Config.JOBS_MAX_EXTRACT_MB * 1024 * 1024
+    written = 0
+
+    def add(name, source, size):
+        nonlocal written
+        if keep_going is not None and not keep_going():
+            source.close()
+            raise ValueError("Extraction stopped")
+        if len(items) >= Config.JOBS_MAX_IMAGES:
+            raise ValueError(f"At most {Config.JOBS_MAX_IMAGES} images per job")
+        if written + size > limit:
+            raise ValueError(f"Archive expands to more than {Config.JOBS_MAX_EXTRACT_MB}MB")
+        path = os.path.join(directory, f"{len(items):06d}{os.path.splitext(name)[1].lower()}")
+        with source, open(path, 'wb') as f:
+            while chunk := source.read(1024 * 1024):
+                written += len(chunk)
+                if written > limit:
+                    raise ValueError(f"Archive expands to more than {Config.JOBS_MAX_EXTRACT_MB}MB")
+                f.write(chunk)
+        items.append((name, path))
+
+    try:
+        if zipfile.is_zipfile(archive):
+            with zipfile.ZipFile(archive) as zf:
+                for info in zf.infolist():
+                    if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                        add(info.filename, zf.open(info), info.file_size)
+        elif tarfile.is_tarfile(archive):
+            with tarfile.open(archive) as tf:
+                for member in tf:
+                    if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                        add(member.name, tf.extractfile(member), member.size)
+        else:
+            raise ValueError("Expected a zip or tar archive")
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise ValueError(f"Corrupt archive: {e}")
+    except Exception:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    return items
+
+
+def input_path(path):
+    """Resolve a submitted local path, which must lie under Config.JOBS_INPUT_DIR."""
+    if not Config.JOBS_INPUT_DIR:
+        raise ValueError("Local paths are disabled; set JOBS_INPUT_DIR or upload an archive")
+    root = os.path.realpath(Config.JOBS_INPUT_DIR)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"Path outside JOBS_INPUT_DIR: {path}")
+    if not os.path.exists(resolved):
+        raise ValueError(f"No such file or directory: {path}")
+    return resolved
+
+
+def expand_paths(paths):
+    """
+    List the images named by local paths; a directory stands for every image under it.
+
+    Returns:
+        List of (path as submitted or relative to JOBS_INPUT_DIR, resolved path)
+    """
+    items = []
+    root = os.path.realpath(Config.JOBS_INPUT_DIR or '.')
+    for path in paths:
+        resolved = input_path(str(path))
+        if os.path.isdir(resolved):
+            for dirpath, _, filenames in sorted(os.walk(resolved)):
+                for name in sorted(filenames):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        full = os.path.join(dirpath, name)
+                        items.append((os.path.relpath(full, root).replace(os.sep, '/'), full))
+        else:
+            items.append((str(path), resolved))
+        if len(items) > Config.JOBS_MAX_IMAGES:
+            raise ValueError(f"At most {Config.JOBS_MAX_IMAGES} images per job")
+    return items
+
+
+def submit_job(archive=None, paths=None, top_k=5, shards=None, views=1):
+    """
+    Queue a bulk search job.
+
+    An archive is only saved here, and checked to be a zip or tar file; the
+    job thread that takes the job extracts it, adding its images after
+    those of paths.
+
+    Args:
+        archive: Uploaded zip/tar archive as a file-like object, or a local
+                 path to one under JOBS_INPUT_DIR
+        paths: Local image files or directories under JOBS_INPUT_DIR
+        top_k: Addresses returned per image (default: 5)
+        shards: Optional location hint (see query_image_unique_addresses)
+        views: Test-time augmentation views per image (default: 1)
+
+    Returns:
+        The new job (see JobStore.get); its total leaves out the archive's
+        images until they have been extracted
+    """
+    job_id = uuid.uuid4().hex
+    params = {'top_k': top_k, 'shards': shards, 'views': views}
+    try:
+        if archive is not None:
+            if hasattr(archive, 'read'):
+                os.makedirs(job_directory(job_id), exist_ok=True)
+                path = upload_path(job_id)
+                with open(path, 'wb') as f:
+                    shutil.copyfileobj(archive, f)
+            else:
+                path = input_path(archive)
+            if not is_archive(path):
+                raise ValueError("Expected a zip or tar archive")
+            params['archive'] = path
+        items = expand_paths(paths or [])
+        if not items and archive is None:
+            raise ValueError("No images in the job")
+        store = get_job_store()
+        store.create(job_id, items, params)
+    except Exception:
+        shutil.rmtree(job_directory(job_id), ignore_errors=True)
+        raise
+    print(f"Queued job {job_id} with {len(items)} images" + (" and an archive" if archive is not None else ""))
+    return store.get(job_id)
+
+
+def job_summary(job):
+    """Public view of a job: status, image counts, progress, rate and ETA."""
+    processed = job['done'] + job['failed']
+    extracting = 'archive' in job['params']
+    elapsed = (job['finished_at'] or time.time()) - job['started_at'] if job['started_at'] else None
+    rate = processed / elapsed if elapsed and processed else None
+    return {
+        'id': job['id'],
+        'status': job['status'],
+        'total': job['total'],
+        'done': job['done'],
+        'failed': job['failed'],
+        'pending': job['pending'],
+        'extracting': extracting,
+        'progress': round(processed / job['total'], 4) if job['total'] and not extracting else
+                    float(job['status'] == 'done'),
+        'images_per_second': round(rate, 2) if rate else None,
+        'eta_seconds': round(job['pending'] / rate) if rate and job['status'] == 'running' else None,
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'error': job['error'],
+        'params': {key: job['params'].get(key) for key in ('top_k', 'shards', 'views')},
+    }
+
+
+# --- Workers ---
+class RateLimiter:
+    """
+    Token bucket shared by the job threads of a process.
+
+    Args:
+        rate: Images per second; 0 for no limit
+        burst: Images that may go at once after an idle period
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def delay(self, count):
+        """Take count tokens, returning how long the caller must wait before using them."""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= count
+            return max(0.0, -self.tokens / self.rate)
+
+
+class JobRunner:
+    """
+    Job threads of one process.
+
+    Args:
+        store: JobStore
+        workers: Job threads (default: Config.JOBS_WORKERS)
+        batch_size: Images searched together (default: Config.JOBS_BATCH_SIZE)
+        rate: Images per second for all threads together (default: Config.JOBS_RATE_LIMIT)
+        lease: Seconds a job stays leased without renewal (default: Config.JOBS_LEASE_SECONDS)
+    """
+
+    def __init__(self, store, workers=None, batch_size=None, rate=None, lease=None):
+        self.store = store
+        self.workers = workers or Config.JOBS_WORKERS
+        self.batch_size = batch_size or Config.JOBS_BATCH_SIZE
+        self.limiter = RateLimiter(Config.JOBS_RATE_LIMIT if rate is None else rate, self.batch_size)
+        self.lease = lease or Config.JOBS_LEASE_SECONDS
+        self.poll = 2.0
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start the job threads, once per process."""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, args=(f"{socket.gethostname()}:{os.getpid()}:{i}",),
+                                          name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self, runner):
+        while not self._stopped.is_set():
+            try:
+                job = self.store.claim(runner, self.lease)
+                if job is None:
+                    self._sweep()
+                    self._stopped.wait(self.poll)
+                    continue
+                self._process(job, runner)
+                self._sweep()
+            except Exception as e:
+                print(f"Job worker {runner} failed: {e}")
+                self._stopped.wait(self.poll)
+
+    def _wait(self, seconds, job, runner, until_quiet=False):
+        # Sleep, renewing the lease; False once the job is lost or cancelled
+        deadline = time.monotonic() + seconds
+        renewed = time.monotonic()
+        while not self._stopped.is_set():
+            busy = until_quiet and (admission.inflight or get_scheduler().queue_depth())
+            if time.monotonic() >= deadline and not busy:
+                return True
+            if time.monotonic() - renewed > self.lease / 3:
+                if not self.store.renew(job['id'], runner, self.lease):
+                    return False
+                renewed = time.monotonic()
+            time.sleep(0.05)
+        return False
+
+    def _process(self, job, runner):
+        from query_pinecone import query_images_unique_addresses
+
+        if 'archive' in job['params']:
+            if not self._extract(job, runner):
+                return
+            job = self.store.get(job['id'])
+        params = job['params']
+        print(f"Job {job['id']}: {job['pending']} of {job['total']} images to search")
+        errors = 0
+        while True:
+            if not self.store.renew(job['id'], runner, self.lease):
+                print(f"Job {job['id']} was cancelled or taken over")
+                return
+            items = self.store.pending(job['id'], self.batch_size)
+            if not items:
+                break
+            # Leave the model to interactive searches
+            if not self._wait(self.limiter.delay(len(items)), job, runner, until_quiet=True):
+                return
+            try:
+                entries = query_images_unique_addresses([path for _, _, path in items], top_k=params['top_k'],
+                                                        shards=params['shards'], views=params['views'],
+                                                        background=True)
+            except QueueFullError:
+                self._wait(1.0, job, runner)
+                continue
+            except Exception as e:
+                errors += 1
+                print(f"Job {job['id']}: batch failed ({errors}/{MAX_BATCH_ERRORS}): {e}")
+                if errors >= MAX_BATCH_ERRORS:
+                    self._finish(job, 'failed', str(e))
+                    return
+                self._wait(5.0 * errors, job, runner)
+                continue
+            errors = 0
+            outcomes = []
+            for (seq, name, _), entry in zip(items, entries):
+                if 'error' in entry:
+                    outcomes.append((seq, 'failed', {'seq': seq, 'name': name, 'error': entry['error']}))
+                else:
+                    outcomes.append((seq, 'done', {'seq': seq, 'name': name, 'results': entry['results']}))
+            # A job cancelled during the batch keeps only what was stored before
+            if not self.store.record(job['id'], runner, outcomes):
+                print(f"Job {job['id']} was cancelled or taken over")
+                return
+            for _, status, _ in outcomes:
+                JOB_IMAGES.inc(outcome=status)
+        self._finish(job, 'done')
+
+    def _extract(self, job, runner):
+        # Extract the job's archive into its images; False once the job failed or was lost
+        archive = job['params']['archive']
+        renewed = time.monotonic()
+
+        def keep_going():
+            nonlocal renewed
+            if time.monotonic() - renewed < 1.0:
+                return True
+            renewed = time.monotonic()
+            return self.store.renew(job['id'], runner, self.lease)
+
+        print(f"Job {job['id']}: extracting the archive")
+        try:
+            items = extract_archive(archive, os.path.join(job_directory(job['id']), 'images'), keep_going)
+            if job['total'] + len(items) > Config.JOBS_MAX_IMAGES:
+                raise ValueError(f"At most {Config.JOBS_MAX_IMAGES} images per job")
+            if not job['total'] + len(items):
+                raise ValueError("No images in the job")
+        except (ValueError, OSError) as e:
+            if self.store.renew(job['id'], runner, self.lease):
+                self._finish(job, 'failed', str(e))
+            else:
+                print(f"Job {job['id']} was cancelled or taken over")
+            return False
+        if not self.store.add_items(job['id'], runner, items):
+            print(f"Job {job['id']} was cancelled or taken over")
+            return False
+        if archive == upload_path(job['id']):
+            os.remove(archive)
+        return True
+
+    def _finish(self, job, status, error=None):
+        if self.store.finish(job['id'], status, error):
+            # Extracted archive images are no longer needed; results stay in the database
+            shutil.rmtree(job_directory(job['id']), ignore_errors=True)
+            print(f"Job {job['id']} {status}")
+
+    def _sweep(self):
+        # Remove the extracted images of finished jobs. Cancelled jobs are
+        # left to this sweep, so no batch still reading them loses its files.
+        try:
+            names = [name for name in os.listdir(Config.JOBS_DIR) if os.path.isdir(job_directory(name))]
+        except FileNotFoundError:
+            return
+        for job_id in self.store.finished(names):
+            shutil.rmtree(job_directory(job_id), ignore_errors=True)
+
+
+def cancel_job(job_id):
+    """
+    Cancel a queued or running job; its searched images keep their results.
+    A batch in flight is not stored, and the runners remove the job's files.
+
+    Returns:
+        False if the job had already finished
+    """
+    return get_job_store().finish(job_id, 'cancelled')
+
+
+_store = None
+_runner = None
+_lock = threading.Lock()
+
+
+def get_job_store():
+    """Return this process's JobStore on Config.JOBS_DB_PATH."""
+    global _store
+    if _store is None:
+        with _lock:
+            if _store is None:
+                _store = JobStore(Config.JOBS_DB_PATH)
+    return _store
+
+
+def get_job_runner():
+    """Return this process's JobRunner, created on first use and started by the caller."""
+    global _runner
+    if _runner is None:
+        store = get_job_store()
+        with _lock:
+            if _runner is None:
+                _runner = JobRunner(store)
+    return _runner
+
+
+def _reset_after_fork():
+    # Job threads do not exist in the child
+    global _runner, _lock
+    _runner = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk search jobs")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('worker', help="Run job threads in this process until interrupted")
+    submit = commands.add_parser('submit', help="Queue a job of local images or an archive")
+    submit.add_argument('paths', nargs='*', help="Image files or directories under JOBS_INPUT_DIR")
+    submit.add_argument('--archive', help="Zip or tar archive under JOBS_INPUT_DIR")
+    submit.add_argument('--top-k', type=int, default=5)
+    submit.add_argument('--shards', help="Location hint, e.g. 75018")
+    submit.add_argument('--views', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == 'submit':
+        print(json.dumps(job_summary(submit_job(args.archive, args.paths, args.top_k, args.shards, args.views))))
+    else:
+        runner = get_job_runner()
+        runner.start()
+        print(f"Running {runner.workers} job threads on {Config.JOBS_DB_PATH}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            runner.stop()
@@ -0,0 +1,124 @@
+"""
+Load-test harness: throughput and latency of a running server as concurrency grows.
+
+For each concurrency level, that many client threads post images back to back
+for --duration seconds. Reports requests per second, latency percentiles and
+how many requests were shed with a 503.
+
+Run the server with CACHE_ENABLED=0 to measure the full decode, inference and
+vector store path; otherwise repeated images are answered from the caches.
+Use `python local_pinecone.py --latency 0.2` as the index to see how a slow
+vector store affects throughput.
+
+Usage:
+    python loadtest.py http://localhost:8080 --images /path/to/photos --concurrency 1 2 4 8 16
+"""
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+
+import requests
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run_level(url, images, concurrency, duration):
+    """
+    Post images from `concurrency` threads for `duration` seconds.
+
+    Args:
+        url: Search endpoint URL
+        images: List of (file name, bytes) posted in turn as the `file` field
+        concurrency: Number of client threads
+        duration: Seconds to keep posting
+
+    Returns:
+        Dict with throughput, latency percentiles in ms and status counts
+    """
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    counter = itertools.count()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            name, data = images[next(counter) % len(images)]
+            start = time.perf_counter()
+            try:
+                status = session.post(url, files={'file': (name, data)}, timeout=120).status_code
+            except requests.RequestException:
+                status = 'error'
+            elapsed = time.perf_counter() - start
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    latencies.append(elapsed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'requests': sum(statuses.values()),
+        'ok_per_second': len(latencies) / elapsed,
+        'p50_ms': 1000 * percentile(latencies, 0.50),
+        'p95_ms': 1000 * percentile(latencies, 0.95),
+        'p99_ms': 1000 * percentile(latencies, 0.99),
+        'shed': statuses.get(503, 0),
+        'errors': sum(n for status, n in statuses.items() if status not in (200, 503)),
+    }
+
+
+def load_images(path):
+    paths = [path] if os.path.isfile(path) else sorted(
+        os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    images = []
+    for p in paths:
+        with open(p, 'rb') as f:
+            images.append((os.path.basename(p), f.read()))
+    return images
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure throughput as client concurrency increases")
+    parser.add_argument('server', help="Base URL, e.g. http://localhost:8080")
+    parser.add_argument('--images', required=True, help="Image file or folder of images to post")
+    parser.add_argument('--endpoint', default='/', help="Search route to post to: / or /api/search (default: /)")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--duration', type=float, default=10, help="Seconds per concurrency level")
+    parser.add_argument('--json', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if not images:
+        parser.error(f"No images found in {args.images}")
+    url = args.server.rstrip('/') + args.endpoint
+
+    print(f"{'clients':>7} {'req':>6} {'ok/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'503':>5} {'err':>5}")
+    report = []
+    for concurrency in args.concurrency:
+        r = run_level(url, images, concurrency, args.duration)
+        report.append(r)
+        print(f"{r['concurrency']:>7} {r['requests']:>6} {r['ok_per_second']:>7.2f} {r['p50_ms']:>8.1f} "
+              f"{r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['shed']:>5} {r['errors']:>5}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
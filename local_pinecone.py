@@ -0,0 +1,169 @@
+"""
+Local stand-in for the Pinecone data-plane HTTP API.
+
+Serves `/query` and `/describe_index_stats` over an in-memory set of vectors so
+the app can be exercised without network access. Point the app at it with:
+
+    PINECONE_API_KEY=local PINECONE_INDEX_HOST=http://127.0.0.1:5081 python app.py
+"""
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+DIMENSION = 768
+
+
+def synthetic_index(num_vectors=10000, num_addresses=1000, dimension=DIMENSION, seed=0):
+    """
+    Build random unit vectors with address metadata.
+
+    Args:
+        num_vectors: Number of vectors to generate
+        num_addresses: Number of distinct addresses the vectors are spread over
+        dimension: Vector dimension (default: 768, as produced by dinov2_vitb14)
+        seed: Random seed so runs are reproducible
+
+    Returns:
+        Tuple (ids, vectors, metadata) with vectors as a float32 array
+    """
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((num_vectors, dimension), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = [f"img_{i}" for i in range(num_vectors)]
+    metadata = [
+        {'address': f"{i % num_addresses + 1} rue synthetique, 75018 Paris, France"}
+        for i in range(num_vectors)
+    ]
+    return ids, vectors, metadata
+
+
+class LocalPineconeServer:
+    """
+    Threaded HTTP server answering Pinecone-style queries by brute force.
+
+    Args:
+        ids: List of vector IDs
+        vectors: float32 array of shape (n, dimension)
+        metadata: List of metadata dicts, one per vector
+        host: Interface to bind (default: 127.0.0.1)
+        port: Port to bind, 0 picks a free one (default: 0)
+        latency: Artificial delay in seconds added to every query (default: 0)
+    """
+
+    def __init__(self, ids, vectors, metadata, host='127.0.0.1', port=0, latency=0.0):
+        self.ids = ids
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.metadata = metadata
+        self.latency = latency
+        self.query_count = 0
+        self.connection_count = 0
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 so clients can keep the connection alive between queries
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                server.connection_count += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, payload, status=200):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_json(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length) or b'{}')
+
+            def do_GET(self):
+                if self.path.startswith('/describe_index_stats'):
+                    self._send_json(server.describe_index_stats())
+                else:
+                    self._send_json({'message': 'Not found'}, status=404)
+
+            def do_POST(self):
+                payload = self._read_json()
+                if self.path.startswith('/query'):
+                    self._send_json(server.query(payload))
+                elif self.path.startswith('/describe_index_stats'):
+                    self._send_json(server.describe_index_stats())
+                else:
+                    self._send_json({'message': 'Not found'}, status=404)
+
+        return Handler
+
+    def describe_index_stats(self):
+        return {
+            'namespaces': {'': {'vectorCount': len(self.ids)}},
+            'dimension': self.vectors.shape[1],
+            'indexFullness': 0.0,
+            'totalVectorCount': len(self.ids),
+        }
+
+    def query(self, payload):
+        if self.latency:
+            threading.Event().wait(self.latency)
+        self.query_count += 1
+        top_k = int(payload.get('topK', 10))
+        vector = np.asarray(payload['vector'], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        scores = self.vectors @ (vector / norm if norm else vector)
+        top_k = min(top_k, len(scores))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        include_metadata = payload.get('includeMetadata', False)
+        matches = []
+        for i in best:
+            match = {'id': self.ids[i], 'score': float(scores[i]), 'values': []}
+            if include_metadata:
+                match['metadata'] = self.metadata[i]
+            matches.append(match)
+        return {'matches': matches, 'namespace': payload.get('namespace', ''), 'usage': {'readUnits': 1}}
+
+    def start(self):
+        """Serve in a background thread and return self."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5081)
+    parser.add_argument('--vectors', type=int, default=10000)
+    parser.add_argument('--addresses', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0, help="Artificial query delay in seconds")
+    args = parser.parse_args()
+
+    server = LocalPineconeServer(*synthetic_index(args.vectors, args.addresses),
+                                 host=args.host, port=args.port, latency=args.latency)
+    print(f"Local Pinecone stand-in serving {args.vectors} vectors on {server.url}")
+    server.serve_forever()
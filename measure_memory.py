@@ -0,0 +1,169 @@
+"""
+Measure memory per gunicorn worker and for the whole container at several
+worker counts.
+
+For each worker count the server is started with `gunicorn --config
+gunicorn.conf.py`, warmed up, optionally sent a few searches, and then every
+process is read from /proc/<pid>/smaps_rollup:
+
+- RSS: resident pages, counting shared ones in full in every process
+- PSS: shared pages split between the processes using them; the sum over
+  all processes is the real footprint
+- private: pages only this process uses (what one more worker costs)
+
+The container figure is the cgroup's memory.current when available (it
+includes the page cache, so the mmapped weights count once).
+
+Linux only. Usage:
+    python measure_memory.py --workers 1 2 3 4 --image photo.jpg
+    MODEL_MMAP=1 INFERENCE_BACKEND=bf16 DINOV2_WEIGHTS_PATH=dinov2_vitb14_bf16.pth python measure_memory.py
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+
+def smaps_rollup(pid):
+    """Return RSS, PSS and private memory of a process in MB."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[-1] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss_mb': fields.get('Rss', 0) / 1024,
+        'pss_mb': fields.get('Pss', 0) / 1024,
+        'private_mb': (fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)) / 1024,
+    }
+
+
+def children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def container_memory_mb():
+    for path in ('/sys/fs/cgroup/memory.current', '/sys/fs/cgroup/memory/memory.usage_in_bytes'):
+        try:
+            with open(path) as f:
+                return int(f.read()) / (1024 * 1024)
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def wait_ready(url, workers, master, log_path, timeout):
+    """
+    Wait until the master has all its workers and, with MODEL_PRELOAD, each
+    has logged that its model is warmed up.
+
+    Returns:
+        Worker pids
+    """
+    preload = (os.environ.get('MODEL_PRELOAD') or '0').lower() in ('1', 'true', 'yes')
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if master.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {master.returncode}, see {log_path}")
+        pids = children(master.pid)
+        if len(pids) == workers:
+            if preload:
+                with open(log_path, errors='replace') as f:
+                    ready = f.read().count('warmed up') >= workers
+            else:
+                ready = requests_ok(url)
+            if ready:
+                return pids
+        time.sleep(1)
+    raise TimeoutError(f"{workers} workers were not ready after {timeout}s, see {log_path}")
+
+
+def requests_ok(url):
+    try:
+        return requests.get(url + '/api/health', timeout=5).status_code == 200
+    except requests.RequestException:
+        return False
+
+
+def measure(workers, port, image, requests_per_worker, timeout, settle):
+    """
+    Start gunicorn with `workers` workers and measure its memory.
+
+    Returns:
+        Dict with per-process figures and totals in MB
+    """
+    url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), PYTHONUNBUFFERED='1')
+    log_path = os.path.join(tempfile.gettempdir(), f'measure_memory_{workers}.log')
+    with open(log_path, 'w') as log:
+        master = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+             'app:app'],
+            env=env, cwd=os.path.dirname(os.path.abspath(__file__)), stdout=log, stderr=subprocess.STDOUT,
+        )
+    try:
+        wait_ready(url, workers, master, log_path, timeout)
+        if image:
+            with open(image, 'rb') as f:
+                data = f.read()
+            for _ in range(requests_per_worker * workers):
+                requests.post(url + '/', files={'file': (os.path.basename(image), data)}, timeout=120)
+        # Let warm-up and the last requests finish touching memory
+        time.sleep(settle)
+        per_worker = [dict(pid=pid, **smaps_rollup(pid)) for pid in children(master.pid)]
+        master_memory = smaps_rollup(master.pid)
+        return {
+            'workers': workers,
+            'master': master_memory,
+            'per_worker': per_worker,
+            'total_pss_mb': master_memory['pss_mb'] + sum(w['pss_mb'] for w in per_worker),
+            'total_rss_mb': master_memory['rss_mb'] + sum(w['rss_mb'] for w in per_worker),
+            'container_mb': container_memory_mb(),
+        }
+    finally:
+        master.send_signal(signal.SIGINT)
+        try:
+            master.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            master.kill()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory per worker at several gunicorn worker counts")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 3, 4])
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--image', help="Photo to search a few times per worker before measuring")
+    parser.add_argument('--requests', type=int, default=3, help="Searches per worker with --image (default: 3)")
+    parser.add_argument('--timeout', type=float, default=300, help="Seconds to wait for the workers to start")
+    parser.add_argument('--settle', type=float, default=5, help="Seconds to wait before reading memory")
+    parser.add_argument('--json', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    print(f"INFERENCE_BACKEND={os.environ.get('INFERENCE_BACKEND') or 'eager'} "
+          f"MODEL_MMAP={os.environ.get('MODEL_MMAP') or '0'} MODEL_PRELOAD={os.environ.get('MODEL_PRELOAD') or '0'}")
+    print(f"{'workers':>7} {'worker RSS':>11} {'worker PSS':>11} {'private':>9} {'total PSS':>10} {'container':>10}")
+    report = []
+    for workers in args.workers:
+        r = measure(workers, args.port, args.image, args.requests, args.timeout, args.settle)
+        report.append(r)
+        n = len(r['per_worker']) or 1
+        container = f"{r['container_mb']:.0f}" if r['container_mb'] is not None else '-'
+        print(f"{workers:>7} {sum(w['rss_mb'] for w in r['per_worker']) / n:>11.0f} "
+              f"{sum(w['pss_mb'] for w in r['per_worker']) / n:>11.0f} "
+              f"{sum(w['private_mb'] for w in r['per_worker']) / n:>9.0f} "
+              f"{r['total_pss_mb']:>10.0f} {container:>10}")
+    print("Per-worker columns are averages in MB; total PSS includes the master")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
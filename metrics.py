@@ -0,0 +1,188 @@
+"""
+Per-stage timing spans and Prometheus text-format metrics.
+
+Search functions record how long each stage took in a `timings` dict with
+`timed`. The app turns those dicts into histograms, counts requests and
+errors, and serves everything on /metrics in the Prometheus text exposition
+format. Values that already live elsewhere (cache counters, queue depth,
+model load time) are read at scrape time through callbacks: gauges for
+values that go up and down, counters for totals that only grow.
+
+Metrics are kept per worker process; each gunicorn worker reports its own.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds, from a cache hit to a slow forward pass on a loaded CPU
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+@contextmanager
+def timed(timings, stage):
+    """
+    Add the duration of the block, in seconds, to timings[stage].
+
+    Args:
+        timings: Dict of stage durations, or None to skip timing
+        stage: Stage name
+    """
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for v in values)
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+
+def _callback_samples(name, labelnames, value):
+    # A callback returns a number, None to skip, or a dict of label value -> number
+    if value is None:
+        return []
+    if isinstance(value, dict):
+        return [(name, _labels(labelnames, (label,)), v) for label, v in value.items() if v is not None]
+    return [(name, '', value)]
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter with optional labels.
+
+    Args:
+        name: Metric name
+        help: Description
+        labelnames: Label names
+        fn: Optional callable read at scrape time instead of inc(), for
+            totals kept elsewhere; returns values as for Gauge
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        if self.fn is not None:
+            return _callback_samples(self.name, self.labelnames, self.fn())
+        with self._lock:
+            return [(self.name, _labels(self.labelnames, key), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Cumulative histogram with optional labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f'{self.name}_bucket',
+                                    _labels(self.labelnames + ('le',), key + (_format(bound),)), count))
+                samples.append((f'{self.name}_sum', _labels(self.labelnames, key), total))
+                samples.append((f'{self.name}_count', _labels(self.labelnames, key), counts[-1]))
+        return samples
+
+
+class Gauge:
+    """
+    Value read at scrape time.
+
+    Args:
+        name: Metric name
+        help: Description
+        fn: Callable returning a number, None to skip, or a dict mapping a
+            label value (for the single label in labelnames) to a number
+        labelnames: At most one label name, used when fn returns a dict
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, fn, labelnames=()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        return _callback_samples(self.name, self.labelnames, self.fn())
+
+
+class Registry:
+    """Set of metrics rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labelnames=(), fn=None):
+        return self._add(Counter(name, help, labelnames, fn))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, fn, labelnames=()):
+        return self._add(Gauge(name, help, fn, labelnames))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # One broken callback should not take down the whole scrape
+                print(f"Metric {metric.name} failed: {e}")
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name}{labels} {_format(value)}' for name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
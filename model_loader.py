@@ -0,0 +1,265 @@
+"""
+DINOv2 model loading and warm-up.
+
+In preload mode the model is built from a hub repo and weights file baked
+into the image, so no network call is made at runtime. The weights are loaded
+once in the gunicorn master and shared copy-on-write with the workers, and
+each worker runs a dummy forward pass before it reports ready.
+
+For several workers per container, MODEL_MMAP=1 maps the weights file
+instead of reading it, so every worker uses the same page-cache pages.
+Combine it with a bf16 or fp16 weights file (`python model_loader.py
+export-weights`) and the matching INFERENCE_BACKEND to halve them, and with
+TORCH_THREADS (or the automatic per-worker share) to avoid oversubscribing
+the cores.
+
+Usage:
+    python model_loader.py export-weights --dtype bf16 dinov2_vitb14_bf16.pth
+"""
+import argparse
+import copy
+import os
+import threading
+import time
+import warnings
+
+import torch
+from config import Config
+
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+# Global variable for the model (loaded at boot in preload mode, lazily otherwise)
+dinov2 = None
+_model_lock = threading.Lock()
+_ready = threading.Event()
+load_seconds = None
+
+
+def load_local_dinov2_model(repo_dir, weights_path, mmap=False):
+    """
+    Build dinov2_vitb14 from a local hub checkout and weights file.
+
+    Args:
+        repo_dir: Local copy of the facebookresearch/dinov2 hub repo
+        weights_path: Path to dinov2_vitb14_pretrain.pth, or a file written
+                      by export_weights
+        mmap: Use the memory-mapped file pages as the parameters instead of
+              copying them, so all processes share one copy (CPU only); the
+              parameters keep the file's dtype
+
+    Returns:
+        Model in eval mode on `device`
+    """
+    print(f"Loading DINOv2 model from {weights_path}{' (mmap)' if mmap else ''}...")
+    model = torch.hub.load(repo_dir, 'dinov2_vitb14', source='local', pretrained=False)
+    state_dict = torch.load(weights_path, map_location='cpu', weights_only=True, mmap=mmap)
+    model.load_state_dict(state_dict, assign=mmap)
+    model = model.to(device)
+    model.eval()
+    print("DINOv2 model loaded successfully!")
+    return model
+
+
+def load_dinov2_model():
+    """Load DINOv2 model with retry logic for rate limiting"""
+    if Config.DINOV2_REPO_DIR and Config.DINOV2_WEIGHTS_PATH:
+        return load_local_dinov2_model(Config.DINOV2_REPO_DIR, Config.DINOV2_WEIGHTS_PATH,
+                                       mmap=Config.MODEL_MMAP and device == 'cpu')
+
+    max_retries = 3
+    for attempt in range(max_retries):
+        try:
+            print(f"Loading DINOv2 model (attempt {attempt + 1}/{max_retries})...")
+            # Using dinov2_vitb14 which produces 768-dimensional vectors
+            model = torch.hub.load('facebookresearch/dinov2', 'dinov2_vitb14', trust_repo=True)
+            model = model.to(device)
+            model.eval()
+            print("DINOv2 model loaded successfully!")
+            return model
+        except Exception as e:
+            print(f"Attempt {attempt + 1} failed: {str(e)}")
+            if attempt < max_retries - 1:
+                wait_time = (attempt + 1) * 10  # Exponential backoff
+                print(f"Waiting {wait_time} seconds before retry...")
+                time.sleep(wait_time)
+            else:
+                print("Failed to load DINOv2 model after all retries")
+                raise e
+
+
+# --- Inference backends ---
+INFERENCE_BACKENDS = ('eager', 'int8', 'torchscript', 'bf16', 'fp16')
+
+HALF_PRECISION_DTYPES = {'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+
+class HalfPrecisionModel(torch.nn.Module):
+    """Runs a bf16/fp16 model on fp32 inputs and returns fp32 embeddings."""
+
+    def __init__(self, model, dtype):
+        super().__init__()
+        self.model = model
+        self.dtype = dtype
+
+    def forward(self, x):
+        return self.model(x.to(self.dtype)).float()
+
+
+def _freeze_pos_encoding(model, size=224):
+    """
+    Replace the positional-embedding interpolation with its result for size x size inputs.
+
+    Every request is preprocessed to 224x224, so the interpolation always gives
+    the same tensor; computing it once also makes the model traceable.
+    """
+    with torch.no_grad():
+        tokens = model.patch_embed(torch.zeros(1, 3, size, size, device=device))
+        tokens = torch.cat((model.cls_token.expand(1, -1, -1), tokens), dim=1)
+        pos_embed = model.interpolate_pos_encoding(tokens, size, size)
+    model.interpolate_pos_encoding = lambda x, w, h: pos_embed
+    return model
+
+
+def optimize_model(model, backend, inplace=False):
+    """
+    Convert the fp32 model for the selected inference backend.
+    
+    Args:
+        model: fp32 DINOv2 model in eval mode
+        backend: 'eager' (fp32, unchanged), 'int8' (dynamic int8 quantization of
+                 the linear layers, CPU only), 'torchscript' (traced and frozen graph),
+                 or 'bf16'/'fp16' (half-precision weights and activations)
+        inplace: Convert bf16/fp16 weights in place instead of on a copy, so
+                 loading never holds both
+    
+    Returns:
+        Callable model for the backend; unless inplace, the input model is not modified
+    """
+    if backend == 'eager':
+        return model
+    if backend in HALF_PRECISION_DTYPES:
+        dtype = HALF_PRECISION_DTYPES[backend]
+        # Weights already stored in this dtype (see export_weights) are kept as is
+        return HalfPrecisionModel((model if inplace else copy.deepcopy(model)).to(dtype), dtype)
+    if backend == 'int8':
+        if device != 'cpu':
+            print("int8 dynamic quantization is CPU only, using the eager model")
+            return model
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend == 'torchscript':
+        model = _freeze_pos_encoding(copy.deepcopy(model))
+        with torch.no_grad(), warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            traced = torch.jit.trace(model, torch.zeros(1, 3, 224, 224, device=device), check_trace=False)
+            return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+    raise ValueError(f"Unknown inference backend {backend!r}, expected one of {INFERENCE_BACKENDS}")
+
+
+def get_model():
+    """
+    Return the DINOv2 model, loading it on first use.
+
+    Returns:
+        The process-wide model instance
+    """
+    global dinov2, load_seconds
+    if dinov2 is None:
+        with _model_lock:
+            if dinov2 is None:
+                start = time.perf_counter()
+                dinov2 = optimize_model(load_dinov2_model(), Config.INFERENCE_BACKEND, inplace=True)
+                load_seconds = time.perf_counter() - start
+    return dinov2
+
+
+def warm_up(batch_size=1):
+    """
+    Run a dummy forward pass so kernels and allocator pools are initialised,
+    then mark the process ready.
+
+    This must run in the worker, not in the gunicorn master: intra-op thread
+    pools started before fork are not usable in the forked children.
+    """
+    start = time.perf_counter()
+    model = get_model()
+    with torch.no_grad():
+        model(torch.zeros(batch_size, 3, 224, 224, device=device))
+    _ready.set()
+    print(f"DINOv2 model warmed up in {time.perf_counter() - start:.1f}s (pid {os.getpid()})")
+
+
+def start_warm_up():
+    """Warm up in a background thread so the worker can answer health checks meanwhile."""
+    thread = threading.Thread(target=warm_up, name='dinov2-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+def is_ready():
+    """True once the model is loaded and warmed up in this process."""
+    return _ready.is_set()
+
+
+# --- Memory and threads per worker ---
+def available_cpus():
+    """CPUs this process may use, honouring CPU affinity and a cgroup v2 quota."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def configure_threads(workers=1):
+    """
+    Set this process's intra-op thread count so N workers share the cores
+    instead of each starting one thread per core.
+
+    Args:
+        workers: Worker processes in the container
+
+    Returns:
+        The thread count set: Config.TORCH_THREADS, or the worker's share of the CPUs
+    """
+    threads = Config.TORCH_THREADS or max(1, available_cpus() // workers)
+    torch.set_num_threads(threads)
+    return threads
+
+
+def export_weights(weights_path, output_path, dtype='bf16'):
+    """
+    Write a copy of a weights file in half precision, for use with MODEL_MMAP.
+
+    Args:
+        weights_path: fp32 dinov2_vitb14_pretrain.pth
+        output_path: File to write
+        dtype: 'bf16' or 'fp16'
+    """
+    state_dict = torch.load(weights_path, map_location='cpu', weights_only=True)
+    converted = {
+        name: tensor.to(HALF_PRECISION_DTYPES[dtype]) if tensor.is_floating_point() else tensor
+        for name, tensor in state_dict.items()
+    }
+    tmp_path = output_path + '.tmp'
+    torch.save(converted, tmp_path)
+    os.replace(tmp_path, output_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DINOv2 weights tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export-weights', help="Write a bf16/fp16 copy of the weights file")
+    export.add_argument('output')
+    export.add_argument('--weights', default=Config.DINOV2_WEIGHTS_PATH,
+                        help="fp32 weights file (default: DINOV2_WEIGHTS_PATH)")
+    export.add_argument('--dtype', choices=sorted(HALF_PRECISION_DTYPES), default='bf16')
+    args = parser.parse_args()
+
+    if not args.weights:
+        parser.error("--weights or DINOV2_WEIGHTS_PATH is required")
+    export_weights(args.weights, args.output, args.dtype)
+    print(f"Wrote {args.dtype} weights to {args.output}")
@@ -0,0 +1,103 @@
+"""
+Process-wide Pinecone index handle shared across requests.
+"""
+import os
+import threading
+import time
+
+import pinecone
+from config import Config
+
+
+class IndexManager:
+    """
+    Holds one Pinecone client and index handle per process.
+
+    The handle is built on first use and then reused by every request, so the
+    HTTP connection pool stays open between queries. Gunicorn forks workers
+    from the master, and pooled sockets must not be shared across processes,
+    so the handle remembers the pid it was built in and is rebuilt in a child.
+
+    Args:
+        api_key: Pinecone API key (default: Config.PINECONE_API_KEY)
+        index_name: Index to open (default: Config.PINECONE_INDEX_NAME)
+        host: Data-plane host, skips the control-plane lookup when set
+              (default: Config.PINECONE_INDEX_HOST)
+        pool_maxsize: Maximum pooled HTTP connections (default: Config.PINECONE_POOL_MAXSIZE)
+        timeout: Request timeout in seconds (default: Config.PINECONE_TIMEOUT)
+    """
+
+    def __init__(self, api_key=None, index_name=None, host=None, pool_maxsize=None, timeout=None):
+        self.api_key = api_key or Config.PINECONE_API_KEY
+        self.index_name = index_name or Config.PINECONE_INDEX_NAME
+        self.host = host or Config.PINECONE_INDEX_HOST
+        self.pool_maxsize = pool_maxsize or Config.PINECONE_POOL_MAXSIZE
+        self.timeout = timeout or Config.PINECONE_TIMEOUT
+        self._lock = threading.Lock()
+        self._index = None
+        self._pid = None
+
+    def _connect(self):
+        pc = pinecone.Pinecone(api_key=self.api_key, timeout=self.timeout,
+                               connection_pool_maxsize=self.pool_maxsize)
+        index = pc.Index(name=self.index_name, host=self.host or '')
+        # Open the first pooled connection now so the TLS handshake is paid
+        # here and not inside the first query.
+        index.describe_index_stats()
+        return index
+
+    def get_index(self):
+        """
+        Return the index handle for this process, building it if needed.
+
+        Returns:
+            Tuple (index, connect_time) where connect_time is the time in
+            seconds spent building the handle, 0.0 when it was reused
+        """
+        if self._index is not None and self._pid == os.getpid():
+            return self._index, 0.0
+        with self._lock:
+            if self._index is not None and self._pid == os.getpid():
+                return self._index, 0.0
+            start = time.perf_counter()
+            self._index = self._connect()
+            self._pid = os.getpid()
+            return self._index, time.perf_counter() - start
+
+    def query(self, vector, top_k, include_metadata=True, timings=None, timeout=None, **kwargs):
+        """
+        Query the shared index handle.
+
+        Args:
+            vector: Query embedding as a list of floats
+            top_k: Number of matches to fetch
+            include_metadata: Whether to return match metadata (default: True)
+            timings: Optional dict, filled with 'pinecone_connect' and
+                     'pinecone_query' durations in seconds
+            timeout: Request timeout in seconds (default: the manager's)
+            **kwargs: Extra arguments passed to index.query
+
+        Returns:
+            Pinecone query response
+        """
+        index, connect_time = self.get_index()
+        start = time.perf_counter()
+        response = index.query(vector=vector, top_k=top_k, include_metadata=include_metadata,
+                               timeout=timeout or self.timeout, **kwargs)
+        if timings is not None:
+            timings['pinecone_connect'] = connect_time
+            timings['pinecone_query'] = time.perf_counter() - start
+        return response
+
+    def reset(self):
+        """Drop the handle so the next request builds a fresh one."""
+        self._lock = threading.Lock()
+        self._index = None
+        self._pid = None
+
+
+index_manager = IndexManager()
+
+# A lock held by another thread at fork time would stay locked forever in the
+# child, so start each worker with a clean manager.
+os.register_at_fork(after_in_child=index_manager.reset)
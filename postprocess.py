@@ -0,0 +1,215 @@
+"""
+Vectorized post-processing of vector store matches.
+
+The matches of one query are held as arrays of IDs, scores and address
+keys (address IDs for the local store, so no string is touched until the
+final top_k) and scored per address in one pass:
+
+- 'max': the address's best match, the cosine score shown until now;
+- 'sum': the sum of the address's best RESULT_TOP_M matches, divided by
+  RESULT_TOP_M so it stays on the cosine scale. An address that several
+  photos agree on beats one lucky photo.
+
+With RESULT_MAX_PER_STREET, addresses beyond that many on one street move
+down the list, below the best addresses of other streets, so a cluster of
+neighbouring façades does not fill every slot.
+
+A calibration fitted by calibrate.py on a labelled set turns address
+scores into the probability that the address is the right one:
+
+- 'temperature': softmax over the best `candidates` address scores divided
+  by a temperature, with one extra "not among them" score;
+- 'isotonic': a monotone step function from address score to the share of
+  addresses at that score that were right.
+
+Calibration file (JSON):
+    {"method": "temperature", "temperature": T, "bias": b, "candidates": N}
+    {"method": "isotonic", "x": [...], "y": [...]}
+"""
+import json
+import re
+import threading
+
+import numpy as np
+
+from config import Config
+
+AGGREGATIONS = ('max', 'sum')
+
+# Addresses scored per query when the calibration or the street limit needs
+# more than the top_k returned
+CANDIDATES = 20
+
+
+class Matches:
+    """
+    The matches of one query as arrays.
+
+    Args:
+        ids: (n,) vector IDs
+        scores: (n,) scores, best first
+        keys: (n,) address key of each match: an address ID, or the address itself
+        addresses: Sequence mapping address IDs to addresses, or None when the keys are addresses
+        partial: True when a shard was left out
+    """
+
+    def __init__(self, ids, scores, keys, addresses=None, partial=False):
+        self.ids = ids
+        self.scores = np.asarray(scores, dtype=np.float64)
+        self.keys = keys
+        self.addresses = addresses
+        self.partial = partial
+
+    @classmethod
+    def from_dicts(cls, matches, partial=False):
+        """Arrays of a Pinecone-style match list, keeping only matches with an address."""
+        kept = [m for m in matches if (m.get('metadata') or {}).get('address')]
+        return cls(
+            np.array([m.get('id') for m in kept], dtype=object),
+            np.fromiter((m.get('score', 0) for m in kept), dtype=np.float64, count=len(kept)),
+            np.array([m['metadata']['address'] for m in kept], dtype=str),
+            partial=partial,
+        )
+
+    def address(self, key):
+        return str(key) if self.addresses is None else self.addresses[key]
+
+    def __len__(self):
+        return len(self.scores)
+
+
+def aggregate(scores, keys, method='max', top_m=3):
+    """
+    Score every address found in a list of matches.
+
+    Args:
+        scores: (n,) match scores, best first
+        keys: (n,) address key of each match
+        method: One of AGGREGATIONS (default: 'max')
+        top_m: Matches summed per address with 'sum' (default: 3)
+
+    Returns:
+        Tuple (first, aggregated, counts) of arrays over the addresses, best
+        first: index of the address's best match, its score and its number
+        of matches
+    """
+    if method not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation '{method}', expected one of {AGGREGATIONS}")
+    if not len(scores):
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=np.int64)
+    _, groups = np.unique(keys, return_inverse=True)
+    # Matches grouped by address, best first within each group
+    order = np.lexsort((-scores, groups))
+    grouped = groups[order]
+    starts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+    counts = np.diff(np.r_[starts, len(order)])
+    first = order[starts]
+    if method == 'max':
+        aggregated = scores[first]
+    else:
+        rank = np.arange(len(order)) - np.repeat(starts, counts)
+        kept = rank < top_m
+        aggregated = np.bincount(grouped[kept], weights=scores[order][kept], minlength=len(starts)) / top_m
+    # Ties go to the address with the earlier best match
+    ranking = np.lexsort((first, -aggregated))
+    return first[ranking], aggregated[ranking], counts[ranking]
+
+
+def street_of(address):
+    """Street of an address, e.g. 'rue etex' for '26 bis rue etex, 75018 Paris, France'."""
+    street = address.split(',')[0].strip().lower()
+    return re.sub(r'^\d+\s*(bis|ter|quater)?\s+', '', street)
+
+
+def spread_streets(addresses, max_per_street):
+    """
+    Order that moves addresses beyond max_per_street on one street below the others.
+
+    Args:
+        addresses: Address strings, best first
+        max_per_street: Addresses per street kept in place
+
+    Returns:
+        Permutation of range(len(addresses)); order is kept within each part
+    """
+    if not len(addresses):
+        return np.empty(0, dtype=np.int64)
+    _, streets = np.unique([street_of(a) for a in addresses], return_inverse=True)
+    order = np.argsort(streets, kind='stable')
+    grouped = streets[order]
+    starts = np.r_[True, grouped[1:] != grouped[:-1]]
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - np.maximum.accumulate(np.where(starts, np.arange(len(order)), 0))
+    return np.argsort(rank >= max_per_street, kind='stable')
+
+
+class Calibrator:
+    """
+    Maps address scores to calibrated confidences.
+
+    Args:
+        method: 'temperature' or 'isotonic'
+        temperature: Softmax temperature ('temperature')
+        bias: Score of the "not among the candidates" outcome ('temperature')
+        candidates: Addresses the softmax runs over ('temperature')
+        x: Increasing address scores ('isotonic')
+        y: Non-decreasing confidences at those scores ('isotonic')
+    """
+
+    def __init__(self, method, temperature=1.0, bias=0.0, candidates=CANDIDATES, x=None, y=None):
+        if method not in ('temperature', 'isotonic'):
+            raise ValueError(f"Unknown calibration method '{method}'")
+        self.method = method
+        self.temperature = float(temperature)
+        self.bias = float(bias)
+        self.candidates = int(candidates)
+        self.x = np.asarray(x if x is not None else [], dtype=np.float64)
+        self.y = np.asarray(y if y is not None else [], dtype=np.float64)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(**json.load(f))
+
+    def save(self, path):
+        if self.method == 'temperature':
+            params = {'temperature': self.temperature, 'bias': self.bias, 'candidates': self.candidates}
+        else:
+            params = {'x': self.x.tolist(), 'y': self.y.tolist()}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(dict(method=self.method, **params), f, indent=2)
+
+    def confidences(self, scores):
+        """
+        Calibrated confidences of a query's address scores.
+
+        Args:
+            scores: (n,) address scores, best first, as returned by aggregate
+
+        Returns:
+            (n,) probabilities that each address is the right one
+        """
+        scores = np.asarray(scores, dtype=np.float64)
+        if self.method == 'isotonic':
+            return np.interp(scores, self.x, self.y)
+        # Addresses beyond the candidates share their normaliser
+        logits = scores / self.temperature
+        top = max(logits[0] if len(logits) else 0.0, self.bias / self.temperature)
+        normaliser = np.exp(self.bias / self.temperature - top) + np.exp(logits[:self.candidates] - top).sum()
+        return np.exp(logits - top) / normaliser
+
+
+_calibrator = None
+_calibrator_lock = threading.Lock()
+
+
+def get_calibrator():
+    """Return the Calibrator loaded from Config.CALIBRATION_PATH, or None when unset."""
+    global _calibrator
+    if not Config.CALIBRATION_PATH:
+        return None
+    if _calibrator is None:
+        with _calibrator_lock:
+            if _calibrator is None:
+                _calibrator = Calibrator.load(Config.CALIBRATION_PATH)
+    return _calibrator
@@ -0,0 +1,220 @@
+"""
+Fast image decoding and preprocessing for DINOv2.
+
+Equivalent to the torchvision pipeline in query_pinecone.preprocess
+(bicubic Resize(224) -> CenterCrop(224) -> ToTensor -> Normalize), but:
+
+- JPEGs are decoded with the decoder's draft mode, which scales the DCT by
+  1/2, 1/4 or 1/8 so a 12 MP photo is never fully decoded;
+- resize and crop are a single PIL call over the crop region only;
+- scaling and normalisation are one in-place operation over the whole
+  batch, written straight into the output tensor.
+
+Run `python preprocessing.py IMAGE [IMAGE ...]` to check that the fast path
+gives the same embeddings as the reference pipeline.
+"""
+import io
+import sys
+
+import numpy as np
+import torch
+from PIL import Image
+
+IMAGE_SIZE = 224
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+# ToTensor's /255 folded into Normalize: x * scale - offset
+_scale = torch.tensor([1.0 / (255.0 * s) for s in STD]).view(1, 3, 1, 1)
+_offset = torch.tensor([m / s for m, s in zip(MEAN, STD)]).view(1, 3, 1, 1)
+
+# Keep at least this many times the target size after draft decoding, so the
+# bicubic downscale still has enough pixels to match a full-size decode
+DRAFT_OVERSAMPLE = 2
+
+
+def open_image(image_bytes, size=IMAGE_SIZE):
+    """
+    Decode encoded image bytes to RGB, at reduced resolution for large JPEGs.
+
+    Args:
+        image_bytes: Encoded image
+        size: Model input size the image will be resized to (default: 224)
+
+    Returns:
+        RGB PIL image whose short side is at least DRAFT_OVERSAMPLE * size,
+        or the full image if it is smaller than that
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    if img.format == 'JPEG':
+        width, height = img.size
+        short_side = min(width, height)
+        target = size * DRAFT_OVERSAMPLE
+        if short_side > target:
+            img.draft('RGB', (width * target // short_side, height * target // short_side))
+    return img.convert('RGB')
+
+
+def center_crop_box(width, height, size=IMAGE_SIZE):
+    """
+    Source-pixel box that Resize(size) followed by CenterCrop(size) keeps.
+
+    Args:
+        width: Source image width
+        height: Source image height
+        size: Output size (default: 224)
+
+    Returns:
+        (left, top, right, bottom) in source coordinates
+    """
+    # Same rounding as torchvision's Resize and CenterCrop
+    if width <= height:
+        resized_w, resized_h = size, int(size * height / width)
+    else:
+        resized_w, resized_h = int(size * width / height), size
+    left = int(round((resized_w - size) / 2.0))
+    top = int(round((resized_h - size) / 2.0))
+    scale_x = width / resized_w
+    scale_y = height / resized_h
+    return (left * scale_x, top * scale_y, (left + size) * scale_x, (top + size) * scale_y)
+
+
+def preprocess_images(images, size=IMAGE_SIZE, out=None):
+    """
+    Resize, crop and normalise a batch of RGB images.
+
+    Args:
+        images: List of RGB PIL images
+        size: Output size (default: 224)
+        out: Optional preallocated float32 tensor of shape (len(images), 3, size, size)
+
+    Returns:
+        Normalised float32 tensor of shape (len(images), 3, size, size)
+    """
+    if out is None:
+        out = torch.empty((len(images), 3, size, size), dtype=torch.float32)
+    for i, img in enumerate(images):
+        crop = img.resize((size, size), Image.BICUBIC, box=center_crop_box(img.width, img.height, size))
+        out[i].copy_(torch.from_numpy(np.array(crop)).permute(2, 0, 1))
+    out.mul_(_scale).sub_(_offset)
+    return out
+
+
+def preprocess_image(img, size=IMAGE_SIZE):
+    """Preprocess a single RGB image to a (3, size, size) tensor."""
+    return preprocess_images([img], size)[0]
+
+
+# Test-time augmentation views, most useful first: the first K are used
+VIEWS = ('center', 'full', 'left', 'right', 'center_flip', 'full_flip', 'left_flip', 'right_flip')
+
+
+def view_box(width, height, view, size=IMAGE_SIZE):
+    """
+    Source-pixel box of a view.
+
+    'center' is the usual center crop. 'left' and 'right' are the squares at
+    either end of the long side (top and bottom for a portrait photo), so the
+    edges a center crop drops are seen too. 'full' is the whole image,
+    squeezed to a square.
+
+    Returns:
+        (left, top, right, bottom) in source coordinates
+    """
+    view = view.replace('_flip', '')
+    if view == 'center':
+        return center_crop_box(width, height, size)
+    if view == 'full':
+        return (0, 0, width, height)
+    side = min(width, height)
+    offset = 0 if view == 'left' else max(width, height) - side
+    return (offset, 0, offset + side, side) if width >= height else (0, offset, side, offset + side)
+
+
+def preprocess_views(img, views, size=IMAGE_SIZE):
+    """
+    Preprocess several views of one RGB image into a batch.
+
+    Args:
+        img: RGB PIL image
+        views: View names from VIEWS; '_flip' views are mirrored left to right
+        size: Output size (default: 224)
+
+    Returns:
+        Normalised float32 tensor of shape (len(views), 3, size, size)
+    """
+    out = torch.empty((len(views), 3, size, size), dtype=torch.float32)
+    for i, view in enumerate(views):
+        crop = img.resize((size, size), Image.BICUBIC, box=view_box(img.width, img.height, view, size))
+        if view.endswith('_flip'):
+            crop = crop.transpose(Image.FLIP_LEFT_RIGHT)
+        out[i].copy_(torch.from_numpy(np.array(crop)).permute(2, 0, 1))
+    out.mul_(_scale).sub_(_offset)
+    return out
+
+
+# Perceptual hash: DCT of a HASH_SIZE * 4 square grayscale thumbnail
+HASH_SIZE = 8
+_HASH_SIDE = HASH_SIZE * 4
+_DCT = np.cos(np.pi * np.outer(np.arange(_HASH_SIDE), 2 * np.arange(_HASH_SIDE) + 1) / (2 * _HASH_SIDE)).astype(np.float32)
+_DCT[0] /= np.sqrt(2)
+
+
+def perceptual_hash(img):
+    """
+    64-bit DCT perceptual hash (pHash) of an image.
+
+    Re-encoding, resizing and recompression barely change the low
+    frequencies of a photo, so copies of one photo hash a few bits apart.
+
+    Args:
+        img: PIL image
+
+    Returns:
+        int whose bits tell which of the 8x8 lowest DCT frequencies are above their median
+    """
+    # PIL's reducing resize averages the source pixels, so any image size gives the same thumbnail
+    pixels = np.asarray(img.convert('L').resize((_HASH_SIDE, _HASH_SIDE), Image.BILINEAR), dtype=np.float32)
+    low = _DCT[:HASH_SIZE] @ pixels @ _DCT[:HASH_SIZE].T
+    bits = (low > np.median(low)).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def check_equivalence(paths, model, min_cosine=0.99):
+    """
+    Compare fast-path embeddings with the reference torchvision pipeline.
+
+    Args:
+        paths: Image files to check
+        model: Embedding model taking a (n, 3, 224, 224) batch
+        min_cosine: Lowest acceptable cosine similarity (default: 0.99)
+
+    Returns:
+        List of (path, cosine similarity, ok) tuples
+    """
+    from query_pinecone import preprocess
+
+    report = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            image_bytes = f.read()
+        reference = preprocess(Image.open(io.BytesIO(image_bytes)).convert('RGB'))
+        fast = preprocess_image(open_image(image_bytes))
+        with torch.no_grad():
+            embeddings = model(torch.stack([reference, fast]))
+        cosine = torch.nn.functional.cosine_similarity(embeddings[0], embeddings[1], dim=0).item()
+        report.append((path, cosine, cosine >= min_cosine))
+    return report
+
+
+if __name__ == "__main__":
+    from model_loader import get_model
+
+    if len(sys.argv) < 2:
+        print("Usage: python preprocessing.py IMAGE [IMAGE ...]")
+        sys.exit(2)
+    failed = 0
+    for path, cosine, ok in check_equivalence(sys.argv[1:], get_model()):
+        print(f"{'OK  ' if ok else 'FAIL'} cosine={cosine:.5f} {path}")
+        failed += not ok
+    sys.exit(1 if failed else 0)
@@ -1,18 +1,34 @@
-import torch
 from PIL import Image
 from torchvision import transforms
-import pinecone
+import numpy as np
 from config import Config
+from batching import get_scheduler
+from cache import NearDuplicateCache, make_cache
+from postprocess import CANDIDATES, Matches, aggregate, get_calibrator, spread_streets
+from preprocessing import VIEWS, open_image, perceptual_hash, preprocess_image, preprocess_views
+from vector_store import PINECONE_MAX_TOP_K, get_routed_store
+from metrics import timed
+from rerank import get_reranker
 import unicodedata
 import re
 import time
 import urllib.parse
+import requests
+import hashlib
+import io
+import ipaddress
+import json
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
 
 def to_ascii_id(s):
     s = unicodedata.normalize('NFKD', s).encode('ascii', 'ignore').decode('ascii')
     s = re.sub(r'[^a-zA-Z0-9_.-]', '_', s)
     return s
 
+
 def create_google_maps_url(address):
     """
     Create a Google Maps URL for the given address.
@@ -27,33 +43,6 @@ def create_google_maps_url(address):
     encoded_address = urllib.parse.quote(address)
     return f"https://www.google.com/maps/place/{encoded_address}"
 
-# --- Load DINOv2 Model ---
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
-
-def load_dinov2_model():
-    """Load DINOv2 model with retry logic for rate limiting"""
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            print(f"Loading DINOv2 model (attempt {attempt + 1}/{max_retries})...")
-            # Using dinov2_vitb14 which produces 768-dimensional vectors
-            model = torch.hub.load('facebookresearch/dinov2', 'dinov2_vitb14', trust_repo=True)
-            model = model.to(device)
-            model.eval()
-            print("DINOv2 model loaded successfully!")
-            return model
-        except Exception as e:
-            print(f"Attempt {attempt + 1} failed: {str(e)}")
-            if attempt < max_retries - 1:
-                wait_time = (attempt + 1) * 10  # Exponential backoff
-                print(f"Waiting {wait_time} seconds before retry...")
-                time.sleep(wait_time)
-            else:
-                print("Failed to load DINOv2 model after all retries")
-                raise e
-
-# Global variable for the model (will be loaded lazily)
-dinov2 = None
 
 # --- Preprocessing for DINOv2 ---
 preprocess = transforms.Compose([
@@ -63,83 +52,903 @@ preprocess = transforms.Compose([
     transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
 ])
 
-def query_image_unique_addresses(image_path, top_k=5, max_results=50):
+# --- Embedding and result caches ---
+# Level one: content hash of the uploaded bytes -> embedding.
+# Level two: (embedding, top_k, max_results, index version) -> deduplicated
+# address list, so a new version of the local index is never served stale results.
+# Near duplicates: perceptual hash of the decoded photo -> embedding, for the
+# same photo re-encoded, resized or stripped of its metadata (per process).
+if Config.CACHE_ENABLED:
+    embedding_cache = make_cache(
+        'embeddings',
+        dumps=lambda vector: np.asarray(vector, dtype=np.float32).tobytes(),
+        loads=lambda data: np.frombuffer(data, dtype=np.float32).tolist(),
+    )
+    result_cache = make_cache('results', dumps=json.dumps, loads=json.loads)
+else:
+    embedding_cache = result_cache = None
+if Config.CACHE_ENABLED and Config.NEAR_DUPLICATE_CACHE:
+    near_duplicate_cache = NearDuplicateCache(Config.CACHE_MAX_ENTRIES, Config.CACHE_TTL_SECONDS,
+                                              Config.NEAR_DUPLICATE_THRESHOLD)
+else:
+    near_duplicate_cache = None
+
+
+def vector_key(vector):
+    return hashlib.blake2b(np.asarray(vector, dtype=np.float32).tobytes(), digest_size=16).hexdigest()
+
+
+def store_key(store):
+    """Shards searched and the live version of each, for result cache keys."""
+    stores = getattr(store, 'stores', None)
+    if stores is None:
+        return f"v{store.version}"
+    return ','.join(f"{name}@v{stores[name].version}" for name in sorted(stores))
+
+
+def cache_stats():
+    """Hit/miss counters for every cache level, or None when caching is disabled."""
+    if embedding_cache is None:
+        return None
+    stats = {'embeddings': embedding_cache.stats(), 'results': result_cache.stats()}
+    if near_duplicate_cache is not None:
+        stats['near_duplicates'] = near_duplicate_cache.stats()
+    return stats
+
+
+def cache_embedding(image_key, image_hash, vector):
+    """Store a freshly computed embedding under its content key and perceptual hash."""
+    if embedding_cache is not None:
+        embedding_cache.set(image_key, vector)
+    if near_duplicate_cache is not None and image_hash is not None:
+        near_duplicate_cache.set(image_hash, vector)
+
+
+# --- Image input ---
+def read_image_bytes(image):
+    """
+    Return the encoded bytes of an image given as a path, bytes or file-like object.
+    
+    Args:
+        image: Path, bytes-like object, file-like object, PIL image or array
+    
+    Returns:
+        The encoded bytes, or None if the image is already decoded
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(image)
+    if isinstance(image, (str, os.PathLike)):
+        with open(image, 'rb') as f:
+            return f.read()
+    if hasattr(image, 'read'):
+        return image.read()
+    return None
+
+
+def decode_image(image, image_bytes=None):
+    """
+    Decode an image to an RGB PIL image without touching the filesystem.
+    
+    Args:
+        image: PIL image or HxWx3 uint8 array, used when image_bytes is None
+        image_bytes: Encoded image bytes, as returned by read_image_bytes
+    
+    Returns:
+        RGB PIL image
+    """
+    if image_bytes is not None:
+        if Config.FAST_PREPROCESS:
+            # Reduced-resolution decode for large JPEGs
+            return open_image(image_bytes)
+        return Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    if isinstance(image, Image.Image):
+        return image.convert('RGB')
+    if isinstance(image, np.ndarray):
+        return Image.fromarray(image).convert('RGB')
+    raise TypeError(f"Unsupported image type: {type(image).__name__}")
+
+
+def image_to_tensor(img):
+    """Preprocess a decoded RGB image to the (3, 224, 224) model input."""
+    if Config.FAST_PREPROCESS:
+        return preprocess_image(img)
+    return preprocess(img)
+
+
+def embedding_space():
+    """
+    Backend, preprocessing and weights the embeddings of this process come from.
+    
+    Embeddings made under another setting are close to, but not the same as,
+    these, so a cache shared with other workers must not mix them.
+    """
+    weights = os.path.basename(Config.DINOV2_WEIGHTS_PATH) if Config.DINOV2_WEIGHTS_PATH else 'hub'
+    preprocessing = 'fast' if Config.FAST_PREPROCESS else 'reference'
+    return f"{Config.INFERENCE_BACKEND}:{preprocessing}:{weights}"
+
+
+def image_content_key(image, image_bytes=None):
+    """Content hash of an image in this process's embedding space, used as the embedding cache key."""
+    if image_bytes is not None:
+        return f"{embedding_space()}:{hashlib.sha256(image_bytes).hexdigest()}"
+    pixels = np.asarray(image)
+    digest = hashlib.sha256(str(pixels.shape).encode('ascii'))
+    digest.update(np.ascontiguousarray(pixels).tobytes())
+    return f"{embedding_space()}:{digest.hexdigest()}"
+
+
+def dedupe_addresses(matches, top_k, aggregation=None, top_m=None, max_per_street=None, calibrator=None):
+    """
+    Rank the addresses of a match list, in vectorized form.
+    
+    Args:
+        matches: postprocess.Matches, or Pinecone matches with 'address' in their metadata
+        top_k: Number of unique addresses to return
+        aggregation: Per-address score, 'max' or 'sum' (default: Config.RESULT_AGGREGATION)
+        top_m: Matches summed per address with 'sum' (default: Config.RESULT_TOP_M)
+        max_per_street: Addresses per street before other streets move up, 0 for
+                        no limit (default: Config.RESULT_MAX_PER_STREET)
+        calibrator: Calibrator adding 'confidence' to the results (default: the
+                    one at Config.CALIBRATION_PATH, if any)
+    
+    Returns:
+        Up to top_k dictionaries with score, id, address and google_maps_url, best
+        first, plus 'confidence' when calibrated and 'matches' with 'sum'
+    """
+    aggregation = aggregation or Config.RESULT_AGGREGATION
+    top_m = top_m or Config.RESULT_TOP_M
+    max_per_street = Config.RESULT_MAX_PER_STREET if max_per_street is None else max_per_street
+    calibrator = calibrator or get_calibrator()
+    if not isinstance(matches, Matches):
+        matches = Matches.from_dicts(matches)
+    
+    first, aggregated, counts = aggregate(matches.scores, matches.keys, aggregation, top_m)
+    confidences = calibrator.confidences(aggregated) if calibrator is not None else None
+    if max_per_street:
+        order = spread_streets([matches.address(k) for k in matches.keys[first]], max_per_street)
+        first, aggregated, counts = first[order], aggregated[order], counts[order]
+        confidences = confidences[order] if confidences is not None else None
+    
+    # Only the returned addresses become dicts with a URL
+    results = []
+    for i in range(min(top_k, len(first))):
+        address = matches.address(matches.keys[first[i]])
+        result = {
+            'score': float(aggregated[i]),
+            'id': str(matches.ids[first[i]]),
+            'address': address,
+            'google_maps_url': create_google_maps_url(address)
+        }
+        if confidences is not None:
+            result['confidence'] = float(confidences[i])
+        if aggregation == 'sum':
+            result['matches'] = int(counts[i])
+        results.append(result)
+    return results
+
+
+def query_matches(store, vector, top_k, max_results=50, timings=None):
+    """
+    Matches for dedupe_addresses to rank: the best per address, or with
+    RESULT_AGGREGATION=sum every match of the first max_results, fetching
+    more while they hold fewer than top_k addresses.
+    
+    Args:
+        store: Vector store, as returned by get_routed_store
+        vector: Image embedding as a list of floats
+        top_k: Number of unique addresses wanted
+        max_results: Matches fetched by the first vector store query (default: 50)
+        timings: Optional dict, filled with the vector store's durations in seconds
+    
+    Returns:
+        postprocess.Matches; partial is set when a shard was left out
+    """
+    if Config.RESULT_AGGREGATION != 'sum':
+        if hasattr(store, 'query_arrays'):
+            return store.query_arrays(vector, top_k, grouped=True, timings=timings)
+        response = store.query_grouped(vector=vector, top_k=top_k, max_results=max_results, timings=timings)
+        return Matches.from_dicts(response['matches'], response.get('partial', False))
+    
+    fetch = max_results
+    total = {}
+    while True:
+        step = {}
+        if hasattr(store, 'query_arrays'):
+            matches = store.query_arrays(vector, fetch, timings=step)
+            returned = len(matches)
+        else:
+            response = store.query(vector, fetch, timings=step)
+            matches = Matches.from_dicts(response['matches'], response.get('partial', False))
+            # from_dicts drops matches without an address; only a short
+            # response means the store has nothing more to give
+            returned = len(response['matches'])
+        for stage, seconds in step.items():
+            total[stage] = total.get(stage, 0.0) + seconds
+        if (len(np.unique(matches.keys)) >= top_k or returned < fetch
+                or fetch >= PINECONE_MAX_TOP_K):
+            break
+        fetch = min(fetch * 4, PINECONE_MAX_TOP_K)
+    if timings is not None:
+        timings.update(total)
+    return matches
+
+
+def prepare_image(image, timings=None):
+    """
+    Look up an image's embedding in the cache, or decode and preprocess it.
+    
+    Args:
+        image: Any image form accepted by query_image_unique_addresses
+        timings: Optional dict, filled with the 'read', 'embedding_cache',
+                 'decode', 'near_duplicate' and 'preprocess' durations in seconds
+    
+    Returns:
+        Tuple (cache key, perceptual hash or None, cached embedding or None,
+        model input tensor or None)
+    """
+    with timed(timings, 'read'):
+        image_bytes = read_image_bytes(image)
+    
+    # A re-uploaded photo skips decoding and the model entirely
+    with timed(timings, 'embedding_cache'):
+        image_key = image_content_key(image, image_bytes)
+        vector = embedding_cache.get(image_key) if embedding_cache is not None else None
+    if vector is not None:
+        return image_key, None, vector, None
+    
+    # Decode in memory and preprocess image
+    with timed(timings, 'decode'):
+        img = decode_image(image, image_bytes)
+    
+    # The same photo re-encoded by a messaging app skips the model too
+    image_hash = None
+    if near_duplicate_cache is not None:
+        with timed(timings, 'near_duplicate'):
+            image_hash = perceptual_hash(img)
+            vector = near_duplicate_cache.get(image_hash)
+        if vector is not None:
+            if embedding_cache is not None:
+                embedding_cache.set(image_key, vector)
+            return image_key, image_hash, vector, None
+    
+    with timed(timings, 'preprocess'):
+        img_tensor = image_to_tensor(img)
+    return image_key, image_hash, None, img_tensor
+
+
+def search_vector(vector, top_k=5, max_results=50, timings=None, shards=None):
+    """
+    Find the top_k unique addresses closest to an embedding.
+    
+    Args:
+        vector: Image embedding as a list of floats
+        top_k: Number of unique addresses to return (default: 5)
+        max_results: Matches fetched by the first vector store query; more are fetched
+                     when they hold fewer than top_k unique addresses (default: 50)
+        timings: Optional dict, filled with the 'result_cache', vector store and
+                 'dedupe' durations in seconds
+        shards: Optional location hint restricting a sharded search to some
+                arrondissements (default: all shards)
+    
+    Returns:
+        List of dictionaries with unique addresses and their scores (see dedupe_addresses)
+    """
+    store = get_routed_store(shards)
+    # A cached embedding skips the vector DB round-trip too
+    results_key = f"{vector_key(vector)}:{top_k}:{max_results}:{store_key(store)}"
+    if result_cache is not None:
+        with timed(timings, 'result_cache'):
+            cached = result_cache.get(results_key)
+        if cached is not None:
+            return [dict(r) for r in cached]
+    
+    # Group by address in the store, re-querying deeper if the first
+    # max_results matches hold fewer than top_k addresses. Calibration and the
+    # street limit look at more addresses than are returned.
+    fetch = top_k
+    if get_calibrator() is not None or Config.RESULT_MAX_PER_STREET:
+        fetch = max(top_k, CANDIDATES)
+    matches = query_matches(store, vector, fetch, max_results, timings)
+    
+    with timed(timings, 'dedupe'):
+        results = dedupe_addresses(matches, top_k)
+    # A shard that timed out may answer next time
+    if result_cache is not None and not matches.partial:
+        result_cache.set(results_key, results)
+    return [dict(r) for r in results]
+
+
+def query_image_unique_addresses(image, top_k=5, max_results=50, timings=None, shards=None, views=None,
+                                 view_aggregation=None):
     """
     Query image and return top_k unique addresses.
     
     Args:
-        image_path: Path to the image file
+        image: Path to the image file, encoded image bytes, a file-like object
+               (e.g. an upload stream), a PIL image or an HxWx3 uint8 array
         top_k: Number of unique addresses to return (default: 5)
-        max_results: Maximum results to fetch from Pinecone to find unique addresses (default: 50)
+        max_results: Matches fetched by the first vector store query; more are fetched
+                     when they hold fewer than top_k unique addresses (default: 50)
+        timings: Optional dict, filled with per-stage durations in seconds: 'read',
+                 'embedding_cache', 'decode', 'near_duplicate', 'preprocess', 'embed'
+                 (queueing and forward pass), 'result_cache', the vector store's
+                 ('pinecone_connect'/'pinecone_query' or 'vector_search'), 'dedupe' and,
+                 with RERANK_ENABLED, 'rerank_features' and 'rerank'
+        shards: Optional location hint: shard names, postal codes or arrondissement
+                numbers to search instead of every shard
+        views: Test-time augmentation views embedded (default: Config.TTA_VIEWS);
+               above 1 the search goes through query_image_views, without re-ranking
+        view_aggregation: One of TTA_AGGREGATIONS (default: Config.TTA_AGGREGATION)
     
     Returns:
-        List of dictionaries with unique addresses and their scores
+        List of dictionaries with unique addresses and their scores; re-ranked
+        results also carry the blended 'rerank_score'
     """
-    global dinov2
+    views = Config.TTA_VIEWS if views is None else views
+    if views > 1:
+        return query_image_views(image, top_k, max_results, views, view_aggregation, timings, shards)
     
-    # Load model lazily if not already loaded
-    if dinov2 is None:
-        dinov2 = load_dinov2_model()
+    reranker = get_reranker()
+    if reranker is not None:
+        # Keep the bytes: re-ranking a cached embedding still needs the pixels
+        with timed(timings, 'read'):
+            image = read_image_bytes(image) or image
     
-    # Load and preprocess image
-    img = Image.open(image_path).convert('RGB')
-    img_tensor = preprocess(img).unsqueeze(0).to(device)
+    image_key, image_hash, vector, img_tensor = prepare_image(image, timings)
+    if vector is None:
+        # Generate vector embedding, batched with any concurrent requests
+        with timed(timings, 'embed'):
+            vector = get_scheduler().embed(img_tensor).numpy().tolist()
+        cache_embedding(image_key, image_hash, vector)
     
-    # Generate vector embedding
-    with torch.no_grad():
-        features = dinov2(img_tensor)
-        vector = features.squeeze().cpu().numpy().tolist()
+    if reranker is None:
+        return search_vector(vector, top_k, max_results, timings, shards)
+    return rerank_search(reranker, image, image_key, vector, img_tensor, top_k, max_results, timings, shards)
+
+
+def rerank_search(reranker, image, image_key, vector, img_tensor, top_k=5, max_results=50, timings=None, shards=None):
+    """
+    Search an embedding and re-rank the close calls (see rerank.Reranker).
     
-    # Initialize Pinecone
-    pc = pinecone.Pinecone(api_key=Config.PINECONE_API_KEY)
-    index = pc.Index(Config.PINECONE_INDEX_NAME)
+    Args:
+        reranker: Reranker, as returned by get_reranker
+        image: The query image, kept to recompute its tensor when the embedding was cached
+        image_key: Content key of the image, as returned by prepare_image
+        vector: Image embedding as a list of floats
+        img_tensor: Preprocessed image, or None when the embedding was cached
+        top_k, max_results, timings, shards: As for query_image_unique_addresses
     
-    # Query Pinecone with more results to ensure we get enough unique addresses
-    query_results = index.query(
-        vector=vector, 
-        top_k=max_results, 
-        include_metadata=True
-    )
+    Returns:
+        List of dictionaries with unique addresses, their scores and 'rerank_score' when re-ranked
+    """
+    results_key = f"{image_key}:{top_k}:{max_results}:{store_key(get_routed_store(shards))}:rerank"
+    if result_cache is not None:
+        with timed(timings, 'result_cache'):
+            cached = result_cache.get(results_key)
+        if cached is not None:
+            return [dict(r) for r in cached]
     
-    # Extract unique addresses
-    unique_addresses = {}
-    results = []
+    def query_tensor():
+        if img_tensor is not None:
+            return img_tensor
+        return image_to_tensor(decode_image(image, read_image_bytes(image)))
+    
+    # Re-score a wider candidate list, then cut to top_k
+    candidates = search_vector(vector, max(top_k, Config.RERANK_CANDIDATES), max_results, timings, shards)
+    results = reranker.rerank(candidates, query_tensor, timings)[:top_k]
+    if result_cache is not None:
+        result_cache.set(results_key, results)
+    return [dict(r) for r in results]
+
+
+def search_image_stages(image, top_k=5, max_results=50, timings=None, shards=None):
+    """
+    Search one image in stages, yielding each outcome as soon as it is known.
     
-    for match in query_results['matches']:
-        meta = match.get('metadata', {})
-        address = meta.get('address')
-        score = match.get('score', 0)
-        
-        # Skip if no address or already found this address
-        if not address or address in unique_addresses:
+    The approximate results are the plain vector search. The refined results
+    re-rank them with RERANK_ENABLED; otherwise they come from a search over
+    STREAM_REFINE_FACTOR times more matches and addresses, cut back to top_k.
+    
+    Args:
+        image, top_k, max_results, shards: As for query_image_unique_addresses
+        timings: Optional dict, filled like query_image_unique_addresses's, with
+                 the whole refining step as 'refine'
+    
+    Yields:
+        (event, data) tuples, in order: ('embedded', {'cached'}), then
+        ('results', {'stage': 'approximate', 'results'}) and
+        ('results', {'stage': 'refined', 'results', 'changed'}), where changed
+        tells whether the refined addresses or their order differ
+    """
+    reranker = get_reranker()
+    if reranker is not None:
+        with timed(timings, 'read'):
+            image = read_image_bytes(image) or image
+    
+    image_key, image_hash, vector, img_tensor = prepare_image(image, timings)
+    cached = vector is not None
+    if vector is None:
+        with timed(timings, 'embed'):
+            vector = get_scheduler().embed(img_tensor).numpy().tolist()
+        cache_embedding(image_key, image_hash, vector)
+    yield 'embedded', {'cached': cached}
+    
+    approximate = search_vector(vector, top_k, max_results, timings, shards)
+    yield 'results', {'stage': 'approximate', 'results': approximate}
+    
+    with timed(timings, 'refine'):
+        if reranker is not None:
+            refined = rerank_search(reranker, image, image_key, vector, img_tensor, top_k, max_results, None, shards)
+        else:
+            factor = Config.STREAM_REFINE_FACTOR
+            refined = search_vector(vector, top_k * factor, max_results * factor, None, shards)[:top_k]
+    changed = [r['address'] for r in refined] != [r['address'] for r in approximate]
+    yield 'results', {'stage': 'refined', 'results': refined, 'changed': changed}
+
+
+# --- Batch search ---
+# Decodes images and runs vector queries concurrently for query_images_unique_addresses.
+# Threads start on first use, so a preloaded gunicorn master never owns any.
+batch_executor = ThreadPoolExecutor(max_workers=Config.SEARCH_WORKERS, thread_name_prefix='batch-search')
+
+# Redirects followed per image URL, each hop checked like the first URL
+MAX_URL_REDIRECTS = 3
+
+
+def public_address(address):
+    """True for an IP address on the public internet: not loopback, private, link-local, reserved or multicast."""
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+def check_image_url(url):
+    """
+    Refuse a URL the server must not fetch on a caller's behalf.
+    
+    Image URLs must be enabled (Config.SEARCH_URL_ENABLED), use http or https,
+    name a host in Config.SEARCH_URL_ALLOWED_HOSTS when that list is set, and
+    resolve only to public addresses, so callers cannot reach cloud metadata,
+    loopback or private-network services.
+    
+    Raises:
+        ValueError: If the URL is refused
+    """
+    if not Config.SEARCH_URL_ENABLED:
+        raise ValueError("Image URLs are disabled; send the image itself")
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme not in ('http', 'https'):
+        raise ValueError(f"Unsupported URL scheme: {url}")
+    host = (parsed.hostname or '').rstrip('.').lower()
+    if not host:
+        raise ValueError(f"No host in URL: {url}")
+    allowed = Config.SEARCH_URL_ALLOWED_HOSTS
+    if allowed and not any(host == name or host.endswith('.' + name) for name in allowed):
+        raise ValueError(f"Host not allowed: {host}")
+    try:
+        infos = socket.getaddrinfo(host, parsed.port or (443 if parsed.scheme == 'https' else 80),
+                                   proto=socket.IPPROTO_TCP)
+    except socket.gaierror:
+        raise ValueError(f"Unknown host: {host}")
+    for info in infos:
+        if not public_address(ipaddress.ip_address(info[4][0].split('%')[0])):
+            raise ValueError(f"Host resolves to a non-public address: {host}")
+
+
+def fetch_image_url(url, timeout=None, max_bytes=None):
+    """
+    Download an image over HTTP(S) from a public host (see check_image_url).
+    
+    Args:
+        url: http:// or https:// URL of the image
+        timeout: Seconds to wait for the server (default: Config.SEARCH_URL_TIMEOUT)
+        max_bytes: Largest accepted body (default: Config.MAX_CONTENT_LENGTH)
+    
+    Returns:
+        The encoded image bytes
+    """
+    max_bytes = max_bytes or Config.MAX_CONTENT_LENGTH
+    for _ in range(MAX_URL_REDIRECTS + 1):
+        check_image_url(url)
+        # Redirects are followed here, so every hop is checked
+        with requests.get(url, timeout=timeout or Config.SEARCH_URL_TIMEOUT, stream=True,
+                          allow_redirects=False) as response:
+            if response.is_redirect:
+                url = urllib.parse.urljoin(url, response.headers['Location'])
+                continue
+            response.raise_for_status()
+            data = bytearray()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                data += chunk
+                if len(data) > max_bytes:
+                    raise ValueError(f"Image larger than {max_bytes} bytes: {url}")
+        return bytes(data)
+    raise ValueError(f"More than {MAX_URL_REDIRECTS} redirects: {url}")
+
+
+def embed_images(images, timings=None, background=False):
+    """
+    Embed several images: decoding runs in parallel and every cache miss goes
+    to the batch scheduler in one submission.
+    
+    Args:
+        images: List of images, each in any form query_image_unique_addresses accepts
+        timings: Optional dict, filled with the 'decode' and 'embed' wall times in seconds
+        background: Queue the images behind interactive ones (see batching.py)
+    
+    Returns:
+        Tuple (vectors, errors): per image, its embedding as a list of floats
+        or None, and None or the message of the error that stopped it
+    """
+    timings = {} if timings is None else timings
+    
+    stage_start = time.perf_counter()
+    futures = [batch_executor.submit(prepare_image, image) for image in images]
+    prepared = []
+    for future in futures:
+        try:
+            prepared.append(future.result())
+        except Exception as e:
+            prepared.append(e)
+    timings['decode'] = time.perf_counter() - stage_start
+    
+    stage_start = time.perf_counter()
+    errors = [f"Could not decode image: {p}" if isinstance(p, Exception) else None for p in prepared]
+    vectors = [None if isinstance(p, Exception) else p[2] for p in prepared]
+    pending = [i for i, p in enumerate(prepared) if not isinstance(p, Exception) and p[2] is None]
+    if pending:
+        embeddings = get_scheduler().embed_many([prepared[i][3] for i in pending], background=background)
+        for i, embedding in zip(pending, embeddings):
+            vectors[i] = embedding.numpy().tolist()
+            cache_embedding(prepared[i][0], prepared[i][1], vectors[i])
+    timings['embed'] = time.perf_counter() - stage_start
+    return vectors, errors
+
+
+def search_vectors(vectors, top_k=5, max_results=50, shards=None):
+    """
+    Run search_vector for several embeddings concurrently.
+    
+    Returns:
+        Per embedding, (results, vector store timings), or None where the embedding is None
+    """
+    searches = []
+    for vector in vectors:
+        if vector is None:
+            searches.append(None)
             continue
-            
-        # Store the best score for this address
-        if address not in unique_addresses or score > unique_addresses[address]['score']:
-            unique_addresses[address] = {
-                'score': score,
-                'id': match.get('id'),
-                'address': address,
-                'google_maps_url': create_google_maps_url(address)
-            }
-        
-        # Stop when we have enough unique addresses
-        if len(unique_addresses) >= top_k:
-            break
+        vector_timings = {}
+        searches.append((batch_executor.submit(search_vector, vector, top_k, max_results, vector_timings, shards),
+                         vector_timings))
+    return [None if s is None else (s[0].result(), s[1]) for s in searches]
+
+
+def query_images_unique_addresses(images, top_k=5, max_results=50, timings=None, shards=None, views=None,
+                                  view_aggregation=None, background=False):
+    """
+    Query several images at once: decoding runs in parallel, the embeddings
+    are computed in batched forward passes and the vector queries are sent
+    concurrently.
+    
+    Args:
+        images: List of images, each in any form query_image_unique_addresses accepts
+        top_k: Number of unique addresses to return per image (default: 5)
+        max_results: Matches fetched by the first vector store query (default: 50)
+        timings: Optional dict, filled with the wall time in seconds of the
+                 'decode', 'embed' and 'search' stages
+        shards: Optional location hint (see query_image_unique_addresses)
+        views, view_aggregation: Test-time augmentation (see query_image_unique_addresses);
+                                 every view of every image goes to the batch scheduler at once
+        background: Queue the images behind interactive ones, for bulk jobs
+    
+    Returns:
+        One dict per image, in order: {'results': [...], 'timings': {...}} with
+        the image's vector store durations, or {'error': message} if it could
+        not be decoded
+    """
+    timings = {} if timings is None else timings
+    views = Config.TTA_VIEWS if views is None else views
+    if views > 1:
+        vectors, errors = embed_views(images, views, view_aggregation, timings, background)
+        stage_start = time.perf_counter()
+        searches = search_views(vectors, top_k, max_results, shards)
+    else:
+        vectors, errors = embed_images(images, timings, background)
+        stage_start = time.perf_counter()
+        searches = search_vectors(vectors, top_k, max_results, shards)
+    timings['search'] = time.perf_counter() - stage_start
+    return [
+        {'error': error} if error else {'results': search[0], 'timings': search[1]}
+        for error, search in zip(errors, searches)
+    ]
+
+
+# --- Test-time augmentation ---
+TTA_AGGREGATIONS = ('mean', 'multi')
+
+
+def check_views(views, aggregation):
+    """Validate a view count and aggregation, returning the aggregation with its default applied."""
+    aggregation = aggregation or Config.TTA_AGGREGATION
+    if not 1 <= views <= len(VIEWS):
+        raise ValueError(f"views must be between 1 and {len(VIEWS)}")
+    if aggregation not in TTA_AGGREGATIONS:
+        raise ValueError(f"Unknown view aggregation '{aggregation}', expected one of {TTA_AGGREGATIONS}")
+    return aggregation
+
+
+def prepare_views(image, views, aggregation, timings=None):
+    """
+    Look up the view embeddings of an image in the cache, or decode it and
+    preprocess its first `views` VIEWS.
+    
+    Args:
+        image: Any image form accepted by query_image_unique_addresses
+        views: Number of views
+        aggregation: One of TTA_AGGREGATIONS
+        timings: Optional dict, filled with the 'read', 'embedding_cache',
+                 'decode' and 'preprocess' durations in seconds
+    
+    Returns:
+        Tuple (cache key, cached query vectors or None, (views, 3, 224, 224)
+        model input or None)
+    """
+    with timed(timings, 'read'):
+        image_bytes = read_image_bytes(image)
+    with timed(timings, 'embedding_cache'):
+        image_key = f"{image_content_key(image, image_bytes)}:views{views}:{aggregation}"
+        cached = embedding_cache.get(image_key) if embedding_cache is not None else None
+    if cached is not None:
+        # Stored as one flat vector
+        rows = 1 if aggregation == 'mean' else views
+        return image_key, np.asarray(cached, dtype=np.float32).reshape(rows, -1).tolist(), None
+    with timed(timings, 'decode'):
+        img = decode_image(image, image_bytes)
+    with timed(timings, 'preprocess'):
+        batch = preprocess_views(img, VIEWS[:views])
+    return image_key, None, batch
+
+
+def view_vectors(embeddings, aggregation):
+    """
+    Turn the embeddings of an image's views into its query vectors.
+    
+    Returns:
+        List of embeddings as lists of floats: the normalised mean for
+        'mean', every normalised view for 'multi'
+    """
+    if aggregation == 'mean':
+        return [mean_embedding(embeddings)]
+    stacked = np.asarray(embeddings, dtype=np.float32)
+    return (stacked / np.linalg.norm(stacked, axis=1, keepdims=True)).tolist()
+
+
+def embed_views(images, views, aggregation=None, timings=None, background=False):
+    """
+    Embed several views of several images. The views of every cache miss go
+    to the batch scheduler in one submission, so the views of one image share
+    a forward pass when views <= BATCH_MAX_SIZE.
+    
+    Args:
+        images: List of images, each in any form query_image_unique_addresses accepts
+        views: Number of views per image
+        aggregation: One of TTA_AGGREGATIONS (default: Config.TTA_AGGREGATION)
+        timings: Optional dict, filled with the 'decode' and 'embed' wall times in seconds
+        background: Queue the views behind interactive images (see batching.py)
+    
+    Returns:
+        Tuple (vectors, errors): per image, its list of query vectors (see
+        view_vectors) or None, and None or the message of the error that stopped it
+    """
+    aggregation = check_views(views, aggregation)
+    timings = {} if timings is None else timings
+    
+    stage_start = time.perf_counter()
+    futures = [batch_executor.submit(prepare_views, image, views, aggregation) for image in images]
+    prepared = []
+    for future in futures:
+        try:
+            prepared.append(future.result())
+        except Exception as e:
+            prepared.append(e)
+    timings['decode'] = time.perf_counter() - stage_start
+    
+    stage_start = time.perf_counter()
+    errors = [f"Could not decode image: {p}" if isinstance(p, Exception) else None for p in prepared]
+    vectors = [None if isinstance(p, Exception) else p[1] for p in prepared]
+    pending = [i for i, p in enumerate(prepared) if not isinstance(p, Exception) and p[1] is None]
+    if pending:
+        embeddings = get_scheduler().embed_many([view for i in pending for view in prepared[i][2]],
+                                                background=background)
+        for n, i in enumerate(pending):
+            vectors[i] = view_vectors([e.numpy() for e in embeddings[n * views:(n + 1) * views]], aggregation)
+            if embedding_cache is not None:
+                embedding_cache.set(prepared[i][0], np.concatenate(vectors[i]).tolist())
+    timings['embed'] = time.perf_counter() - stage_start
+    return vectors, errors
+
+
+def fuse_views(searches, top_k):
+    """
+    Merge the result lists of an image's views: each address keeps the
+    result of the view that scored it best.
+    
+    Returns:
+        The top_k results, best first
+    """
+    best = {}
+    for results in searches:
+        for result in results:
+            if result['address'] not in best or result['score'] > best[result['address']]['score']:
+                best[result['address']] = result
+    return sorted(best.values(), key=lambda r: r['score'], reverse=True)[:top_k]
+
+
+def search_views(vectors, top_k=5, max_results=50, shards=None, timings=None):
+    """
+    Search the query vectors of several images concurrently and fuse the
+    views of each image.
+    
+    Args:
+        vectors: Per image, its list of query vectors, or None
+        top_k, max_results, shards: As for search_vector
+        timings: Optional dict, filled with the 'view_fusion' duration in seconds
+    
+    Returns:
+        Per image, (results, vector store timings of its slowest view), or None
+        where the image has no vectors
+    """
+    flat = [v for image_vectors in vectors if image_vectors is not None for v in image_vectors]
+    flat_searches = iter(search_vectors(flat, top_k, max_results, shards))
+    searches = []
+    with timed(timings, 'view_fusion'):
+        for image_vectors in vectors:
+            if image_vectors is None:
+                searches.append(None)
+                continue
+            image_searches = [next(flat_searches) for _ in image_vectors]
+            stages = {}
+            for _, view_timings in image_searches:
+                for stage, seconds in view_timings.items():
+                    stages[stage] = max(stages.get(stage, 0.0), seconds)
+            searches.append((fuse_views([results for results, _ in image_searches], top_k), stages))
+    return searches
+
+
+def query_image_views(image, top_k=5, max_results=50, views=4, aggregation=None, timings=None, shards=None):
+    """
+    Query an image with test-time augmentation: its first `views` VIEWS are
+    embedded in one batch and searched as one mean vector ('mean') or as one
+    query per view, fused by best score per address ('multi').
+    
+    Args:
+        image, top_k, max_results, shards: As for query_image_unique_addresses
+        views: Number of views (default: 4)
+        aggregation: One of TTA_AGGREGATIONS (default: Config.TTA_AGGREGATION)
+        timings: Optional dict, filled like query_image_unique_addresses's, plus
+                 'view_fusion' for 'multi'
+    
+    Returns:
+        List of dictionaries with unique addresses and their scores (see dedupe_addresses)
+    """
+    aggregation = check_views(views, aggregation)
+    image_key, vectors, batch = prepare_views(image, views, aggregation, timings)
+    if vectors is None:
+        with timed(timings, 'embed'):
+            embeddings = get_scheduler().embed_many(list(batch))
+            vectors = view_vectors([e.numpy() for e in embeddings], aggregation)
+        if embedding_cache is not None:
+            embedding_cache.set(image_key, np.concatenate(vectors).tolist())
+    if len(vectors) == 1:
+        return search_vector(vectors[0], top_k, max_results, timings, shards)
+    (results, stages), = search_views([vectors], top_k, max_results, shards, timings)
+    if timings is not None:
+        timings.update(stages)
+    return results
+
+
+# --- Multi-photo fusion ---
+FUSION_METHODS = ('rrf', 'score', 'mean')
+
+# Reciprocal rank fusion constant: 1 / (RRF_K + rank)
+RRF_K = 60
+
+
+def mean_embedding(vectors):
+    """L2-normalised mean of the L2-normalised embeddings."""
+    stacked = np.asarray(vectors, dtype=np.float32)
+    stacked /= np.linalg.norm(stacked, axis=1, keepdims=True)
+    mean = stacked.mean(axis=0)
+    return (mean / np.linalg.norm(mean)).tolist()
+
+
+def query_images_fused(images, top_k=5, max_results=50, method='rrf', depth=None, timings=None, shards=None):
+    """
+    Combine several photos of the same building into one ranked address list.
+    
+    The photos are embedded in one batch and searched concurrently. Their
+    result lists are then fused:
+    
+    - 'rrf': reciprocal rank fusion, sum over photos of 1 / (60 + rank)
+    - 'score': mean cosine score over photos (0 where a photo misses the address)
+    - 'mean': one more query with the mean of the photo embeddings
+    
+    Args:
+        images: List of images, each in any form query_image_unique_addresses accepts
+        top_k: Number of addresses to return (default: 5)
+        max_results: Matches fetched by the first vector store query (default: 50)
+        method: One of FUSION_METHODS (default: 'rrf')
+        depth: Addresses taken from each photo's result list (default: 4 * top_k)
+        timings: Optional dict, filled with the 'decode', 'embed', 'search'
+                 and 'fusion' wall times in seconds
+        shards: Optional location hint (see query_image_unique_addresses)
+    
+    Returns:
+        Tuple (results, errors). results is a list of dictionaries with
+        address, score, google_maps_url and 'contributions' (per photo, its
+        share of the fused score, or its own score for 'mean'; None where the
+        photo did not find the address), best first. errors holds per photo
+        None or an error message.
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method '{method}', expected one of {FUSION_METHODS}")
+    timings = {} if timings is None else timings
+    depth = depth or 4 * top_k
+    vectors, errors = embed_images(images, timings)
+    valid = [v for v in vectors if v is not None]
+    if not valid:
+        return [], errors
+    
+    stage_start = time.perf_counter()
+    pooled = (batch_executor.submit(search_vector, mean_embedding(valid), top_k, max_results, None, shards)
+              if method == 'mean' else None)
+    searches = search_vectors(vectors, depth, max_results, shards)
+    pooled = pooled.result() if pooled is not None else None
+    timings['search'] = time.perf_counter() - stage_start
     
-    # Convert to list and sort by score
-    results = list(unique_addresses.values())
-    results.sort(key=lambda x: x['score'], reverse=True)
+    stage_start = time.perf_counter()
+    # Per address: each photo's (rank, score)
+    evidence = {}
+    for i, search in enumerate(searches):
+        if search is None:
+            continue
+        for rank, result in enumerate(search[0], 1):
+            evidence.setdefault(result['address'], [None] * len(images))[i] = (rank, result['score'])
     
-    # Return only the requested number of results
-    return results[:top_k]
+    if method == 'mean':
+        fused = [(r['address'], r['score'], [None if e is None else e[1]
+                                             for e in evidence.get(r['address'], [None] * len(images))])
+                 for r in pooled]
+    else:
+        fused = []
+        for address, hits in evidence.items():
+            if method == 'rrf':
+                contributions = [None if h is None else 1.0 / (RRF_K + h[0]) for h in hits]
+            else:
+                contributions = [None if h is None else h[1] / len(valid) for h in hits]
+            fused.append((address, sum(c for c in contributions if c is not None), contributions))
+        fused.sort(key=lambda x: x[1], reverse=True)
+    
+    results = [
+        {
+            'address': address,
+            'score': score,
+            'google_maps_url': create_google_maps_url(address),
+            'contributions': contributions,
+        }
+        for address, score, contributions in fused[:top_k]
+    ]
+    timings['fusion'] = time.perf_counter() - stage_start
+    return results, errors
+
 
-def query_image(image_path, top_k=5):
+def query_image(image, top_k=5):
     """
     Legacy function for backward compatibility.
     Now returns unique addresses by default.
     """
-    return query_image_unique_addresses(image_path, top_k=top_k)
+    return query_image_unique_addresses(image, top_k=top_k)
+
 
 if __name__ == "__main__":
     # Example usage
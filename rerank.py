@@ -0,0 +1,322 @@
+"""
+Second-stage re-ranking with DINOv2 patch features.
+
+The global embedding cannot always tell apart similar façades on the same
+street. When the top two addresses score within RERANK_GAP of each other,
+the candidates are re-scored with regional descriptors: the 16x16 DINOv2
+patch tokens average-pooled to a 4x4 grid, projected to a few PCA
+dimensions. Each query region is matched to its most similar candidate
+region and the matches are averaged. The result is blended with the global
+cosine score.
+
+Candidate descriptors are precomputed and stored compactly: int8 values
+with one scale per region, memory-mapped and looked up by vector ID. Query
+descriptors come from a second forward pass, which runs on its own batch
+scheduler and is abandoned if it does not finish within RERANK_BUDGET_MS.
+
+Feature store layout (one directory):
+    ids.npy       (n,) vector IDs, sorted
+    features.npy  (n, regions, dim) int8 descriptors
+    scales.npy    (n, regions) float16 dequantisation scale per descriptor
+    pca.npz       mean (768,) and components (dim, 768)
+
+Usage:
+    python rerank.py build --source /data/addresses-paris --output rerank
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+import torch
+
+from batching import BatchScheduler
+from config import Config, IMAGES_FOLDER
+from metrics import timed
+from model_loader import HalfPrecisionModel, device, get_model
+
+# Patch tokens are pooled to GRID x GRID regions
+GRID = 4
+
+# Inference backends whose model exposes the patch tokens (torchscript is a frozen trace)
+RERANK_BACKENDS = ('eager', 'int8', 'bf16', 'fp16')
+
+
+def check_rerank_backend():
+    """Refuse RERANK_ENABLED with an inference backend that cannot give patch tokens."""
+    if Config.RERANK_ENABLED and Config.INFERENCE_BACKEND not in RERANK_BACKENDS:
+        raise ValueError(f"RERANK_ENABLED needs INFERENCE_BACKEND set to one of {', '.join(RERANK_BACKENDS)}, "
+                         f"not {Config.INFERENCE_BACKEND!r}")
+
+
+def regional_descriptors(batch, grid=GRID):
+    """
+    Pool the DINOv2 patch tokens of a batch to grid x grid regional descriptors.
+
+    Args:
+        batch: Preprocessed (n, 3, 224, 224) tensor
+        grid: Regions per side (default: 4)
+
+    Returns:
+        float32 CPU tensor of shape (n, grid * grid, 768)
+    """
+    model = get_model()
+    dtype = torch.float32
+    if isinstance(model, HalfPrecisionModel):
+        model, dtype = model.model, model.dtype
+    if not hasattr(model, 'forward_features'):
+        raise RuntimeError("Re-ranking needs the eager, int8, bf16 or fp16 inference backend")
+    with torch.no_grad():
+        tokens = model.forward_features(batch.to(device, dtype))['x_norm_patchtokens'].float()
+    n, count, dim = tokens.shape
+    side = int(count ** 0.5)
+    patches = tokens.transpose(1, 2).reshape(n, dim, side, side)
+    pooled = torch.nn.functional.adaptive_avg_pool2d(patches, grid)
+    return pooled.flatten(2).transpose(1, 2).cpu()
+
+
+def project(descriptors, mean, components):
+    """PCA-project descriptors (..., 768) to (..., dim) and L2-normalise them."""
+    projected = (np.asarray(descriptors, dtype=np.float32) - mean) @ components.T
+    projected /= np.maximum(np.linalg.norm(projected, axis=-1, keepdims=True), 1e-6)
+    return projected
+
+
+def quantize(descriptors):
+    """Return (int8 values, float16 scales) with one scale per descriptor."""
+    scales = np.maximum(np.abs(descriptors).max(axis=-1), 1e-6) / 127.0
+    values = np.round(descriptors / scales[..., None]).astype(np.int8)
+    return values, scales.astype(np.float16)
+
+
+def local_scores(query, candidates):
+    """
+    Region-matching similarity of one query to several candidates.
+
+    Args:
+        query: (regions, dim) normalised query descriptors
+        candidates: (m, regions, dim) normalised candidate descriptors
+
+    Returns:
+        (m,) mean over query regions of the best cosine with any region of the candidate
+    """
+    similarities = np.einsum('rd,msd->mrs', query, candidates)
+    return similarities.max(axis=2).mean(axis=1)
+
+
+class FeatureStore:
+    """Precomputed candidate descriptors, memory-mapped and looked up by vector ID."""
+
+    def __init__(self, directory):
+        self.ids = np.load(os.path.join(directory, 'ids.npy'), mmap_mode='r')
+        self.features = np.load(os.path.join(directory, 'features.npy'), mmap_mode='r')
+        self.scales = np.load(os.path.join(directory, 'scales.npy'), mmap_mode='r')
+        with np.load(os.path.join(directory, 'pca.npz')) as pca:
+            self.mean = pca['mean']
+            self.components = pca['components']
+
+    def lookup(self, ids):
+        """
+        Fetch the descriptors of some vectors.
+
+        Returns:
+            Tuple (found mask, (found, regions, dim) float32 descriptors)
+        """
+        ids = np.asarray(ids, dtype=str)
+        rows = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        found = self.ids[rows] == ids
+        rows = rows[found]
+        # Sorted rows read the memory map front to back
+        order = np.argsort(rows)
+        values = np.empty((len(rows),) + self.features.shape[1:], dtype=np.float32)
+        values[order] = self.features[rows[order]] * self.scales[rows[order]][..., None].astype(np.float32)
+        return found, values
+
+
+class Reranker:
+    """
+    Re-scores close calls with regional descriptors.
+
+    Args:
+        store: FeatureStore with the candidates' descriptors
+        weight: Share of the local score in the blended score (default: Config.RERANK_WEIGHT)
+        gap: Re-rank only when the top two scores differ by less than this
+             (default: Config.RERANK_GAP)
+        budget_ms: Longest the query feature pass may take (default: Config.RERANK_BUDGET_MS)
+    """
+
+    def __init__(self, store, weight=None, gap=None, budget_ms=None):
+        self.store = store
+        self.weight = Config.RERANK_WEIGHT if weight is None else weight
+        self.gap = Config.RERANK_GAP if gap is None else gap
+        self.budget = (Config.RERANK_BUDGET_MS if budget_ms is None else budget_ms) / 1000.0
+        self.scheduler = BatchScheduler(model_fn=regional_descriptors)
+        self.counts = {'reranked': 0, 'confident': 0, 'over_budget': 0, 'no_features': 0, 'error': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def rerank(self, results, image_tensor, timings=None):
+        """
+        Re-order results when the top two are too close to call.
+
+        Args:
+            results: Address results, best first, each with 'id' and 'score'
+            image_tensor: Callable returning the query's preprocessed (3, 224, 224) tensor
+            timings: Optional dict, filled with the 'rerank_features' (query forward pass)
+                     and 'rerank' (scoring) durations in seconds
+
+        Returns:
+            The results, re-ordered by 'rerank_score' when re-ranked, unchanged
+            otherwise, including when the feature pass fails
+        """
+        if len(results) < 2 or results[0]['score'] - results[1]['score'] >= self.gap:
+            self._count('confident')
+            return results
+        found, candidates = self.store.lookup([r['id'] for r in results])
+        if not found.any():
+            self._count('no_features')
+            return results
+
+        with timed(timings, 'rerank_features'):
+            future = None
+            try:
+                future = self.scheduler.submit(image_tensor())
+                query = future.result(timeout=self.budget)
+            except FutureTimeoutError:
+                # Drop the pass if it has not started; the global order stands
+                future.cancel()
+                self._count('over_budget')
+                return results
+            except Exception as e:
+                # Re-ranking is optional: a failed or shed feature pass keeps the cosine order
+                print(f"Re-ranking skipped: {e}")
+                if future is not None:
+                    future.cancel()
+                self._count('error')
+                return results
+
+        with timed(timings, 'rerank'):
+            local = local_scores(project(query.numpy(), self.store.mean, self.store.components), candidates)
+            blended = np.array([r['score'] for r in results], dtype=np.float32)
+            # Candidates without stored features keep their global score
+            blended[found] = (1 - self.weight) * blended[found] + self.weight * local
+            reranked = [dict(r, rerank_score=float(s)) for r, s in zip(results, blended)]
+            reranked.sort(key=lambda r: r['rerank_score'], reverse=True)
+        self._count('reranked')
+        return reranked
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+    """Return this process's Reranker, or None when re-ranking is disabled."""
+    global _reranker
+    if not Config.RERANK_ENABLED:
+        return None
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = Reranker(FeatureStore(Config.RERANK_DIR))
+    return _reranker
+
+
+def _reset_after_fork():
+    # The scheduler thread does not exist in the child; the memory maps are reopened lazily
+    global _reranker, _reranker_lock
+    _reranker = None
+    _reranker_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# --- Building the feature store ---
+def _embed_regions(source, keys, batch_size, workers):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from ingest import StageTimer, _decoded_batches
+    from preprocessing import preprocess_images
+
+    timer = StageTimer()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch in _decoded_batches(source, keys, batch_size, pool, timer):
+            batch = [(key, img) for key, img in batch if img is not None]
+            if batch:
+                yield [key for key, _ in batch], regional_descriptors(preprocess_images([img for _, img in batch])).numpy()
+
+
+def build_feature_store(source, directory, dim=64, pca_samples=2000, batch_size=32, workers=4, seed=0):
+    """
+    Compute and store the regional descriptors of every image of a source.
+
+    Args:
+        source: FolderSource or BucketSource, as used by ingest.py
+        directory: Output directory
+        dim: PCA dimensions kept per descriptor (default: 64)
+        pca_samples: Images used to fit the PCA (default: 2000)
+        batch_size: Images per forward pass (default: 32)
+        workers: Decoding threads (default: 4)
+        seed: Seed for the PCA sample
+
+    Returns:
+        Number of images stored
+    """
+    from ingest import vector_id
+
+    os.makedirs(directory, exist_ok=True)
+    keys = source.keys()
+    rng = np.random.default_rng(seed)
+    sample = sorted(rng.choice(keys, size=min(pca_samples, len(keys)), replace=False).tolist())
+
+    print(f"Fitting PCA on {len(sample)} images...")
+    descriptors = np.concatenate([d.reshape(-1, d.shape[-1])
+                                  for _, d in _embed_regions(source, sample, batch_size, workers)])
+    mean = descriptors.mean(axis=0)
+    _, _, vt = np.linalg.svd(descriptors - mean, full_matrices=False)
+    components = vt[:dim].astype(np.float32)
+    np.savez(os.path.join(directory, 'pca.npz'), mean=mean.astype(np.float32), components=components)
+
+    ids, values, scales = [], [], []
+    started = time.perf_counter()
+    for batch_keys, batch in _embed_regions(source, keys, batch_size, workers):
+        v, s = quantize(project(batch, mean, components))
+        ids.extend(vector_id(key) for key in batch_keys)
+        values.append(v)
+        scales.append(s)
+        print(f"{len(ids)}/{len(keys)} images, {len(ids) / (time.perf_counter() - started):.1f} img/s")
+
+    from vector_store import _save
+
+    ids = np.asarray(ids, dtype=str)
+    order = np.argsort(ids)
+    _save(directory, 'features.npy', np.concatenate(values)[order])
+    _save(directory, 'scales.npy', np.concatenate(scales)[order])
+    _save(directory, 'ids.npy', ids[order])
+    return len(ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-ranking feature store tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="Compute the regional descriptors of an image folder or bucket")
+    build.add_argument('--source', default=IMAGES_FOLDER,
+                       help="Image folder or gs://bucket/prefix (default: IMAGES_FOLDER)")
+    build.add_argument('--output', default=Config.RERANK_DIR, help="Feature store directory (default: RERANK_DIR)")
+    build.add_argument('--dim', type=int, default=64, help="PCA dimensions per descriptor")
+    build.add_argument('--pca-samples', type=int, default=2000)
+    build.add_argument('--batch-size', type=int, default=32)
+    build.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    from ingest import BucketSource, FolderSource
+
+    source = BucketSource(args.source) if args.source.startswith('gs://') else FolderSource(args.source)
+    count = build_feature_store(source, args.output, args.dim, args.pca_samples, args.batch_size, args.workers)
+    print(f"Wrote features for {count} images to {args.output}")
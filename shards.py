@@ -0,0 +1,195 @@
+"""
+Sharded search across per-arrondissement indexes.
+
+With SHARDS set (e.g. "75017,75018"), each shard is a namespace of the
+Pinecone index, or a sub-directory of LOCAL_INDEX_DIR for the local store.
+A query fans out to every shard, or to the ones picked by a location hint,
+in parallel. Each shard returns its best match per address. The router
+merges them with a heap into one global top_k, keeping one entry per address
+across shards.
+
+A shard that has not answered within SHARD_TIMEOUT_MS, or that fails, is
+left out. The response is then marked partial, and search_vector does not
+cache it. Each shard is queried from its own thread pool, and a Pinecone
+query is given the same timeout, so a stuck shard ties up only its own
+threads and only until then.
+"""
+import heapq
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from config import Config
+from metrics import registry
+
+SHARD_FAILURES = registry.counter('shard_failures_total', "Shard queries left out of a merged result",
+                                  ('shard', 'reason'))
+
+# Per-shard thread pools running the shard queries. Threads start on first
+# use, so a preloaded gunicorn master never owns any.
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def shard_executor(name):
+    """Thread pool querying one shard, created on first use."""
+    executor = _executors.get(name)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                executor = _executors[name] = ThreadPoolExecutor(max_workers=Config.SHARD_WORKERS,
+                                                                 thread_name_prefix=f'shard-{name}')
+    return executor
+
+
+def _reset_after_fork():
+    # Pool threads do not exist in the child
+    global _executors_lock
+    _executors.clear()
+    _executors_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def configured_shards():
+    """Shard names from Config.SHARDS, in order."""
+    return [name.strip() for name in Config.SHARDS.split(',') if name.strip()]
+
+
+def postal_code(value):
+    """Paris postal code for an arrondissement given as '18', '75018' or 'paris-18', or None."""
+    digits = re.sub(r'\D', '', str(value))
+    if not digits:
+        return None
+    return digits if len(digits) == 5 else f"750{int(digits):02d}"
+
+
+def coverage_label(names):
+    """Human-readable coverage, e.g. 'Paris 17, 18' for shards named by postal code."""
+    codes = [postal_code(name) for name in names]
+    if all(code and code.startswith('750') for code in codes):
+        return "Paris " + ", ".join(str(int(code[-2:])) for code in codes)
+    return ", ".join(names)
+
+
+class ShardedStore:
+    """
+    Fans grouped queries out to several stores and merges the results.
+
+    Args:
+        stores: Dict mapping shard name to a PineconeStore or LocalStore
+        timeout_ms: Longest wait for the shards of one query (default: Config.SHARD_TIMEOUT_MS)
+    """
+
+    name = 'sharded'
+    version = None
+
+    def __init__(self, stores, timeout_ms=None):
+        self.stores = stores
+        self.timeout = (Config.SHARD_TIMEOUT_MS if timeout_ms is None else timeout_ms) / 1000.0
+
+    def route(self, hint):
+        """
+        Restrict the store to the shards named by a location hint.
+
+        Args:
+            hint: Shard name, postal code or arrondissement number, a
+                  comma-separated string of them, or a list
+
+        Returns:
+            ShardedStore over the matching shards
+        """
+        values = hint.split(',') if isinstance(hint, str) else hint
+        selected = {}
+        for value in values:
+            value = str(value).strip()
+            names = [name for name in self.stores
+                     if name == value or (postal_code(value) and postal_code(name) == postal_code(value))]
+            if not names:
+                raise ValueError(f"Unknown shard {value!r}, expected one of {', '.join(self.stores)}")
+            selected.update((name, self.stores[name]) for name in names)
+        return ShardedStore(selected, self.timeout * 1000)
+
+    def _fan_out(self, method, *args):
+        # Returns (per-shard match lists, names of the shards left out)
+        # The store's own timeout ends a stuck query, freeing its thread
+        futures = {shard_executor(name).submit(getattr(store, method), *args, timeout=self.timeout): name
+                   for name, store in self.stores.items()}
+        done, pending = wait(futures, timeout=self.timeout)
+        failed = []
+        for future in pending:
+            future.cancel()
+            failed.append(futures[future])
+            SHARD_FAILURES.inc(shard=futures[future], reason='timeout')
+        responses = []
+        for future in done:
+            try:
+                responses.append(future.result()['matches'])
+            except Exception as e:
+                print(f"Shard {futures[future]} failed: {e}")
+                failed.append(futures[future])
+                SHARD_FAILURES.inc(shard=futures[future], reason='error')
+        if failed:
+            print(f"Partial result: shards {', '.join(sorted(failed))} left out")
+        return responses, sorted(failed)
+
+    def query(self, vector, top_k, include_metadata=True, timings=None):
+        """
+        The top_k matches over all shards.
+
+        Returns:
+            Pinecone-style response, best first, plus 'partial' and the 'failed_shards' left out
+        """
+        start = time.perf_counter()
+        responses, failed = self._fan_out('query', vector, top_k, include_metadata)
+        if timings is not None:
+            timings['shard_fanout'] = time.perf_counter() - start
+        matches = heapq.nlargest(top_k, (m for matches in responses for m in matches), key=lambda m: m['score'])
+        return {'matches': matches, 'partial': bool(failed), 'failed_shards': failed}
+
+    def query_grouped(self, vector, top_k, max_results=50, timings=None):
+        """
+        Best match for each of the top_k addresses over all shards.
+
+        Returns:
+            Pinecone-style response with at most one match per address, best
+            first, plus 'partial' and the 'failed_shards' left out
+        """
+        start = time.perf_counter()
+        responses, failed = self._fan_out('query_grouped', vector, top_k, max_results)
+
+        # Each shard already holds one match per address; an address on a
+        # shard border keeps its best score
+        best = {}
+        for matches in responses:
+            for match in matches:
+                address = (match.get('metadata') or {}).get('address')
+                if address and (address not in best or match['score'] > best[address]['score']):
+                    best[address] = match
+        if timings is not None:
+            timings['shard_fanout'] = time.perf_counter() - start
+        return {
+            'matches': heapq.nlargest(top_k, best.values(), key=lambda m: m['score']),
+            'partial': bool(failed),
+            'failed_shards': failed,
+        }
+
+    def count(self):
+        return sum(store.count() for store in self.stores.values())
+
+    def address_count(self):
+        """Live addresses over the local shards; one on a shard border counts once per shard."""
+        return sum(store.address_count() for store in self.stores.values())
+
+    def reloaded(self):
+        """This store, or a new one if any local shard has a newer version."""
+        stores = {name: store.reloaded() if hasattr(store, 'reloaded') else store
+                  for name, store in self.stores.items()}
+        if all(stores[name] is self.stores[name] for name in stores):
+            return self
+        return ShardedStore(stores, self.timeout * 1000)
+
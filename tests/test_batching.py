@@ -0,0 +1,92 @@
+"""
+BatchScheduler with a stand-in model: coalescing, shedding and the background lane.
+"""
+import threading
+
+import pytest
+import torch
+
+from batching import BatchScheduler, QueueFullError
+
+
+class StandInModel:
+    """Embeds each image as its mean pixel; the first pass can be held at a gate."""
+
+    def __init__(self, hold_first=False):
+        self.batches = []
+        self.gate = threading.Event()
+        self.started = threading.Event()
+        if not hold_first:
+            self.gate.set()
+
+    def __call__(self, batch):
+        self.started.set()
+        self.gate.wait(5)
+        self.batches.append([round(float(t.mean()), 3) for t in batch])
+        return batch.mean(dim=(2, 3))
+
+
+def image(value):
+    return torch.full((3, 224, 224), float(value))
+
+
+def test_concurrent_images_share_one_pass():
+    model = StandInModel(hold_first=True)
+    scheduler = BatchScheduler(model, max_batch_size=8, max_wait_ms=50, max_queue_size=64)
+    first = scheduler.submit(image(0))
+    assert model.started.wait(5)
+    # Queued while the first pass runs, so they go together in the next one
+    futures = [scheduler.submit(image(i)) for i in range(1, 6)]
+    model.gate.set()
+
+    assert first.result(5)[0] == 0
+    assert [float(f.result(5)[0]) for f in futures] == [1, 2, 3, 4, 5]
+    assert model.batches == [[0], [1, 2, 3, 4, 5]]
+    assert scheduler.batches_run == 2 and scheduler.images_run == 6
+
+
+def test_passes_are_capped_at_max_batch_size():
+    model = StandInModel(hold_first=True)
+    scheduler = BatchScheduler(model, max_batch_size=2, max_wait_ms=50, max_queue_size=64)
+    scheduler.submit(image(0))
+    assert model.started.wait(5)
+    futures = [scheduler.submit(image(i)) for i in range(1, 6)]
+    model.gate.set()
+
+    for f in futures:
+        f.result(5)
+    assert [len(b) for b in model.batches] == [1, 2, 2, 1]
+
+
+def test_embed_many_sheds_the_whole_request_when_the_queue_is_full():
+    model = StandInModel(hold_first=True)
+    scheduler = BatchScheduler(model, max_batch_size=8, max_wait_ms=0, max_queue_size=3)
+    busy = scheduler.submit(image(0))
+    assert model.started.wait(5)
+
+    with pytest.raises(QueueFullError):
+        scheduler.embed_many([image(i) for i in range(1, 6)])
+    model.gate.set()
+    busy.result(5)
+    scheduler.embed(image(9), timeout=5)
+
+    # The three images queued before the queue filled were cancelled, not embedded
+    assert model.batches == [[0], [9]]
+
+
+
+
+
+def test_background_images_wait_behind_interactive_ones():
+    model = StandInModel(hold_first=True)
+    scheduler = BatchScheduler(model, max_batch_size=8, max_wait_ms=50, max_queue_size=64,
+                               max_background_batch=2)
+    scheduler.submit(image(0))
+    assert model.started.wait(5)
+    background = [scheduler.submit(image(i), background=True) for i in (10, 11, 12)]
+    interactive = [scheduler.submit(image(i)) for i in (1, 2)]
+    model.gate.set()
+
+    for f in background + interactive:
+        f.result(5)
+    assert model.batches == [[0], [1, 2], [10, 11], [12]]
@@ -0,0 +1,45 @@
+"""
+Cache keys and counters.
+"""
+import threading
+
+from cache import SQLiteCache
+from config import Config
+from query_pinecone import image_content_key
+
+
+def test_embedding_key_depends_on_the_embedding_space(monkeypatch):
+    data = b'same upload'
+    monkeypatch.setattr(Config, 'INFERENCE_BACKEND', 'eager')
+    monkeypatch.setattr(Config, 'FAST_PREPROCESS', True)
+    monkeypatch.setattr(Config, 'DINOV2_WEIGHTS_PATH', None)
+    eager = image_content_key(None, data)
+    assert image_content_key(None, data) == eager
+
+    monkeypatch.setattr(Config, 'INFERENCE_BACKEND', 'int8')
+    int8 = image_content_key(None, data)
+    monkeypatch.setattr(Config, 'FAST_PREPROCESS', False)
+    reference = image_content_key(None, data)
+    monkeypatch.setattr(Config, 'DINOV2_WEIGHTS_PATH', '/opt/torch/dinov2_vitb14_bf16.pth')
+    bf16_weights = image_content_key(None, data)
+
+    assert len({eager, int8, reference, bf16_weights}) == 4
+
+
+def test_sqlite_counters_are_exact_under_threads(tmp_path):
+    cache = SQLiteCache(str(tmp_path / 'cache.db'), 'results', 100, 60, str, str)
+    cache.set('hit', 'value')
+
+    def lookups():
+        for _ in range(200):
+            cache.get('hit')
+            cache.get('miss')
+
+    threads = [threading.Thread(target=lookups) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert cache.stats()['hits'] == 1600
+    assert cache.stats()['misses'] == 1600
@@ -0,0 +1,115 @@
+"""
+Bulk jobs: archive extraction by the runner, lease takeover and cancellation.
+"""
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import zipfile
+
+import pytest
+
+import jobs
+import query_pinecone
+from config import Config
+from jobs import JobRunner, JobStore, cancel_job, submit_job
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'JOBS_DIR', str(tmp_path / 'jobs'))
+    monkeypatch.setattr(jobs, '_store', JobStore(str(tmp_path / 'jobs' / 'jobs.db')))
+    return jobs._store
+
+
+def archive(*names):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        for name in names:
+            zf.writestr(name, b'not really an image')
+    buffer.seek(0)
+    return buffer
+
+
+def fake_search(paths, top_k, shards, views, background):
+    return [{'results': [{'address': f"{i} rue A"}]} for i in range(len(paths))]
+
+
+def test_archive_is_extracted_by_the_runner(store, monkeypatch):
+    monkeypatch.setattr(query_pinecone, 'query_images_unique_addresses', fake_search)
+    job = submit_job(archive('a.jpg', 'notes.txt', 'b/c.png'))
+    # Submitting only saves the archive
+    assert (job['status'], job['total']) == ('queued', 0)
+    assert jobs.job_summary(job)['extracting']
+    assert os.path.exists(jobs.upload_path(job['id']))
+
+    JobRunner(store, rate=0)._process(store.claim('host:1:0', 60), 'host:1:0')
+
+    job = store.get(job['id'])
+    assert (job['status'], job['total'], job['done']) == ('done', 2, 2)
+    assert [json.loads(r)['name'] for r in store.results(job['id'])] == ['a.jpg', 'b/c.png']
+    assert not jobs.job_summary(job)['extracting']
+
+
+def test_archive_without_images_fails_the_job(store):
+    job = submit_job(archive('notes.txt'))
+    JobRunner(store, rate=0)._process(store.claim('host:1:0', 60), 'host:1:0')
+
+    job = store.get(job['id'])
+    assert (job['status'], job['error']) == ('failed', "No images in the job")
+
+
+def test_submit_refuses_a_file_that_is_not_an_archive(store):
+    with pytest.raises(ValueError):
+        submit_job(io.BytesIO(b'plain text'))
+
+
+def test_expired_lease_is_taken_over(store):
+    store.create('job', [('a.jpg', '/tmp/a.jpg')], {'top_k': 5, 'shards': None, 'views': 1})
+    assert store.claim('elsewhere:1:0', 0.2)['id'] == 'job'
+    # Held by a live runner of another host until its lease runs out
+    assert store.claim('here:1:0', 60) is None
+    time.sleep(0.3)
+    assert store.claim('here:1:0', 60)['runner'] == 'here:1:0'
+    # The first runner can no longer renew the job or store results
+    assert not store.renew('job', 'elsewhere:1:0', 60)
+    assert not store.record('job', 'elsewhere:1:0', [(0, 'done', {})])
+
+
+def test_job_of_an_exited_local_process_is_taken_over_at_once(store):
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    store.create('job', [('a.jpg', '/tmp/a.jpg')], {'top_k': 5, 'shards': None, 'views': 1})
+    store.claim(f"{socket.gethostname()}:{exited.pid}:0", 3600)
+
+    assert store.claim('here:1:0', 60)['id'] == 'job'
+
+
+def test_cancel_during_a_batch_keeps_earlier_results(store, monkeypatch):
+    searching, release = threading.Event(), threading.Event()
+    batches = []
+
+    def slow_search(paths, **kwargs):
+        batches.append(len(paths))
+        if len(batches) == 2:
+            searching.set()
+            release.wait(5)
+        return fake_search(paths, **kwargs)
+
+    monkeypatch.setattr(query_pinecone, 'query_images_unique_addresses', slow_search)
+    store.create('job', [(f"{i}.jpg", f"/tmp/{i}.jpg") for i in range(6)], {'top_k': 5, 'shards': None, 'views': 1})
+    runner = JobRunner(store, batch_size=2, rate=0)
+    thread = threading.Thread(target=runner._process, args=(store.claim('host:1:0', 60), 'host:1:0'))
+    thread.start()
+    assert searching.wait(5)
+    assert cancel_job('job')
+    release.set()
+    thread.join(5)
+
+    job = store.get('job')
+    assert (job['status'], job['done'], job['pending']) == ('cancelled', 2, 4)
+    assert batches == [2, 2]
@@ -0,0 +1,79 @@
+"""
+IndexManager against the local Pinecone stand-in.
+"""
+import os
+
+import pytest
+
+from config import Config
+from local_pinecone import LocalPineconeServer, synthetic_index
+from pinecone_pool import IndexManager, index_manager
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = LocalPineconeServer(*synthetic_index(200, 20)).start()
+    monkeypatch.setattr(Config, 'PINECONE_API_KEY', 'local')
+    monkeypatch.setattr(Config, 'PINECONE_INDEX_HOST', server.url)
+    yield server
+    server.stop()
+
+
+def query(manager, server):
+    timings = {}
+    response = manager.query(server.vectors[0].tolist(), top_k=3, timings=timings)
+    assert response['matches'][0]['id'] == 'img_0'
+    return timings
+
+
+def test_queries_reuse_one_handle(server):
+    manager = IndexManager()
+    first = query(manager, server)
+    index = manager._index
+    second = query(manager, server)
+
+    assert first['pinecone_connect'] > 0
+    assert second['pinecone_connect'] == 0.0
+    assert manager._index is index
+    assert server.query_count == 2
+
+
+def test_reset_rebuilds_the_handle(server):
+    manager = IndexManager()
+    query(manager, server)
+    index = manager._index
+
+    manager.reset()
+    timings = query(manager, server)
+
+    assert timings['pinecone_connect'] > 0
+    assert manager._index is not index
+
+
+def test_forked_child_builds_its_own_handle(server):
+    manager = IndexManager()
+    query(manager, server)
+    index = manager._index
+
+    pid = os.fork()
+    if pid == 0:
+        # The parent's handle, and its pooled sockets, must not be reused here
+        try:
+            _, connect_time = manager.get_index()
+            os._exit(0 if manager._index is not index and connect_time > 0 else 1)
+        except BaseException:
+            os._exit(2)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert manager._index is index
+
+
+def test_fork_hook_resets_the_process_manager(monkeypatch):
+    monkeypatch.setattr(index_manager, '_index', object())
+    monkeypatch.setattr(index_manager, '_pid', os.getpid())
+
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if index_manager._index is None and index_manager._pid is None else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
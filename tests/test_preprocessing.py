@@ -0,0 +1,54 @@
+"""
+Fast preprocessing against the reference torchvision pipeline, on synthetic JPEGs.
+"""
+import io
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from preprocessing import open_image, preprocess_image, preprocess_views
+from query_pinecone import preprocess
+
+# Normalised units: one 8-bit step is 1 / 255 / std, about 0.017
+MAX_MEAN_ABS_DIFF = 0.01
+MAX_ABS_DIFF = 3 / 255 / 0.224
+MIN_COSINE = 0.9995
+
+SIZES = [(4032, 3024), (3024, 4032), (800, 600), (200, 150), (150, 200), (100, 100)]
+
+
+def synthetic_jpeg(width, height):
+    # Smooth colour waves, like a façade photo at model resolution
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    pixels = np.stack([
+        127 + 100 * np.sin(x / width * 7) * np.cos(y / height * 5),
+        127 + 100 * np.sin((x + y) / (width + height) * 11),
+        x / width * 255,
+    ], axis=-1)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels.clip(0, 255).astype(np.uint8)).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('width,height', SIZES)
+def test_fast_path_matches_reference(width, height):
+    data = synthetic_jpeg(width, height)
+    reference = preprocess(Image.open(io.BytesIO(data)).convert('RGB'))
+    fast = preprocess_image(open_image(data))
+
+    assert fast.shape == reference.shape == (3, 224, 224)
+    difference = (fast - reference).abs()
+    assert difference.mean() < MAX_MEAN_ABS_DIFF
+    assert difference.max() < MAX_ABS_DIFF
+    assert torch.nn.functional.cosine_similarity(fast.flatten(), reference.flatten(), dim=0) > MIN_COSINE
+
+
+@pytest.mark.parametrize('width,height', SIZES)
+def test_first_view_is_the_center_crop(width, height):
+    img = open_image(synthetic_jpeg(width, height))
+    views = preprocess_views(img, ['center', 'full', 'left_flip'])
+
+    assert views.shape == (3, 3, 224, 224)
+    assert torch.allclose(views[0], preprocess_image(img), atol=1e-6)
@@ -0,0 +1,50 @@
+"""
+Re-ranking falls back to the cosine order when its feature pass cannot help.
+"""
+import numpy as np
+import pytest
+import torch
+
+from batching import BatchScheduler, QueueFullError
+from config import Config
+from rerank import Reranker, check_rerank_backend
+
+RESULTS = [{'id': 'a', 'score': 0.90}, {'id': 'b', 'score': 0.899}]
+
+
+class StandInFeatures:
+    mean = np.zeros(768, dtype=np.float32)
+    components = np.eye(8, 768, dtype=np.float32)
+
+    def lookup(self, ids):
+        return np.ones(len(ids), dtype=bool), np.ones((len(ids), 16, 8), dtype=np.float32)
+
+
+class FullScheduler:
+    def submit(self, img_tensor, background=False):
+        raise QueueFullError("Inference queue is full")
+
+
+def failing_pass(batch):
+    raise RuntimeError("no patch tokens in a torchscript trace")
+
+
+@pytest.mark.parametrize('scheduler', [BatchScheduler(model_fn=failing_pass), FullScheduler()])
+def test_failed_feature_pass_keeps_the_cosine_order(scheduler):
+    reranker = Reranker(StandInFeatures(), weight=0.5, gap=0.01, budget_ms=2000)
+    reranker.scheduler = scheduler
+
+    results = reranker.rerank(RESULTS, lambda: torch.zeros(3, 224, 224))
+
+    assert results == RESULTS
+    assert reranker.counts['error'] == 1
+
+
+def test_torchscript_backend_is_refused_at_startup(monkeypatch):
+    monkeypatch.setattr(Config, 'RERANK_ENABLED', True)
+    monkeypatch.setattr(Config, 'INFERENCE_BACKEND', 'torchscript')
+    with pytest.raises(ValueError, match="INFERENCE_BACKEND"):
+        check_rerank_backend()
+
+    monkeypatch.setattr(Config, 'INFERENCE_BACKEND', 'bf16')
+    check_rerank_backend()
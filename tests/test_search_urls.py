@@ -0,0 +1,90 @@
+"""
+Image URLs: only public hosts are fetched, redirects included.
+"""
+import ipaddress
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import query_pinecone
+from config import Config
+from query_pinecone import check_image_url, fetch_image_url
+
+
+@pytest.mark.parametrize('url', [
+    'http://127.0.0.1/photo.jpg',
+    'http://localhost:8080/photo.jpg',
+    'http://169.254.169.254/latest/meta-data/',
+    'http://10.0.0.5/photo.jpg',
+    'http://192.168.1.1/photo.jpg',
+    'http://[::1]/photo.jpg',
+    'http://[::ffff:127.0.0.1]/photo.jpg',
+    'http://0.0.0.0/photo.jpg',
+    'file:///etc/passwd',
+])
+def test_non_public_urls_are_refused(url):
+    with pytest.raises(ValueError):
+        check_image_url(url)
+
+
+def test_allowed_hosts_restrict_urls(monkeypatch):
+    monkeypatch.setattr(Config, 'SEARCH_URL_ALLOWED_HOSTS', ['images.example.com'])
+    with pytest.raises(ValueError, match="not allowed"):
+        check_image_url('https://evil.example.org/photo.jpg')
+    with pytest.raises(ValueError, match="not allowed"):
+        check_image_url('https://notimages.example.com/photo.jpg')
+
+
+def test_urls_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(Config, 'SEARCH_URL_ENABLED', False)
+    with pytest.raises(ValueError, match="disabled"):
+        check_image_url('https://images.example.com/photo.jpg')
+
+
+@pytest.fixture
+def redirecting_server(monkeypatch):
+    # A server on loopback, trusted for this test only, that redirects to cloud metadata
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == '/photo.jpg':
+                self.send_response(200)
+                self.send_header('Content-Length', '4')
+                self.end_headers()
+                self.wfile.write(b'JPEG')
+            else:
+                self.send_response(302)
+                self.send_header('Location', 'http://169.254.169.254/latest/meta-data/')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    public_address = query_pinecone.public_address
+    monkeypatch.setattr(query_pinecone, 'public_address',
+                        lambda address: address == ipaddress.ip_address('127.0.0.1') or public_address(address))
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_redirects_are_checked_at_every_hop(redirecting_server):
+    assert fetch_image_url(f"{redirecting_server}/photo.jpg") == b'JPEG'
+    with pytest.raises(ValueError, match="non-public"):
+        fetch_image_url(f"{redirecting_server}/moved.jpg")
+
+
+def test_api_search_reports_a_refused_url_per_image():
+    from app import app
+
+    response = app.test_client().post('/api/search', json={'images': [{'url': 'http://127.0.0.1/photo.jpg',
+                                                                        'name': 'local'}]})
+
+    assert response.status_code == 200
+    image = response.get_json()['images'][0]
+    assert image['name'] == 'local'
+    assert 'non-public' in image['error']
+    assert 'results' not in image
@@ -0,0 +1,40 @@
+"""
+Sharded fan-out with a shard that stops answering.
+"""
+import threading
+
+import shards
+from config import Config
+from shards import ShardedStore
+
+
+class StandInShard:
+    """Answers with one match, or blocks until released when stuck."""
+
+    def __init__(self, address, stuck=False):
+        self.address = address
+        self.release = threading.Event()
+        if not stuck:
+            self.release.set()
+        self.timeouts = []
+
+    def query(self, vector, top_k, include_metadata=True, timings=None, timeout=None):
+        self.timeouts.append(timeout)
+        self.release.wait()
+        return {'matches': [{'id': self.address, 'score': 0.5, 'metadata': {'address': self.address}}]}
+
+
+def test_stuck_shard_does_not_hold_up_the_others(monkeypatch):
+    monkeypatch.setattr(Config, 'SHARD_WORKERS', 1)
+    monkeypatch.setattr(shards, '_executors', {})
+    stuck, healthy = StandInShard('stuck', stuck=True), StandInShard('healthy')
+    store = ShardedStore({'stuck': stuck, 'healthy': healthy}, timeout_ms=50)
+    try:
+        # The stuck shard's thread stays busy, yet later queries still reach the healthy shard
+        for _ in range(3):
+            response = store.query([0.0], top_k=5)
+            assert response['failed_shards'] == ['stuck']
+            assert [m['id'] for m in response['matches']] == ['healthy']
+        assert healthy.timeouts == [0.05] * 3
+    finally:
+        stuck.release.set()
@@ -0,0 +1,148 @@
+"""
+Grouped search over the local store and the Pinecone stand-in, and local store versions.
+"""
+import time
+
+import numpy as np
+import pytest
+
+import vector_store
+from config import Config
+from local_pinecone import LocalPineconeServer, synthetic_index
+from pinecone_pool import IndexManager
+from vector_store import (LocalStore, PineconeStore, build_ivf, rollback_local_store, update_local_store,
+                          write_local_store)
+
+DIMENSION = 16
+
+
+def clustered_store(directory, monkeypatch, clusters=4, per_cluster=10):
+    # Tight clusters around the axes, one address per vector and one IVF list per cluster
+    rng = np.random.default_rng(0)
+    vectors = np.concatenate([np.eye(DIMENSION)[c] + 0.05 * rng.standard_normal((per_cluster, DIMENSION))
+                              for c in range(clusters)])
+    ids = [f"id{i}" for i in range(len(vectors))]
+    write_local_store(directory, ids, vectors, [f"{i} rue A" for i in range(len(vectors))])
+    monkeypatch.setattr(vector_store, 'train_ivf',
+                        lambda vectors, nlist, iterations: np.eye(DIMENSION, dtype=np.float32)[:nlist])
+    build_ivf(directory, nlist=clusters)
+    return ids
+
+
+def test_grouped_search_ignores_deleted_rows(tmp_path, monkeypatch):
+    root = str(tmp_path / 'index')
+    ids = clustered_store(root, monkeypatch)
+    # Leave two live addresses in the first cluster
+    update_local_store(root, remove=ids[:8])
+    store = LocalStore(root, mode='ivf', nprobe=1)
+
+    indices, scores = store.search_grouped(np.eye(DIMENSION)[0], top_k=5)
+
+    # The probed list has only two live addresses, so the search goes exact
+    assert len(indices) == 5
+    assert np.isfinite(scores).all()
+    assert not set(store._take(store.ids, store.delta_ids, indices)) & set(ids[:8])
+
+
+def test_counts_leave_out_deleted_addresses(tmp_path, monkeypatch):
+    root = str(tmp_path / 'index')
+    ids = clustered_store(root, monkeypatch)
+    update_local_store(root, remove=ids[:8])
+    store = LocalStore(root)
+
+    assert store.count() == 32
+    assert store.address_count() == 32
+    assert len(store.addresses) == 40
+
+
+def test_pinecone_grouped_query_fetches_more_until_top_k_addresses():
+    server = LocalPineconeServer(*synthetic_index(400, 40)).start()
+    try:
+        store = PineconeStore(manager=IndexManager(api_key='local', host=server.url))
+        response = store.query_grouped(server.vectors[0].tolist(), top_k=30, max_results=10)
+
+        addresses = [m['metadata']['address'] for m in response['matches']]
+        assert len(addresses) == len(set(addresses)) == 30
+        assert server.query_count > 1
+    finally:
+        server.stop()
+
+
+def small_store(root):
+    vectors = np.eye(4, DIMENSION)
+    write_local_store(root, ['id0', 'id1', 'id2', 'id3'], vectors, ['0 rue A', '1 rue A', '2 rue A', '3 rue A'])
+    return vectors
+
+
+def current(root):
+    with open(f"{root}/CURRENT") as f:
+        return f.read()
+
+
+def test_updates_publish_new_versions_and_keep_two(tmp_path):
+    root = str(tmp_path / 'index')
+    vectors = small_store(root)
+    store = LocalStore(root)
+
+    assert update_local_store(root, remove=['id3']) == 1
+    assert update_local_store(root, ['id4'], vectors[:1], ['4 rue A']) == 2
+    assert update_local_store(root, remove=['id0']) == 3
+
+    assert current(root) == 'v000003'
+    assert vector_store._versions(root) == [2, 3]
+    reloaded = store.reloaded()
+    assert reloaded is not store and reloaded.version == 3
+    assert reloaded.reloaded() is reloaded
+    assert sorted(map(str, reloaded._take(reloaded.ids, reloaded.delta_ids, reloaded.search(vectors[0], 10)[0]))) == \
+        ['id1', 'id2', 'id4']
+
+
+def test_failed_build_leaves_current_alone(tmp_path):
+    root = str(tmp_path / 'index')
+    small_store(root)
+    update_local_store(root, remove=['id3'])
+
+    def build(directory):
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        vector_store._publish_version(root, build)
+    assert current(root) == 'v000001'
+    assert LocalStore(root).count() == 3
+
+
+def test_rollback_restores_the_previous_version(tmp_path):
+    root = str(tmp_path / 'index')
+    small_store(root)
+    update_local_store(root, remove=['id1'])
+    update_local_store(root, remove=['id3'])
+
+    assert rollback_local_store(root) == 1
+    assert LocalStore(root).count() == 3
+    with pytest.raises(ValueError):
+        rollback_local_store(root)
+
+    # The next update starts from the rolled-back version, under a new number
+    assert update_local_store(root, remove=['id2']) == 3
+    store = LocalStore(root)
+    assert store.version == 3 and store.count() == 2
+
+
+def test_workers_switch_versions_without_stale_cached_results(tmp_path, monkeypatch):
+    import query_pinecone
+
+    root = str(tmp_path / 'index')
+    vectors = small_store(root)
+    monkeypatch.setattr(Config, 'VECTOR_STORE', 'local')
+    monkeypatch.setattr(Config, 'LOCAL_INDEX_DIR', root)
+    monkeypatch.setattr(Config, 'LOCAL_INDEX_RELOAD_SECONDS', 0.001)
+    monkeypatch.setattr(vector_store, '_store', None)
+    query = (vectors[3] + 0.01).tolist()
+
+    assert query_pinecone.search_vector(query, top_k=2)[0]['address'] == '3 rue A'
+    update_local_store(root, remove=['id3'])
+    time.sleep(0.01)
+    results = query_pinecone.search_vector(query, top_k=2)
+
+    assert vector_store.get_vector_store().version == 1
+    assert '3 rue A' not in [r['address'] for r in results]
@@ -0,0 +1,887 @@
+"""
+Vector stores behind query_image_unique_addresses.
+
+PineconeStore queries the hosted index through the shared handle in
+pinecone_pool. LocalStore searches vectors memory-mapped from local files,
+either exactly with one matrix product or through an IVF index whose
+`nprobe` trades recall for latency.
+
+With product quantization (build-pq), each vector is also stored as m
+one-byte codes. Queries score the codes through a per-query lookup table
+(asymmetric distance computation) and re-score only the best few hundred
+with the full vectors, so the fp32 matrix stays on disk except for the
+short list's rows.
+
+Local store layout (one directory):
+    vectors.npy       float32 (n, d), L2-normalised rows
+    ids.npy           (n,) vector IDs
+    address_ids.npy   (n,) int32 position of each vector's address in addresses.json
+    addresses.json    address string table
+    ivf_centroids.npy (nlist, d) IVF centroids             } optional, written
+    ivf_order.npy     (n,) vector indices grouped by list  } by build-ivf
+    ivf_offsets.npy   (nlist + 1,) start of each list      }
+    pq_codebooks.npy  (m, 256, d / m) sub-vector centroids } optional, written
+    pq_codes.npy      (m, n) uint8 codes, one row per byte } by build-pq
+
+Incremental updates (update_local_store) make the directory versioned: a
+CURRENT file names the live version sub-directory (v000001, ...), which
+hard-links the base files above and adds
+    delta_vectors.npy, delta_ids.npy, delta_address_ids.npy
+                      vectors added since the base was built, searched exactly
+    deleted.npy       (k,) base rows removed or replaced (tombstones)
+    version.json      version number and creation time
+Workers poll CURRENT and switch to a new version between queries; rollback
+points CURRENT back at the previous kept version.
+"""
+import argparse
+import json
+import mmap
+import os
+import re
+import threading
+import time
+
+import numpy as np
+from config import Config
+from pinecone_pool import index_manager
+from postprocess import Matches
+from shards import ShardedStore, configured_shards
+
+
+# Pinecone's largest top_k for queries that return metadata
+PINECONE_MAX_TOP_K = 1000
+
+
+def best_per_address(matches, top_k):
+    """First (best) match of each address, for matches sorted best first."""
+    seen = set()
+    best = []
+    for match in matches:
+        address = (match.get('metadata') or {}).get('address')
+        if address and address not in seen:
+            seen.add(address)
+            best.append(match)
+            if len(best) >= top_k:
+                break
+    return best
+
+
+class PineconeStore:
+    """Hosted Pinecone index, queried through the process-wide pooled handle."""
+
+    name = 'pinecone'
+    version = None
+
+    def __init__(self, manager=None, namespace=None):
+        self.manager = manager or index_manager
+        self.namespace = namespace
+
+    def query(self, vector, top_k, include_metadata=True, timings=None, timeout=None):
+        """Pinecone query; fills 'pinecone_connect' and 'pinecone_query' in timings."""
+        kwargs = {'namespace': self.namespace} if self.namespace else {}
+        return self.manager.query(vector=vector, top_k=top_k, include_metadata=include_metadata,
+                                  timings=timings, timeout=timeout, **kwargs)
+
+    def query_grouped(self, vector, top_k, max_results=50, timings=None, timeout=None):
+        """
+        Best match for each of the top_k addresses.
+
+        Starts with max_results matches and re-queries with a larger top_k
+        until top_k distinct addresses are found or the index has no more
+        matches, so the list is only short when the index itself is.
+
+        Args:
+            vector: Query embedding
+            top_k: Number of distinct addresses wanted
+            max_results: Matches fetched by the first query (default: 50)
+            timings: Optional dict; query time is summed over all rounds
+            timeout: Seconds for all rounds together (default: the manager's per request)
+
+        Returns:
+            Pinecone-style response with at most one match per address, best first
+        """
+        fetch = max_results
+        total = {}
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            step = {}
+            remaining = max(deadline - time.monotonic(), 0.001) if deadline else None
+            matches = self.query(vector, fetch, include_metadata=True, timings=step, timeout=remaining)['matches']
+            for stage, seconds in step.items():
+                total[stage] = total.get(stage, 0.0) + seconds
+            best = best_per_address(matches, top_k)
+            if (len(best) >= top_k or len(matches) < fetch or fetch >= PINECONE_MAX_TOP_K
+                    or (deadline and time.monotonic() >= deadline)):
+                break
+            fetch = min(fetch * 4, PINECONE_MAX_TOP_K)
+        if timings is not None:
+            timings.update(total)
+        return {'matches': best}
+
+    def count(self):
+        index, _ = self.manager.get_index()
+        stats = index.describe_index_stats()
+        if self.namespace:
+            namespace = stats.namespaces.get(self.namespace)
+            return namespace.vector_count if namespace else 0
+        return stats.total_vector_count
+
+
+class LocalStore:
+    """
+    Vectors and address metadata memory-mapped from a local directory.
+
+    Pages are shared between all worker processes through the OS page cache,
+    so opening the store costs no copy and almost no time.
+
+    Args:
+        directory: Store directory (see module docstring for the layout)
+        mode: 'exact' for brute-force search, 'ivf' for the IVF index, 'pq'
+              for product-quantized codes, or 'auto' to use IVF and PQ when
+              they have been built (default: 'auto')
+        nprobe: IVF lists scanned per query; higher is slower but closer to
+                exact (default: 16)
+        rescore: Best PQ candidates re-scored with the full vectors (default: 512)
+    """
+
+    name = 'local'
+
+    def __init__(self, directory, mode='auto', nprobe=16, rescore=512):
+        self.root = directory
+        self.directory, self.version = resolve_store_dir(directory)
+        directory = self.directory
+        self.mode = mode
+        self.nprobe = nprobe
+        self.rescore = rescore
+        self.vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r')
+        self.ids = np.load(os.path.join(directory, 'ids.npy'), mmap_mode='r')
+        self.address_ids = np.load(os.path.join(directory, 'address_ids.npy'), mmap_mode='r')
+        with open(os.path.join(directory, 'addresses.json'), encoding='utf-8') as f:
+            self.addresses = json.load(f)
+
+        # Rows added and removed since the base was built
+        self.delta_vectors = self.delta_ids = self.delta_address_ids = None
+        self.deleted = np.empty(0, dtype=np.int64)
+        self._address_count = None
+        if os.path.exists(os.path.join(directory, 'delta_ids.npy')):
+            self.delta_vectors = np.load(os.path.join(directory, 'delta_vectors.npy'))
+            self.delta_ids = np.load(os.path.join(directory, 'delta_ids.npy'))
+            self.delta_address_ids = np.load(os.path.join(directory, 'delta_address_ids.npy'))
+        if os.path.exists(os.path.join(directory, 'deleted.npy')):
+            self.deleted = np.load(os.path.join(directory, 'deleted.npy'))
+
+        self.centroids = None
+        centroids_path = os.path.join(directory, 'ivf_centroids.npy')
+        if mode == 'ivf' or (mode == 'auto' and os.path.exists(centroids_path)):
+            self.centroids = np.load(centroids_path)
+            self.ivf_order = np.load(os.path.join(directory, 'ivf_order.npy'), mmap_mode='r')
+            self.ivf_offsets = np.load(os.path.join(directory, 'ivf_offsets.npy'))
+
+        self.pq_codebooks = None
+        codebooks_path = os.path.join(directory, 'pq_codebooks.npy')
+        if mode == 'pq' or (mode == 'auto' and os.path.exists(codebooks_path)):
+            self.pq_codebooks = np.load(codebooks_path)
+            self.pq_codes = np.load(os.path.join(directory, 'pq_codes.npy'), mmap_mode='r')
+            # Re-scoring reads scattered rows: map only the pages it touches
+            # instead of faulting in their neighbours
+            if hasattr(mmap, 'MADV_RANDOM'):
+                self.vectors._mmap.madvise(mmap.MADV_RANDOM)
+
+    def count(self):
+        """Live vectors: base rows not deleted, plus added rows."""
+        added = len(self.delta_ids) if self.delta_ids is not None else 0
+        return len(self.ids) - len(self.deleted) + added
+
+    def address_count(self):
+        """Addresses with at least one live vector, counted once per version."""
+        if self._address_count is None:
+            live = np.ones(len(self.ids), dtype=bool)
+            live[self.deleted] = False
+            address_ids = np.asarray(self.address_ids)[live]
+            if self.delta_address_ids is not None:
+                address_ids = np.concatenate([address_ids, self.delta_address_ids])
+            self._address_count = len(np.unique(address_ids))
+        return self._address_count
+
+    def reloaded(self):
+        """This store, or the store's newer version if CURRENT has moved on."""
+        if resolve_store_dir(self.root)[0] == self.directory:
+            return self
+        return LocalStore(self.root, mode=self.mode, nprobe=self.nprobe, rescore=self.rescore)
+
+    def _take(self, base, delta, indices):
+        # Row indices past the base refer to the added rows
+        indices = np.asarray(indices)
+        if delta is None:
+            return base[indices]
+        in_base = indices < len(base)
+        values = np.empty(len(indices), dtype=np.result_type(base.dtype, delta.dtype))
+        values[in_base] = base[indices[in_base]]
+        values[~in_base] = delta[indices[~in_base] - len(base)]
+        return values
+
+    def _adc_scores(self, query, candidates=None):
+        # Inner products of the query with every sub-vector centroid, then one
+        # table lookup per code byte instead of a 768-d dot product per vector
+        m, _, dsub = self.pq_codebooks.shape
+        table = np.einsum('mkd,md->mk', self.pq_codebooks, query.reshape(m, dsub))
+        codes = self.pq_codes if candidates is None else self.pq_codes[:, candidates]
+        scores = np.zeros(codes.shape[1], dtype=np.float32)
+        for j in range(m):
+            scores += table[j].take(codes[j])
+        return scores
+
+    def _candidates(self, query, nprobe):
+        nprobe = min(nprobe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        candidates = np.concatenate([self.ivf_order[self.ivf_offsets[l]:self.ivf_offsets[l + 1]] for l in lists])
+        # Sorted indices read the memory map front to back
+        candidates.sort()
+        return candidates
+
+    def _score(self, vector, nprobe=None, exact=False, shortlist=0):
+        # Returns (candidate indices or None for all vectors, cosine scores)
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        candidates = None
+        if self.centroids is not None and not exact:
+            candidates = self._candidates(query, nprobe or self.nprobe)
+        if self.pq_codebooks is not None and not exact:
+            approximate = self._adc_scores(query, candidates)
+            shortlist = max(shortlist, self.rescore)
+            if shortlist < len(approximate):
+                # Only the short list is re-scored exactly, in file order
+                best = np.sort(np.argpartition(-approximate, shortlist - 1)[:shortlist])
+                candidates = candidates[best] if candidates is not None else best
+        scores = self.vectors[candidates] @ query if candidates is not None else self.vectors @ query
+        if len(self.deleted):
+            if candidates is None:
+                scores[self.deleted] = -np.inf
+            else:
+                scores[np.isin(candidates, self.deleted, assume_unique=True)] = -np.inf
+        if self.delta_vectors is not None and len(self.delta_vectors):
+            # Added rows are few and always searched exactly
+            added = np.arange(len(self.ids), len(self.ids) + len(self.delta_vectors))
+            if candidates is not None:
+                candidates = np.concatenate([candidates, added])
+            scores = np.concatenate([scores, self.delta_vectors @ query])
+        return candidates, scores
+
+    def search(self, vector, top_k, nprobe=None, exact=False):
+        """
+        Find the vectors most similar to a query.
+
+        Args:
+            vector: Query embedding
+            top_k: Number of neighbours to return
+            nprobe: IVF lists to scan (default: the store's nprobe)
+            exact: Force brute-force search even when IVF is available
+
+        Returns:
+            Tuple (indices, scores) as arrays, best first; scores are cosine similarities
+        """
+        candidates, scores = self._score(vector, nprobe, exact, shortlist=top_k)
+        top_k = min(top_k, len(scores))
+        if top_k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        # Deleted rows score -inf
+        best = best[np.isfinite(scores[best])]
+        indices = candidates[best] if candidates is not None else best
+        return indices, scores[best]
+
+    def search_grouped(self, vector, top_k, nprobe=None, exact=False):
+        """
+        Best vector for each of the top_k best-matching addresses.
+
+        Grouping runs on the integer address IDs, so no address strings are
+        touched until the final top_k, and scores are exact cosines even with
+        PQ. If the IVF or PQ candidates cover fewer than top_k addresses the
+        search falls back to exact.
+
+        Returns:
+            Tuple (indices, scores) as arrays, one per address, best first
+        """
+        candidates, scores = self._score(vector, nprobe, exact, shortlist=top_k * 16)
+        fetch = min(len(scores), top_k * 16)
+        while True:
+            best = np.argpartition(-scores, fetch - 1)[:fetch] if fetch < len(scores) else np.arange(len(scores))
+            best = best[np.argsort(-scores[best], kind='stable')]
+            # Deleted rows score -inf and must not count as addresses found
+            best = best[np.isfinite(scores[best])]
+            indices = candidates[best] if candidates is not None else best
+            _, first = np.unique(self._take(self.address_ids, self.delta_address_ids, indices), return_index=True)
+            if len(first) >= top_k or fetch >= len(scores):
+                break
+            fetch = min(len(scores), fetch * 4)
+        if len(first) < top_k and candidates is not None and self.address_count() > len(first):
+            return self.search_grouped(vector, top_k, exact=True)
+        first = np.sort(first)[:top_k]
+        return indices[first], scores[best[first]]
+
+    def _matches(self, indices, scores, include_metadata=True):
+        ids = self._take(self.ids, self.delta_ids, indices)
+        address_ids = self._take(self.address_ids, self.delta_address_ids, indices)
+        matches = []
+        for vector_id, address_id, score in zip(ids, address_ids, scores):
+            match = {'id': str(vector_id), 'score': float(score)}
+            if include_metadata:
+                match['metadata'] = {'address': self.addresses[address_id]}
+            matches.append(match)
+        return matches
+
+    def query(self, vector, top_k, include_metadata=True, timings=None, timeout=None):
+        """
+        Search and return a Pinecone-style response; fills 'vector_search' in timings.
+        timeout is accepted for the PineconeStore interface: a local search has no request to time out.
+        """
+        start = time.perf_counter()
+        indices, scores = self.search(vector, top_k)
+        matches = self._matches(indices, scores, include_metadata)
+        if timings is not None:
+            timings['vector_search'] = time.perf_counter() - start
+        return {'matches': matches}
+
+    def query_arrays(self, vector, top_k, grouped=False, timings=None):
+        """
+        Like query, or query_grouped with grouped=True, but without building a dict per match.
+
+        Returns:
+            postprocess.Matches keyed by address ID
+        """
+        start = time.perf_counter()
+        indices, scores = self.search_grouped(vector, top_k) if grouped else self.search(vector, top_k)
+        matches = Matches(self._take(self.ids, self.delta_ids, indices), scores,
+                          self._take(self.address_ids, self.delta_address_ids, indices), self.addresses)
+        if timings is not None:
+            timings['vector_search'] = time.perf_counter() - start
+        return matches
+
+    def query_grouped(self, vector, top_k, max_results=50, timings=None, timeout=None):
+        """Best match for each of the top_k addresses; max_results and timeout are not needed locally."""
+        start = time.perf_counter()
+        indices, scores = self.search_grouped(vector, top_k)
+        matches = self._matches(indices, scores)
+        if timings is not None:
+            timings['vector_search'] = time.perf_counter() - start
+        return {'matches': matches}
+
+
+def _save(directory, name, array):
+    # Write then rename, so a reader never maps a half-written file
+    path = os.path.join(directory, name)
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def write_local_store(directory, ids, vectors, addresses):
+    """
+    Write vectors and their addresses in the LocalStore layout.
+
+    Args:
+        directory: Output directory, created if needed
+        ids: Vector IDs
+        vectors: Array-like of shape (n, d); rows are L2-normalised on write
+        addresses: Address string for each vector
+    """
+    os.makedirs(directory, exist_ok=True)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    table = {}
+    address_ids = np.array([table.setdefault(a, len(table)) for a in addresses], dtype=np.int32)
+    _save(directory, 'vectors.npy', vectors / norms)
+    _save(directory, 'ids.npy', np.asarray(ids, dtype=str))
+    _save(directory, 'address_ids.npy', address_ids)
+    with open(os.path.join(directory, 'addresses.json.tmp'), 'w', encoding='utf-8') as f:
+        json.dump(list(table), f, ensure_ascii=False)
+    os.replace(os.path.join(directory, 'addresses.json.tmp'), os.path.join(directory, 'addresses.json'))
+
+
+# --- Versions and incremental updates ---
+# Files shared unchanged between versions through hard links
+BASE_FILES = ('vectors.npy', 'ids.npy', 'address_ids.npy', 'ivf_centroids.npy', 'ivf_order.npy',
+              'ivf_offsets.npy', 'pq_codebooks.npy', 'pq_codes.npy')
+
+
+def resolve_store_dir(directory):
+    """
+    Directory holding the live version of a local store.
+
+    Returns:
+        Tuple (path, version number); version 0 for an unversioned store
+    """
+    try:
+        with open(os.path.join(directory, 'CURRENT'), encoding='utf-8') as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return directory, 0
+    return os.path.join(directory, name), int(name.lstrip('v'))
+
+
+def _write_json(path, value):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(value, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+
+def _versions(root):
+    # Numbers of the complete version directories, oldest first
+    return sorted(int(d[1:]) for d in os.listdir(root) if re.fullmatch(r'v\d{6}', d))
+
+
+def _set_current(root, version):
+    # Atomic rename: readers see the old name or the new one, never a partial file
+    with open(os.path.join(root, 'CURRENT.tmp'), 'w', encoding='utf-8') as f:
+        f.write(f"v{version:06d}")
+    os.replace(os.path.join(root, 'CURRENT.tmp'), os.path.join(root, 'CURRENT'))
+
+
+def _publish_version(root, build, keep=2):
+    """
+    Create the next version directory with build(path) and make it current.
+
+    The directory is filled under a temporary name, renamed into place, and
+    only then named in CURRENT, so readers see either version in full.
+    Versions before the last `keep` are removed; workers that still map
+    their files keep reading them until they switch. A build that fails
+    leaves CURRENT as it was.
+
+    Returns:
+        The new version number
+    """
+    import shutil
+
+    # Past any version rolled back from, so no directory is reused
+    version = max([resolve_store_dir(root)[1]] + _versions(root)) + 1
+    name = f"v{version:06d}"
+    tmp_dir = os.path.join(root, name + '.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    build(tmp_dir)
+    _write_json(os.path.join(tmp_dir, 'version.json'),
+                {'version': version, 'created': time.strftime('%Y-%m-%dT%H:%M:%S')})
+    os.rename(tmp_dir, os.path.join(root, name))
+    _set_current(root, version)
+
+    for old in _versions(root)[:-keep]:
+        shutil.rmtree(os.path.join(root, f"v{old:06d}"), ignore_errors=True)
+    return version
+
+
+def rollback_local_store(root):
+    """
+    Make the newest kept version before the current one live again, e.g.
+    after a bad update. Workers switch back as they do to a new version.
+
+    Returns:
+        The version now current
+    """
+    _, version = resolve_store_dir(root)
+    earlier = [v for v in _versions(root) if v < version]
+    if not earlier:
+        raise ValueError(f"No version before v{version:06d} to roll back to in {root}")
+    _set_current(root, earlier[-1])
+    return earlier[-1]
+
+
+def update_local_store(root, ids=(), vectors=None, addresses=(), remove=()):
+    """
+    Add, replace and remove vectors without rebuilding the store.
+
+    The new version hard-links the base files of the current one, so only
+    the added rows, the tombstones and the address table are written.
+    Added rows are searched exactly until `compact` folds them into the base.
+
+    Args:
+        root: Local store directory
+        ids: Vector IDs to add; an ID already in the store replaces it
+        vectors: Array-like of shape (len(ids), d)
+        addresses: Address string for each added vector
+        remove: Vector IDs to delete
+
+    Returns:
+        The new version number
+    """
+    current = LocalStore(root, mode='exact')
+    ids = [str(i) for i in ids]
+    changed = np.asarray(sorted(set(ids) | {str(i) for i in remove}), dtype=str)
+
+    # Tombstone replaced and removed base rows; drop them from the added rows
+    deleted = np.union1d(current.deleted, np.flatnonzero(np.isin(current.ids, changed)))
+    table = list(current.addresses)
+    positions = {address: i for i, address in enumerate(table)}
+    if current.delta_ids is not None:
+        kept = ~np.isin(current.delta_ids, changed)
+        delta_ids = current.delta_ids[kept].tolist()
+        delta_vectors = [current.delta_vectors[kept]]
+        delta_address_ids = current.delta_address_ids[kept].tolist()
+    else:
+        delta_ids, delta_vectors, delta_address_ids = [], [], []
+    if ids:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        delta_vectors.append(vectors / norms)
+        delta_ids.extend(ids)
+        for address in addresses:
+            if address not in positions:
+                positions[address] = len(table)
+                table.append(address)
+            delta_address_ids.append(positions[address])
+    dimension = current.vectors.shape[1]
+
+    def build(directory):
+        for name in BASE_FILES:
+            path = os.path.join(current.directory, name)
+            if os.path.exists(path):
+                os.link(path, os.path.join(directory, name))
+        _write_json(os.path.join(directory, 'addresses.json'), table)
+        np.save(os.path.join(directory, 'delta_vectors.npy'),
+                np.concatenate(delta_vectors) if delta_vectors else np.empty((0, dimension), dtype=np.float32))
+        np.save(os.path.join(directory, 'delta_ids.npy'), np.asarray(delta_ids, dtype=str))
+        np.save(os.path.join(directory, 'delta_address_ids.npy'), np.asarray(delta_address_ids, dtype=np.int32))
+        np.save(os.path.join(directory, 'deleted.npy'), deleted.astype(np.int64))
+
+    return _publish_version(root, build)
+
+
+def compact_local_store(root, ivf=None, pq=None):
+    """
+    Fold added and deleted rows into a new base version.
+
+    Args:
+        root: Local store directory
+        ivf: Rebuild the IVF index (default: if the current version has one)
+        pq: Rebuild the PQ codes (default: if the current version has them)
+
+    Returns:
+        The new version number
+    """
+    current = LocalStore(root, mode='exact')
+    live = np.setdiff1d(np.arange(len(current.ids)), current.deleted)
+    ivf = os.path.exists(os.path.join(current.directory, 'ivf_centroids.npy')) if ivf is None else ivf
+    pq = os.path.exists(os.path.join(current.directory, 'pq_codebooks.npy')) if pq is None else pq
+
+    added = len(current.delta_ids) if current.delta_ids is not None else 0
+    rows = np.concatenate([live, np.arange(len(current.ids), len(current.ids) + added)])
+
+    def build(directory):
+        vectors = np.asarray(current.vectors[live])
+        if added:
+            vectors = np.concatenate([vectors, current.delta_vectors])
+        address_ids = current._take(current.address_ids, current.delta_address_ids, rows)
+        write_local_store(directory, current._take(current.ids, current.delta_ids, rows), vectors,
+                          [current.addresses[i] for i in address_ids])
+        if ivf:
+            build_ivf(directory)
+        if pq:
+            build_pq(directory)
+
+    return _publish_version(root, build)
+
+
+def train_ivf(vectors, nlist, iterations=10, sample_size=100000, seed=0):
+    """
+    Spherical k-means over a sample of the vectors.
+
+    Args:
+        vectors: (n, d) L2-normalised vectors
+        nlist: Number of lists (centroids)
+        iterations: k-means iterations (default: 10)
+        sample_size: Vectors sampled for training (default: 100000)
+        seed: Random seed
+
+    Returns:
+        float32 array of nlist unit-length centroids
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    sample = np.asarray(vectors[np.sort(rng.choice(n, min(n, sample_size), replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = assign_lists(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=nlist)
+        # Re-seed empty lists with random sample points
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True)
+    return centroids.astype(np.float32)
+
+
+def assign_lists(vectors, centroids, chunk_size=65536):
+    """Index of the closest centroid for every vector, computed in chunks."""
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+        assignment[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignment
+
+
+def build_ivf(directory, nlist=None, iterations=10):
+    """
+    Train and write an IVF index for an existing local store.
+
+    Args:
+        directory: Local store directory
+        nlist: Number of lists (default: about 4 * sqrt(n))
+        iterations: k-means iterations (default: 10)
+    """
+    directory, _ = resolve_store_dir(directory)
+    vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r')
+    nlist = nlist or max(1, int(4 * np.sqrt(len(vectors))))
+    centroids = train_ivf(vectors, nlist, iterations)
+    assignment = assign_lists(vectors, centroids)
+    order = np.argsort(assignment, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))])
+    _save(directory, 'ivf_order.npy', order)
+    _save(directory, 'ivf_offsets.npy', offsets)
+    _save(directory, 'ivf_centroids.npy', centroids)
+
+
+def _nearest(vectors, centroids):
+    # Squared Euclidean distance without the constant ||x||^2 term
+    return np.argmin((centroids ** 2).sum(axis=1) - 2 * vectors @ centroids.T, axis=1)
+
+
+def train_pq(vectors, m, ksub=256, iterations=10, sample_size=100000, seed=0):
+    """
+    k-means codebooks for each of the m sub-vectors.
+
+    Args:
+        vectors: (n, d) L2-normalised vectors, d divisible by m
+        m: Number of sub-vectors (bytes per code)
+        ksub: Centroids per sub-vector (default: 256, one byte)
+        iterations: k-means iterations (default: 10)
+        sample_size: Vectors sampled for training (default: 100000)
+        seed: Random seed
+
+    Returns:
+        float32 array of shape (m, ksub, d / m)
+    """
+    rng = np.random.default_rng(seed)
+    n, d = vectors.shape
+    if d % m:
+        raise ValueError(f"Dimension {d} is not divisible by m={m}")
+    sample = np.asarray(vectors[np.sort(rng.choice(n, min(n, sample_size), replace=False))], dtype=np.float32)
+    ksub = min(ksub, len(sample))
+    dsub = d // m
+    codebooks = np.empty((m, ksub, dsub), dtype=np.float32)
+    for j in range(m):
+        sub = sample[:, j * dsub:(j + 1) * dsub]
+        centroids = sub[rng.choice(len(sub), ksub, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = _nearest(sub, centroids)
+            sums = np.stack([np.bincount(assignment, weights=sub[:, k], minlength=ksub) for k in range(dsub)], axis=1)
+            counts = np.bincount(assignment, minlength=ksub)
+            # Re-seed empty centroids with random sample points
+            empty = counts == 0
+            sums[empty] = sub[rng.choice(len(sub), int(empty.sum()))]
+            counts[empty] = 1
+            centroids = sums / counts[:, None]
+        codebooks[j] = centroids
+    return codebooks
+
+
+def encode_pq(vectors, codebooks, chunk_size=65536):
+    """
+    uint8 PQ codes for the vectors, computed in chunks.
+
+    Returns:
+        (m, n) array: byte j of every code is contiguous, so scoring reads one
+        row per sub-vector table
+    """
+    m, _, dsub = codebooks.shape
+    codes = np.empty((m, len(vectors)), dtype=np.uint8)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+        for j in range(m):
+            codes[j, start:start + chunk_size] = _nearest(chunk[:, j * dsub:(j + 1) * dsub], codebooks[j])
+    return codes
+
+
+def build_pq(directory, m=64, iterations=10):
+    """
+    Train and write product-quantization codes for an existing local store.
+
+    Args:
+        directory: Local store directory
+        m: Sub-vectors per vector, i.e. bytes per code (default: 64)
+        iterations: k-means iterations per sub-vector (default: 10)
+    """
+    directory, _ = resolve_store_dir(directory)
+    vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r')
+    codebooks = train_pq(vectors, m, iterations=iterations)
+    _save(directory, 'pq_codes.npy', encode_pq(vectors, codebooks))
+    _save(directory, 'pq_codebooks.npy', codebooks)
+
+
+def export_pinecone(directory, batch_size=100):
+    """Copy every vector and its address from the Pinecone index into a local store."""
+    index, _ = index_manager.get_index()
+    ids, vectors, addresses = [], [], []
+    for page in index.list(limit=batch_size):
+        page_ids = [item.id for item in page.vectors]
+        fetched = index.fetch(ids=page_ids).vectors
+        for vector_id in page_ids:
+            record = fetched.get(vector_id)
+            if record is None:
+                continue
+            ids.append(vector_id)
+            vectors.append(record.values)
+            addresses.append((record.metadata or {}).get('address', ''))
+        print(f"Exported {len(ids)} vectors...")
+    write_local_store(directory, ids, vectors, addresses)
+
+
+_store = None
+_store_lock = threading.Lock()
+_reload_lock = threading.Lock()
+_reload_checked = 0.0
+_info = None
+
+
+def _open_store():
+    if Config.VECTOR_STORE == 'local':
+        def open_shard(directory):
+            return LocalStore(directory, mode=Config.LOCAL_INDEX_MODE, nprobe=Config.LOCAL_INDEX_NPROBE,
+                              rescore=Config.LOCAL_INDEX_RESCORE)
+    elif Config.VECTOR_STORE == 'pinecone':
+        def open_shard(namespace):
+            return PineconeStore(namespace=namespace)
+    else:
+        raise ValueError(f"Unknown VECTOR_STORE {Config.VECTOR_STORE!r}, expected 'pinecone' or 'local'")
+
+    names = configured_shards()
+    if not names:
+        return open_shard(Config.LOCAL_INDEX_DIR if Config.VECTOR_STORE == 'local' else None)
+    if Config.VECTOR_STORE == 'local':
+        return ShardedStore({name: open_shard(os.path.join(Config.LOCAL_INDEX_DIR, name)) for name in names})
+    return ShardedStore({name: open_shard(name) for name in names})
+
+
+def _reload_if_updated():
+    # One thread looks at CURRENT every LOCAL_INDEX_RELOAD_SECONDS; the others
+    # keep querying the store they have. Opening a version only maps its
+    # files, and in-flight queries finish on the old one.
+    global _store, _reload_checked
+    if time.monotonic() - _reload_checked < Config.LOCAL_INDEX_RELOAD_SECONDS:
+        return
+    if not _reload_lock.acquire(blocking=False):
+        return
+    try:
+        _reload_checked = time.monotonic()
+        store = _store.reloaded()
+        if store is not _store:
+            _store = store
+            print(f"Switched to a new local store version ({store.count()} vectors)")
+    except Exception as e:
+        print(f"Local store reload failed, keeping the current version: {e}")
+    finally:
+        _reload_lock.release()
+
+
+def get_vector_store():
+    """
+    Return the store selected by Config.VECTOR_STORE, opened once per process;
+    a ShardedStore over the shards when Config.SHARDS is set.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _open_store()
+    elif Config.VECTOR_STORE == 'local' and Config.LOCAL_INDEX_RELOAD_SECONDS > 0:
+        _reload_if_updated()
+    return _store
+
+
+def get_routed_store(hint=None):
+    """
+    The live store, restricted to the shards named by a location hint.
+
+    Args:
+        hint: Optional shard name, postal code or arrondissement, or several
+              (see ShardedStore.route)
+    """
+    store = get_vector_store()
+    if not hint:
+        return store
+    if not isinstance(store, ShardedStore):
+        raise ValueError("A location hint needs sharded search (set SHARDS)")
+    return store.route(hint)
+
+
+def store_info(ttl=60):
+    """
+    Vector count and version of the live store, for display.
+
+    Pinecone's count costs a request, so it is cached for `ttl` seconds; the
+    local store's is always current.
+
+    Returns:
+        Dict with 'store', 'total_vectors', 'total_addresses' and 'version'
+        (both None for Pinecone)
+    """
+    global _info
+    store = get_vector_store()
+    if Config.VECTOR_STORE == 'local':
+        return {'store': store.name, 'total_vectors': store.count(), 'total_addresses': store.address_count(),
+                'version': store.version}
+    info = _info
+    if info is None or time.monotonic() - info[0] > ttl:
+        info = _info = (time.monotonic(), {'store': store.name, 'total_vectors': store.count(),
+                                           'total_addresses': None, 'version': None})
+    return info[1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the local vector store")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export-pinecone', help="Copy the Pinecone index into a local store")
+    export.add_argument('directory')
+    ivf = commands.add_parser('build-ivf', help="Train the IVF index of a local store")
+    ivf.add_argument('directory')
+    ivf.add_argument('--nlist', type=int)
+    ivf.add_argument('--iterations', type=int, default=10)
+    pq = commands.add_parser('build-pq', help="Train product-quantization codes for a local store")
+    pq.add_argument('directory')
+    pq.add_argument('--m', type=int, default=64, help="Bytes per code; must divide the dimension")
+    pq.add_argument('--iterations', type=int, default=10)
+    remove = commands.add_parser('remove', help="Delete vectors from a local store by ID")
+    remove.add_argument('directory')
+    remove.add_argument('ids', nargs='+')
+    compact = commands.add_parser('compact', help="Fold added and deleted vectors into a new base version")
+    compact.add_argument('directory')
+    rollback = commands.add_parser('rollback', help="Make the previous kept version current again")
+    rollback.add_argument('directory')
+    synthetic = commands.add_parser('synthetic', help="Write a store of random vectors for development")
+    synthetic.add_argument('directory')
+    synthetic.add_argument('--vectors', type=int, default=100000)
+    synthetic.add_argument('--addresses', type=int, default=10000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == 'export-pinecone':
+        export_pinecone(args.directory)
+    elif args.command == 'build-ivf':
+        build_ivf(args.directory, args.nlist, args.iterations)
+    elif args.command == 'build-pq':
+        build_pq(args.directory, args.m, args.iterations)
+    elif args.command == 'remove':
+        print(f"Published version {update_local_store(args.directory, remove=args.ids)}")
+    elif args.command == 'compact':
+        print(f"Published version {compact_local_store(args.directory)}")
+    elif args.command == 'rollback':
+        print(f"Rolled back to version {rollback_local_store(args.directory)}")
+    else:
+        from local_pinecone import synthetic_index
+        ids, vectors, metadata = synthetic_index(args.vectors, args.addresses)
+        write_local_store(args.directory, ids, vectors, [m['address'] for m in metadata])
+    print(f"{args.command} done in {time.perf_counter() - start:.1f}s")